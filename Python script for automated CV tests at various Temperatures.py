@@ -1,45 +1,303 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function 
+import sys
 import time
-
-# import Fluignet package, including Pumps, flow sensors, Valve.
-from Fluigent.SDK import fgt_init, fgt_close
-from Fluigent.SDK import fgt_set_pressure, fgt_set_sensorRegulation, fgt_set_sensorRegulationResponse
-from Fluigent.SDK import fgt_get_sensorValue
-from Fluigent.SDK import fgt_get_valveChannelCount
-from Fluigent.SDK import fgt_get_valvePosition, fgt_set_valvePosition
-fgt_init()
-
-# import EC worksation package
-import hardpotato as hp
+import math
 import os
+import json
+import hashlib
+import types
+import random
+import contextlib
+import importlib
 
-# import water bath package
-import serial
+# The device packages (Fluigent.SDK, hardpotato, serial and mvsdk) are imported by the bring-up of their devices,
+# so that the script also runs on the simulated devices without them
 
-# import camera package
 import threading
-import mvsdk
+import queue
+import ctypes
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
+from collections import namedtuple, deque
 
 
-### Define fuctions ###--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
-# camera control function
-class CameraRecorder:
-    def __init__(self, max_recording_time, save_path):
-        self.max_recording_time = max_recording_time  # Maximum recording time in seconds
-        self.save_path = save_path  # Path where video will be saved
+### Define fuctions ###--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
+# clock functions: all waits and timestamps of the script go through the clock, so that the simulated devices can
+# run on a virtual clock
+class Clock:
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, event, seconds):
+        # sleep that ends early when `event` is set
+        return event.wait(seconds)
+
+    def real_timeout(self, timeout):
+        # timeout of a wait of the threading module (Event.wait, Condition.wait_for) for a failing device
+        return timeout
+
+
+# virtual clock running `speed` times faster than real time, shared by all simulated devices. The virtual time is
+# advanced by a ticker thread, by at most `max_real_step` seconds of real time per step, and it is held at the end
+# of every sleep or wait until the waiting thread has woken up. A process stalled by a loaded CPU then runs slower
+# in virtual time instead of skipping it, so the timeouts of the simulation do not fire because of the load.
+class VirtualClock(Clock):
+    def __init__(self, speed, min_real_timeout=1, max_real_step=0.002):
+        self.speed = speed
+        self.min_real_timeout = min_real_timeout  # s, failure timeouts are never shorter in real time
+        self.max_real_step = max_real_step  # s
+        self.start_time = time.time()
+        self.now = 0.0  # s of virtual time since the start
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)  # wakes the ticker when it has to step to an earlier end or stops holding
+        self.waits = []  # [end time, event or None, condition] of every pending wait
+        self.step_end = 0.0  # virtual time the ticker is stepping to
+        self.holding = False
+        # a thread holding the interpreter for the default 5 ms would delay the ticker by `speed` * 5 ms of virtual time
+        sys.setswitchinterval(1e-4)
+        threading.Thread(target=self._tick_loop, name='virtual clock', daemon=True).start()
+
+    def _tick_loop(self):
+        with self.lock:
+            last_real = time.monotonic()
+            while True:
+                next_end = min((end for end, _, _ in self.waits), default=None)
+                if next_end is not None and next_end <= self.now:
+                    # a waiting thread has not woken up yet: hold the virtual time
+                    self.holding = True
+                    self.changed.wait(self.max_real_step)
+                    self.holding = False
+                    last_real = time.monotonic()
+                    continue
+                real_step = self.max_real_step if next_end is None else min(self.max_real_step, (next_end - self.now) / self.speed)
+                self.step_end = self.now + real_step * self.speed
+                self.changed.wait(real_step)
+                real = time.monotonic()
+                # never step over the end of a wait, including the waits started during this step
+                next_end = min((end for end, _, _ in self.waits), default=float('inf'))
+                self.now = min(self.now + min(real - last_real, self.max_real_step) * self.speed, max(self.now, next_end))
+                last_real = real
+                for end, event, condition in self.waits:
+                    if end <= self.now or (event is not None and event.is_set()):
+                        condition.notify()
+
+    def _wait(self, event, seconds):
+        with self.lock:
+            pending = [self.now + max(0, seconds), event, threading.Condition(self.lock)]
+            self.waits.append(pending)
+            if pending[0] < self.step_end:
+                self.changed.notify()
+            try:
+                while self.now < pending[0] and not (event is not None and event.is_set()):
+                    pending[2].wait()
+            finally:
+                self.waits.remove(pending)
+                if self.holding:
+                    self.changed.notify()
+        return event is not None and event.is_set()
+
+    def time(self):
+        return self.start_time + self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self._wait(None, seconds)
+
+    def wait(self, event, seconds):
+        return event.is_set() or self._wait(event, seconds)
+
+    def real_timeout(self, timeout):
+        return None if timeout is None else max(timeout / self.speed, self.min_real_timeout)
+
+
+# simulation functions
+# simulated Fluigent devices, with the function names of Fluigent.SDK: pressure pumps regulated on their flow
+# sensors with a first-order flow response, and the valves
+class SimulatedFluigent:
+    def __init__(self, n_channels=4, valve_positions=(8, 2), time_constant=3, noise=1, seed=None):
+        self.setpoints = [0.0 for _ in range(n_channels)]  # uL/min
+        self.flow_rates = [0.0 for _ in range(n_channels)]  # uL/min
+        self.valve_positions = list(valve_positions)  # number of positions of every valve
+        self.valves = [0 for _ in valve_positions]
+        self.time_constant = time_constant  # s
+        self.noise = noise  # uL/min
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.last_update = clock.monotonic()
+
+    def _update(self):
+        now = clock.monotonic()
+        decay = math.exp(-(now - self.last_update) / self.time_constant)
+        for channel in range(len(self.flow_rates)):
+            self.flow_rates[channel] = self.setpoints[channel] + (self.flow_rates[channel] - self.setpoints[channel]) * decay
+        self.last_update = now
+
+    def fgt_init(self, instruments=None):
+        print("Simulated Fluigent devices: {} pumps, {} valves".format(len(self.flow_rates), len(self.valves)))
+
+    def fgt_close(self):
+        pass
+
+    def fgt_set_pressure(self, pump, pressure):
+        with self.lock:
+            self._update()
+            self.setpoints[pump] = 0.0  # stops the regulation, treated as no flow
+
+    def fgt_set_sensorRegulation(self, sensor, pump, flow_rate):
+        with self.lock:
+            self._update()
+            self.setpoints[pump] = float(flow_rate)
+
+    def fgt_set_sensorRegulationResponse(self, sensor, response_time):
+        pass
+
+    def fgt_get_sensorValue(self, sensor):
+        with self.lock:
+            self._update()
+            return self.flow_rates[sensor] + self.random.gauss(0, self.noise)
+
+    def fgt_get_valveChannelCount(self):
+        return len(self.valves)
+
+    def fgt_get_valvePosition(self, valve):
+        return self.valves[valve]
+
+    def fgt_set_valvePosition(self, valve, position):
+        if not 0 <= position < self.valve_positions[valve]:
+            raise ValueError("Valve {} has no position {}".format(valve, position))
+        self.valves[valve] = position
+
+
+# write a voltammogram as a CHI text file
+def write_chi_text_file(file_path, title, header, parameters, potentials, currents, scan_time=0, n_chunks=1):
+    # the data points are written in `n_chunks` chunks over `scan_time`, so that the file grows during the scan
+    with open(file_path, 'w') as f:
+        f.write(time.strftime('%b. %d, %Y   %H:%M:%S', time.localtime(clock.time())) + '\n')
+        f.write(title + '\n')
+        f.write('Header: {}\n\n'.format(header))
+        for name, value in parameters:
+            f.write('{} = {}\n'.format(name, value))
+        f.write('\nPotential/V, Current/A\n\n')
+        f.flush()
+        for chunk in np.array_split(np.arange(len(potentials)), n_chunks):
+            clock.sleep(scan_time / n_chunks)
+            for i in chunk:
+                f.write('{:.3f}, {:.4e}\n'.format(potentials[i], currents[i]))
+            f.flush()
+
+
+# simulated potentiostat, with the hp.potentiostat interface of hardpotato. A CV takes its scan time on the clock
+# and writes a synthetic voltammogram during the scan: double layer charging plus a sigmoidal alcohol oxidation wave, scaled by the
+# alcohol concentration in the cell and by an Arrhenius temperature dependence. A surface peak of the fouled electrode
+# decays with every sweep; a new electrode is fouled, and every alcohol measurement fouls it again
+class SimulatedPotentiostat:
+    def __init__(self, fluigent, bath_emulator, folder_path, concentration, fail_after=None, seed=None, return_delay=0):
+        self.fluigent = fluigent
+        self.bath_emulator = bath_emulator
+        self.folder_path = folder_path
+        self.concentration = concentration  # mmol/L, concentration of the concentrated anolytes
+        self.fail_after = fail_after  # number of CVs after which the potentiostat crashes, None to never crash
+        self.n_runs = 0
+        self.fouling = 1.0  # relative height of the surface peak
+        self.fouling_sweeps = 8  # sweeps for the surface peak to decay by a factor e
+        self.random = np.random.RandomState(seed)  # noise of the currents
+        self.return_delay = return_delay  # s, time the CHI software takes to return after the scan
+
+    def Setup(self, model, path, folder):
+        print("Simulated potentiostat {}, data saved to {}".format(model, self.folder_path))
+
+    def CV(self, Eini, Ev1, Ev2, Efin, sr, dE, nSweeps, sens, fileName, header):
+        return SimulatedCV(self, Eini, Ev1, Ev2, Efin, sr, dE, nSweeps, sens, fileName, header)
+
+    def LSV(self, Eini, Efin, sr, dE, sens, fileName, header):
+        # a single sweep from Eini to Efin
+        lsv = SimulatedCV(self, Eini, Efin, Efin, Efin, sr, dE, 1, sens, fileName, header)
+        lsv.title = 'Linear Sweep Voltammetry'
+        return lsv
+
+    def alcohol_current(self, potentials):
+        # the alcohol at valve 1 positions 1 to 6; position 0 is the washing solvent and position 7 is the air
+        valve_position = self.fluigent.fgt_get_valvePosition(0)
+        if not 1 <= valve_position <= 6:
+            return np.zeros_like(potentials)
+        flow_rates = [max(0, self.fluigent.fgt_get_sensorValue(channel)) for channel in (0, 1)]
+        concentration = self.concentration * flow_rates[0] / max(sum(flow_rates), 1e-9)
+        temp = self.bath_emulator.temp
+        activation_energy = 20e3 + 5e3 * valve_position  # J/mol
+        onset_potential = 0.35 + 0.02 * valve_position  # V
+        limiting_current = 2e-7 * concentration * math.exp(-activation_energy / 8.314 * (1 / (temp + 273.15) - 1 / 298.15))  # A
+        return limiting_current / (1 + np.exp(-(potentials - onset_potential) / 0.025))
+
+
+class SimulatedCV:
+    def __init__(self, potentiostat, Eini, Ev1, Ev2, Efin, sr, dE, nSweeps, sens, fileName, header):
+        self.potentiostat = potentiostat
+        self.Eini, self.Ev1, self.Ev2, self.Efin = Eini, Ev1, Ev2, Efin
+        self.sr, self.dE, self.nSweeps, self.sens = sr, dE, nSweeps, sens
+        self.fileName = fileName
+        self.header = header
+        self.title = 'Cyclic Voltammetry'
+
+    def potential_program(self):
+        # sweep segments Eini -> Ev1 -> Ev2 -> Ev1 -> ...
+        vertices = [self.Eini, self.Ev1]
+        for segment in range(1, self.nSweeps):
+            vertices.append(self.Ev2 if segment % 2 == 1 else self.Ev1)
+        potentials = []
+        for start, end in zip(vertices[:-1], vertices[1:]):
+            n = max(1, int(round(abs(end - start) / self.dE)))
+            potentials.append(np.linspace(start, end, n, endpoint=False))
+        potentials.append([vertices[-1]])
+        potentials = np.concatenate(potentials)
+        directions = np.sign(np.diff(potentials, append=potentials[-1]))
+        return potentials, directions
+
+    def run(self):
+        self.potentiostat.n_runs += 1
+        if self.potentiostat.fail_after is not None and self.potentiostat.n_runs > self.potentiostat.fail_after:
+            raise Exception("Simulated potentiostat crash")
+        potentials, directions = self.potential_program()
+        currents = 5e-4 * self.sr * directions + self.potentiostat.alcohol_current(potentials)  # 0.5 mF double layer
+        sweeps = np.cumsum(np.abs(np.diff(directions, prepend=directions[0])) > 0)  # sweep of every data point
+        fouling = self.potentiostat.fouling * np.exp(-sweeps / self.potentiostat.fouling_sweeps)
+        currents += 2e-4 * self.sr * fouling * np.exp(-((potentials - 0.45) / 0.05) ** 2)
+        currents += self.potentiostat.random.normal(0, 1e-9, len(potentials))
+        self.potentiostat.fouling *= math.exp(-self.nSweeps / self.potentiostat.fouling_sweeps)
+        if 1 <= self.potentiostat.fluigent.fgt_get_valvePosition(0) <= 6:
+            self.potentiostat.fouling = min(1.0, self.potentiostat.fouling + 0.3)
+        parameters = [('Init E (V)', self.Eini), ('High E (V)', max(self.Ev1, self.Ev2)), ('Low E (V)', min(self.Ev1, self.Ev2)),
+                      ('Final E (V)', self.Efin), ('Scan Rate (V/s)', self.sr), ('Sample Interval (V)', self.dE),
+                      ('Sweep Segments', self.nSweeps), ('Sensitivity (A/V)', self.sens)]
+        write_chi_text_file(os.path.join(self.potentiostat.folder_path, self.fileName + '.txt'), self.title,
+                            self.header, parameters, potentials, currents,
+                            scan_elapsed_times(potentials, self.sr)[-1], min(self.nSweeps * 20, 100))
+        clock.sleep(self.potentiostat.return_delay)
+
+
+# camera control functions
+# camera backend on the MindVision SDK: opens the camera once, and acquires, processes and encodes frames
+class MvsdkCamera:
+    def __init__(self, camera_index=0):
         # Enumerate cameras
         DevList = mvsdk.CameraEnumerateDevice()
         nDev = len(DevList)
         if nDev < 1:
-            print("No camera was found!")
-            return
+            raise Exception("No camera was found!")
 
-        DevInfo = DevList[0]  # Automatically select the first camera
+        DevInfo = DevList[camera_index]  # the first camera by default
         print(DevInfo)
 
         # Open the camera
@@ -49,7 +307,7 @@ class CameraRecorder:
             mvsdk.CameraSetTriggerMode(self.hCamera, 1)
         except mvsdk.CameraException as e:
             print("CameraInit Failed({}): {}".format(e.error_code, e.message))
-            return
+            raise
 
         cap = mvsdk.CameraGetCapability(self.hCamera)
         monoCamera = (cap.sIspCapacity.bMonoSensor != 0)
@@ -62,52 +320,2449 @@ class CameraRecorder:
 
         mvsdk.CameraPlay(self.hCamera)
 
-        FrameBufferSize = cap.sResolutionRange.iWidthMax * cap.sResolutionRange.iHeightMax * (1 if monoCamera else 3)
-        self.pFrameBuffer = mvsdk.CameraAlignMalloc(FrameBufferSize, 16)
+        self.frame_buffer_size = cap.sResolutionRange.iWidthMax * cap.sResolutionRange.iHeightMax * (1 if monoCamera else 3)
 
-        # Initialize recording with the specified path
-        self.ErrCode = mvsdk.CameraInitRecord(self.hCamera, 4, self.save_path, True, 100, 25)
+    def alloc(self, size):
+        return mvsdk.CameraAlignMalloc(size, 16)
 
-    def start_recording(self):
-        time.sleep(4)
-        if self.ErrCode != 0:
-            print("Failed to initialize recording.")
+    def free(self, buffer):
+        mvsdk.CameraAlignFree(buffer)
+
+    def start_record(self, save_path, frame_rate):
+        return mvsdk.CameraInitRecord(self.hCamera, 4, save_path, True, 100, frame_rate) == 0
+
+    def stop_record(self):
+        mvsdk.CameraStopRecord(self.hCamera)
+
+    def acquire(self, raw_buffer):
+        # copy the raw frame into our buffer, so the SDK buffer is released at once
+        mvsdk.CameraSoftTrigger(self.hCamera)
+        pRawData, FrameHead = mvsdk.CameraGetImageBuffer(self.hCamera, 2000)
+        ctypes.memmove(raw_buffer, pRawData, FrameHead.uBytes)
+        mvsdk.CameraReleaseImageBuffer(self.hCamera, pRawData)
+        return FrameHead
+
+    def process(self, raw_buffer, frame_buffer, FrameHead):
+        mvsdk.CameraImageProcess(self.hCamera, raw_buffer, frame_buffer, FrameHead)
+
+    def encode(self, frame_buffer, FrameHead):
+        mvsdk.CameraPushFrame(self.hCamera, frame_buffer, FrameHead)
+
+    def frame_array(self, frame_buffer, FrameHead):
+        # view of a processed frame as a (height, width, channels) array
+        channels = 1 if FrameHead.uiMediaType == mvsdk.CAMERA_MEDIA_TYPE_MONO8 else 3
+        frame_data = (ctypes.c_ubyte * (FrameHead.iHeight * FrameHead.iWidth * channels)).from_address(frame_buffer)
+        return np.frombuffer(frame_data, dtype=np.uint8).reshape((FrameHead.iHeight, FrameHead.iWidth, channels))
+
+    def close(self):
+        mvsdk.CameraUnInit(self.hCamera)
+
+
+# fake camera backend with fixed latencies of the stages, to benchmark the capture pipeline and to simulate the camera.
+# It produces synthetic frames of the electrode, with `bubble_rate` bubbles per recording on average appearing at random.
+class FakeCamera:
+    def __init__(self, width=2048, height=1536, acquire_time=0.005, process_time=0.015, encode_time=0.02, bubble_rate=0, bubble_time=60, seed=None):
+        self.width = width
+        self.height = height
+        self.frame_buffer_size = width * height * 3
+        self.acquire_time = acquire_time  # s
+        self.process_time = process_time  # s
+        self.encode_time = encode_time  # s
+        self.bubble_rate = bubble_rate
+        self.bubble_time = bubble_time  # s, the bubbles appear within this time after the start of the recording
+        self.random = np.random.RandomState(seed)  # number, size, place and time of the bubbles
+        self.frame_count = 0
+        self.encoded_frames = 0
+        # dark electrode disk in a grey cell
+        yy, xx = np.mgrid[:height, :width]
+        self.background = np.full((height, width, 3), 120, dtype=np.uint8)
+        self.background[(yy - height / 2) ** 2 + (xx - width / 2) ** 2 < (min(height, width) / 3) ** 2] = 60
+        self.bubbles = []  # (appear time in s, row slice, column slice, mask)
+        self.record_start = 0
+        self.video = None
+
+    def alloc(self, size):
+        return bytearray(size)
+
+    def free(self, buffer):
+        pass
+
+    def start_record(self, save_path, frame_rate):
+        self.encoded_frames = 0
+        self.record_start = clock.monotonic()
+        self.video = open(save_path, 'w')  # stand-in for the video file: one line per encoded frame
+        self.bubbles = []
+        for i in range(self.random.poisson(self.bubble_rate)):
+            radius = self.random.randint(3, max(3, min(self.height, self.width) // 20) + 1)
+            row = self.random.randint(radius, self.height - radius)
+            column = self.random.randint(radius, self.width - radius)
+            yy, xx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+            self.bubbles.append((self.random.uniform(0, self.bubble_time), slice(row - radius, row + radius + 1),
+                                 slice(column - radius, column + radius + 1), yy ** 2 + xx ** 2 <= radius ** 2))
+        return True
+
+    def stop_record(self):
+        self.video.close()
+
+    def acquire(self, raw_buffer):
+        clock.sleep(self.acquire_time)
+        self.frame_count += 1
+        return self.frame_count
+
+    def process(self, raw_buffer, frame_buffer, FrameHead):
+        clock.sleep(self.process_time)
+        frame = self.frame_array(frame_buffer, FrameHead)
+        frame[:] = self.background
+        elapsed_time = clock.monotonic() - self.record_start
+        for appear_time, rows, columns, mask in self.bubbles:
+            if appear_time <= elapsed_time:
+                frame[rows, columns][mask] = 220  # bright bubble
+
+    def encode(self, frame_buffer, FrameHead):
+        clock.sleep(self.encode_time)
+        self.encoded_frames += 1
+        self.video.write('frame {}\n'.format(FrameHead))
+
+    def frame_array(self, frame_buffer, FrameHead):
+        return np.frombuffer(frame_buffer, dtype=np.uint8, count=self.frame_buffer_size).reshape((self.height, self.width, 3))
+
+    def close(self):
+        pass
+
+
+# capture pipeline: acquisition is paced at the frame rate and copies raw frames into a fixed pool of buffers,
+# separate workers process and encode them, connected by bounded queues. A frame is dropped when no buffer is
+# free or the acquisition misses its slot, so a slow stage does not shift the timing of the frames after it.
+# The clock.monotonic() acquisition time of every encoded frame is kept, in the order of the frames in the video.
+class CapturePipeline:
+    def __init__(self, camera, buffer_size, pool_size, frame_analyzer=None, analysis_stride=1):
+        self.camera = camera
+        self.frame_analyzer = frame_analyzer  # called with every `analysis_stride`-th processed frame as an array
+        self.analysis_stride = analysis_stride
+        self.slots = [(camera.alloc(buffer_size), camera.alloc(buffer_size)) for _ in range(pool_size)]  # (raw, processed)
+        self.free_slots = queue.Queue()
+        for slot in range(pool_size):
+            self.free_slots.put(slot)
+
+    def run(self, duration, frame_rate, stop_event=None):
+        # records for `duration` seconds, or until `stop_event` is set
+        process_queue = queue.Queue(maxsize=len(self.slots))
+        encode_queue = queue.Queue(maxsize=len(self.slots))
+        stats = {'frames': 0, 'dropped': 0, 'errors': 0, 'acquire': [], 'process': [], 'encode': [], 'total': [], 'frame_times': []}
+
+        def process_worker():
+            frame_index = 0
+            while True:
+                item = process_queue.get()
+                if item is None:
+                    encode_queue.put(None)
+                    return
+                slot, FrameHead, acquired_time = item
+                start_time = clock.monotonic()
+                try:
+                    self.camera.process(self.slots[slot][0], self.slots[slot][1], FrameHead)
+                except Exception as e:
+                    print("Frame processing failed: {}".format(e))
+                    stats['errors'] += 1
+                    self.free_slots.put(slot)
+                    continue
+                stats['process'].append(clock.monotonic() - start_time)
+                if self.frame_analyzer is not None and frame_index % self.analysis_stride == 0:
+                    try:
+                        self.frame_analyzer(self.camera.frame_array(self.slots[slot][1], FrameHead))
+                    except Exception as e:
+                        print("Frame analysis failed: {}".format(e))
+                frame_index += 1
+                encode_queue.put(item)
+
+        def encode_worker():
+            while True:
+                item = encode_queue.get()
+                if item is None:
+                    return
+                slot, FrameHead, acquired_time = item
+                start_time = clock.monotonic()
+                try:
+                    self.camera.encode(self.slots[slot][1], FrameHead)
+                    stats['encode'].append(clock.monotonic() - start_time)
+                    stats['total'].append(clock.monotonic() - acquired_time)
+                    stats['frame_times'].append(acquired_time)
+                    stats['frames'] += 1
+                except Exception as e:
+                    print("Frame encoding failed: {}".format(e))
+                    stats['errors'] += 1
+                self.free_slots.put(slot)
+
+        workers = [threading.Thread(target=process_worker, daemon=True), threading.Thread(target=encode_worker, daemon=True)]
+        for worker in workers:
+            worker.start()
+
+        frame_interval = 1 / frame_rate
+        start_time = next_frame = clock.monotonic()
+        try:
+            while next_frame - start_time < duration:
+                clock.sleep(max(0, next_frame - clock.monotonic()))
+                if stop_event is not None and stop_event.is_set():
+                    break
+                try:
+                    slot = self.free_slots.get_nowait()
+                except queue.Empty:
+                    stats['dropped'] += 1  # processing or encoding is behind
+                else:
+                    acquired_time = clock.monotonic()
+                    try:
+                        FrameHead = self.camera.acquire(self.slots[slot][0])
+                    except Exception as e:
+                        print("Frame acquisition failed: {}".format(e))
+                        self.free_slots.put(slot)
+                        break
+                    stats['acquire'].append(clock.monotonic() - acquired_time)
+                    process_queue.put((slot, FrameHead, acquired_time))
+                next_frame += frame_interval
+                # skip the frame slots missed by a slow acquisition
+                missed = int((clock.monotonic() - next_frame) / frame_interval)
+                if missed > 0:
+                    stats['dropped'] += missed
+                    next_frame += missed * frame_interval
+        finally:
+            process_queue.put(None)
+            for worker in workers:
+                worker.join()
+        return stats
+
+    def close(self):
+        for raw_buffer, frame_buffer in self.slots:
+            self.camera.free(raw_buffer)
+            self.camera.free(frame_buffer)
+
+
+# bubble detector: the first frames recorded after a wash or a bubble purge are the background, kept for all the
+# recordings of a point so that bubbles trapped in an earlier recording are still detected. In the later frames, the
+# pixels of the electrode region (roi) differing from the background by more than `threshold` grey levels are bubble
+# candidates, single pixels are removed by an opening, and the covered fraction of the region is the bubble coverage.
+# The bubble score of a measurement is the mean coverage of its last `score_frames` analysed frames.
+class BubbleDetector:
+    def __init__(self, roi, threshold, background_frames, score_frames):
+        self.roi = roi  # (top, bottom, left, right) in pixels, None for the whole frame
+        self.threshold = threshold  # grey levels
+        self.background_frames = background_frames
+        self.score_frames = score_frames
+        self.reset_background()
+        self.reset()
+
+    def reset(self):
+        # a new recording: the score restarts, the background is kept
+        self.coverages = deque(maxlen=self.score_frames)
+
+    def reset_background(self):
+        # the cell was washed or purged: the background is learned again from the next frames
+        self.background = None
+        self.background_count = 0
+
+    def __call__(self, frame):
+        if self.roi is not None:
+            top, bottom, left, right = self.roi
+            frame = frame[top:bottom, left:right]
+        gray = frame.mean(axis=2, dtype=np.float32)
+
+        if self.background_count < self.background_frames:
+            # running mean of the background frames
+            if self.background is None:
+                self.background = gray
+            else:
+                self.background += (gray - self.background) / (self.background_count + 1)
+            self.background_count += 1
             return
 
-        start_time = time.time()  # Get the start time
+        mask = np.abs(gray - self.background) > self.threshold
+        # opening with a 3x3 cross: erosion, then dilation
+        eroded = np.zeros_like(mask)
+        eroded[1:-1, 1:-1] = mask[1:-1, 1:-1] & mask[:-2, 1:-1] & mask[2:, 1:-1] & mask[1:-1, :-2] & mask[1:-1, 2:]
+        opened = eroded.copy()
+        opened[1:, :] |= eroded[:-1, :]
+        opened[:-1, :] |= eroded[1:, :]
+        opened[:, 1:] |= eroded[:, :-1]
+        opened[:, :-1] |= eroded[:, 1:]
+        self.coverages.append(float(opened.mean()))
+
+    def score(self):
+        return sum(self.coverages) / len(self.coverages) if self.coverages else 0.0
+
+
+# number of air columns for the bubble removal: none below the bubble score threshold, more for heavy bubbling
+def bubble_purge_air_columns(score):
+    if score is None:
+        return 1  # no bubble detection, always remove bubbles
+    if score < bubble_score_threshold:
+        return 0
+    if score < bubble_score_heavy:
+        return 1
+    return 2
+
+
+# camera session: the camera is opened and the frame buffers are allocated once per campaign,
+# only the recording is started and stopped for every measurement
+class CameraSession:
+    def __init__(self, camera, frame_rate, pool_size, frame_analyzer=None, analysis_stride=1):
+        self.camera = camera  # MvsdkCamera or FakeCamera
+        self.frame_rate = frame_rate
+        self.frame_analyzer = frame_analyzer
+        self.pipeline = CapturePipeline(camera, camera.frame_buffer_size, pool_size, frame_analyzer, analysis_stride)
+
+    def record(self, save_path, max_recording_time, stop_event=None):
+        # records until `stop_event` is set, at most `max_recording_time` seconds
+        if not self.camera.start_record(save_path, self.frame_rate):
+            print("Failed to initialize recording.")
+            return None
+
+        if self.frame_analyzer is not None:
+            self.frame_analyzer.reset()
         print("Recording started...")
+        try:
+            stats = self.pipeline.run(max_recording_time, self.frame_rate, stop_event)
+        finally:
+            # Stop the recording, the camera stays open for the next measurement
+            self.camera.stop_record()
+
+        print("Recording finished: {} frames, {} dropped, {} errors".format(stats['frames'], stats['dropped'], stats['errors']))
+        for stage in ('acquire', 'process', 'encode', 'total'):
+            if stats[stage]:
+                print("  {:<8s} latency: mean {:.1f} ms, max {:.1f} ms".format(
+                    stage, sum(stats[stage]) / len(stats[stage]) * 1000, max(stats[stage]) * 1000))
+        return stats
+
+    def close(self):
+        print("Cleaning up camera resources...")
+        self.pipeline.close()
+        self.camera.close()
+
+
+# time (s) of every data point of a scan since its first point: the points follow the potential program at the scan rate `sr`
+def scan_elapsed_times(potentials, sr):
+    return np.concatenate(([0], np.cumsum(np.abs(np.diff(potentials))))) / sr
+
+
+# clock.monotonic() time of the first data point of a scan, from observations (time, number of points) of its data file.
+# The potentiostat is assumed to write the points as it takes them, so the last point seen at an observation was taken
+# at the latest then, and the earliest of these bounds is the start. The watcher of the file sees the first points
+# within its poll interval; without it, only the return of the potentiostat is left, which is late by the time the CHI
+# software takes after the scan
+def scan_start_time(potentials, sr, observations):
+    elapsed_times = scan_elapsed_times(potentials, sr)
+    return min(t - elapsed_times[n - 1] for t, n in observations if n > 0)
+
+
+# clock.monotonic() time of every data point of a scan that started at `start_time`
+def scan_point_times(potentials, sr, start_time):
+    return start_time + scan_elapsed_times(potentials, sr)
+
+
+# frame-to-potential index of a video: the applied potential and the measured current at the acquisition time of every
+# frame, interpolated from the scans recorded during the video and NaN between them; scans: (point times, potentials, currents)
+def frame_potential_index(frame_times, scans):
+    frame_times = np.asarray(frame_times, dtype=float)
+    index = np.full((len(frame_times), 4), np.nan)
+    index[:, 0] = np.arange(len(frame_times))
+    index[:, 1] = frame_times - frame_times[0]  # s, time in the video
+    for point_times, potentials, currents in scans:
+        during = (frame_times >= point_times[0]) & (frame_times <= point_times[-1])
+        index[during, 2] = np.interp(frame_times[during], point_times, potentials)
+        index[during, 3] = np.interp(frame_times[during], point_times, currents)
+    return index
+
+
+def save_frame_index(file_path, frame_times, scans):
+    # writes the frame-to-potential index of a video as a csv file; returns False if no frame was recorded
+    if not frame_times:
+        print("No frames recorded, no frame index for {}".format(file_path))
+        return False
+    np.savetxt(file_path, frame_potential_index(frame_times, scans), delimiter=',', fmt=['%d', '%.4f', '%.6g', '%.6g'],
+               header='frame,video_time_s,potential_V,current_A', comments='')
+    return True
+
+
+# electrode cleaning function: flush the electrode and run the cleaning CVs after testing an alchol
+def clean_electrode(valve_position, temp):
+    fgt_set_valvePosition(valve1_index, 0) # position 0 is the washing solvent
+    fgt_set_valvePosition(valve2_index, 0) # position 0 is the catholyte, also the washing solvent
+    flow_controller.set_all(flow_rate_for_flushing_electrode) # set flow rates of A1, A2, B1 and B2
+                
+    wait_for_stable_flow([flow_rate_for_flushing_electrode] * 4)
+    wash(flushing_dead_volumes, time_for_flushing_electrode)
+                
+    # Run CVs for electrode cleaning                
+    flow_controller.set_all(flow_rate_for_cleaning_electrode_with_CVs) # set flow rates of A1, A2, B1 and B2
+                
+    wait_for_stable_flow([flow_rate_for_cleaning_electrode_with_CVs] * 4)
+                
+    fileName_cleaning = '{:.0f}_'.format(valve_position)+'_{:.0f}oC'.format(temp) # base file name for data file
+    header_cleaning = 'CV_cleaning'   # header for data filef"file_{x}.txt"
 
+    data_file_paths, potentials, currents, n_sweeps = run_converging_cvs(Eini_cleaning, Ev1_cleaning, Ev2_cleaning, Efin_cleaning, sr_cleaning, dE_cleaning,
+                                                                         nSweeps_cleaning, sens_cleaning, fileName_cleaning, header_cleaning)
+    measurement_store.append(campaign_run_id, 'cleaning', {'valve_position': valve_position, 'temp': temp}, potentials, currents,
+                             {'data_files': [os.path.basename(path) for path in data_file_paths], 'n_sweeps': n_sweeps})
+    campaign_journal.record('cleaning', (valve_position, temp), data_file_paths)
+
+
+# cleaning and activation CVs: the sweeps run in chunks of `cleaning_chunk_sweeps`, and stop once the last two
+# cycles of a chunk agree (peak current drift and correlation of the curves), after at least `cleaning_min_sweeps`
+# and at most `max_sweeps` sweeps
+def split_cycles(potentials, currents):
+    # the full cycles (two sweeps) of a CV, split at the reversals of the scan direction
+    directions = np.sign(np.diff(potentials))
+    reversals = np.nonzero(directions[1:] * directions[:-1] < 0)[0] + 1
+    bounds = np.concatenate([[0], reversals, [len(potentials) - 1]])
+    return [(potentials[bounds[i]:bounds[i + 2]], currents[bounds[i]:bounds[i + 2]]) for i in range(0, len(bounds) - 2, 2)]
+
+
+def cycle_convergence(previous_cycle, cycle):
+    # relative drift of the peak current and correlation of the currents of two cycles
+    n = min(len(previous_cycle[1]), len(cycle[1]))
+    previous_peak = np.max(previous_cycle[1])
+    drift = abs(np.max(cycle[1]) - previous_peak) / abs(previous_peak) if previous_peak != 0 else float('inf')
+    correlation = np.corrcoef(previous_cycle[1][:n], cycle[1][:n])[0, 1]
+    return drift, correlation
+
+
+def run_converging_cvs(Eini, Ev1, Ev2, Efin, sr, dE, max_sweeps, sens, fileName, header):
+    # returns the data files of the chunks, the potentials and currents of all chunks and the number of sweeps
+    data_file_paths = []
+    potentials = []
+    currents = []
+    n_sweeps = 0
+    while n_sweeps < max_sweeps:
+        chunk_sweeps = min(cleaning_chunk_sweeps, max_sweeps - n_sweeps)
+        chunk_name = '{}_{:02d}'.format(fileName, len(data_file_paths) + 1)
+        cv = hp.potentiostat.CV(Eini, Ev1, Ev2, Efin, sr, dE, chunk_sweeps, sens, chunk_name, header)
+        cv.run()
+        n_sweeps += chunk_sweeps
+        data_file_paths.append(os.path.join(folder_path, chunk_name + '.txt'))
+        chunk_potentials, chunk_currents = read_chi_text_file(data_file_paths[-1])
+        potentials.append(chunk_potentials)
+        currents.append(chunk_currents)
+        
+        cycles = split_cycles(chunk_potentials, chunk_currents)
+        if len(cycles) < 2:
+            continue
+        drift, correlation = cycle_convergence(cycles[-2], cycles[-1])
+        print("{} sweeps: peak current drift {:.2%}, correlation {:.5f}".format(n_sweeps, drift, correlation))
+        if n_sweeps >= cleaning_min_sweeps and drift <= cleaning_max_drift and correlation >= cleaning_min_correlation:
+            print("Converged after {} of at most {} sweeps".format(n_sweeps, max_sweeps))
+            break
+    return data_file_paths, np.concatenate(potentials), np.concatenate(currents), n_sweeps
+
+
+# CV data functions
+# incremental reader of a CHI text data file that grows during the scan: each poll reads only the bytes appended
+# since the last poll and parses the complete data lines into numpy arrays
+class CHIFileTail:
+    def __init__(self, file_path, ignore_existing=True):
+        self.file_path = file_path
+        self.previous_file = self.stat() if ignore_existing else None  # a file left from an earlier run is ignored until it is rewritten
+        self.reset()
+
+    def stat(self):
+        try:
+            st = os.stat(self.file_path)
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime_ns)
+
+    def reset(self):
+        self.offset = 0
+        self.partial_line = b''
+        self.in_data = False
+        self.n_points = 0
+        self.data = np.empty((1024, 2))  # potential in V, current in A; grown by doubling
+
+    @property
+    def potentials(self):
+        return self.data[:self.n_points, 0]
+
+    @property
+    def currents(self):
+        return self.data[:self.n_points, 1]
+
+    def poll(self, final=False):
+        # returns the potentials and currents of the new data points
+        st = self.stat()
+        if st is None or st == self.previous_file:
+            return self.data[:0, 0], self.data[:0, 1]
+        self.previous_file = None
+        if st[0] < self.offset:
+            self.reset()  # the file was rewritten
+        with open(self.file_path, 'rb') as f:
+            f.seek(self.offset)
+            new_bytes = f.read()
+        self.offset += len(new_bytes)
+        lines = (self.partial_line + new_bytes).split(b'\n')
+        self.partial_line = b'' if final else lines.pop()  # the last line may still be written
+        rows = []
+        for line in lines:
+            line = line.strip()
+            if not self.in_data:
+                self.in_data = line.startswith(b'Potential/V')
+            elif line:
+                rows.append(line.split(b','))
+        if not rows:
+            return self.data[:0, 0], self.data[:0, 1]
+        new_data = np.array(rows, dtype=float)
+        while self.n_points + len(new_data) > len(self.data):
+            self.data = np.concatenate([self.data, np.empty_like(self.data)])
+        first = self.n_points
+        self.data[first:first + len(new_data)] = new_data
+        self.n_points += len(new_data)
+        return self.data[first:self.n_points, 0], self.data[first:self.n_points, 1]
+
+
+def read_chi_text_file(file_path):
+    # potentials and currents of a complete CHI text data file
+    tail = CHIFileTail(file_path, ignore_existing=False)
+    tail.poll(final=True)
+    return tail.potentials, tail.currents
+
+
+# features of a CV updated with each chunk of new data points: peak current and potential, onset potential (where
+# the current first rises `onset_current` above the current at the start of the scan) and the charge passed
+class CVFeatureTracker:
+    def __init__(self, scan_rate, onset_current, baseline_points=10):
+        self.scan_rate = scan_rate  # V/s
+        self.onset_current = onset_current  # A
+        self.baseline_points = baseline_points
+        self.baseline_currents = []
+        self.baseline = None
+        self.previous = None  # last (potential, current)
+        self.n_points = 0
+        self.peak_current = None  # A
+        self.peak_potential = None  # V
+        self.onset_potential = None  # V
+        self.charge = 0.0  # C
+
+    def update(self, potentials, currents):
+        if len(potentials) == 0:
+            return
+        self.n_points += len(potentials)
+        peak = np.argmax(currents)
+        if self.peak_current is None or currents[peak] > self.peak_current:
+            self.peak_current, self.peak_potential = float(currents[peak]), float(potentials[peak])
+        # trapezoidal charge, dt = dE / scan rate
+        if self.previous is not None:
+            potentials = np.concatenate([[self.previous[0]], potentials])
+            currents = np.concatenate([[self.previous[1]], currents])
+        self.charge += float(np.sum((currents[1:] + currents[:-1]) / 2 * np.abs(np.diff(potentials)))) / self.scan_rate
+        self.previous = (potentials[-1], currents[-1])
+        if self.baseline is None:
+            self.baseline_currents.extend(currents[:self.baseline_points - len(self.baseline_currents)])
+            if len(self.baseline_currents) < self.baseline_points:
+                return
+            self.baseline = float(np.mean(self.baseline_currents))
+        if self.onset_potential is None:
+            above = np.nonzero(currents - self.baseline >= self.onset_current)[0]
+            if len(above):
+                self.onset_potential = float(potentials[above[0]])
+
+    def features(self):
+        return {'n_points': self.n_points, 'peak_current': self.peak_current, 'peak_potential': self.peak_potential,
+                'onset_potential': self.onset_potential, 'charge': self.charge}
+
+
+# tails the data file of a running CV in a thread and publishes its features with the condition metadata after each
+# poll with new data, and once more with `final` True when stopped
+class CVDataWatcher:
+    def __init__(self, file_path, metadata, scan_rate, publish, onset_current, poll_interval=5):
+        self.tail = CHIFileTail(file_path)
+        self.tracker = CVFeatureTracker(scan_rate, onset_current)
+        self.metadata = metadata
+        self.publish = publish  # publish(metadata, features, final)
+        self.poll_interval = poll_interval  # s
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.observations = []  # (clock.monotonic() in s, number of points) of every poll with new points
+
+    def poll(self, final=False):
+        potentials, currents = self.tail.poll(final)
+        if len(potentials):
+            self.observations.append((clock.monotonic(), self.tail.n_points))
+        self.tracker.update(potentials, currents)
+        if len(potentials) or final:
+            self.publish(self.metadata, self.tracker.features(), final)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.watch_loop, daemon=True)
+        self.thread.start()
+
+    def watch_loop(self):
+        while not clock.wait(self.stop_event, self.poll_interval):
+            self.poll()
+
+    def stop(self, final=True):
+        # after the CV has finished: read the rest of the file and publish the final features. After a failed CV
+        # (`final` False) the watcher only stops
+        self.stop_event.set()
+        self.thread.join()
+        if not final:
+            return None
+        self.poll(final=True)
+        return self.tracker.features()
+
+
+# measurement store: the curves of all CVs packed into memory-mapped chunk files of (potential, current) rows, and
+# an append-only index with one json line per curve: run ID, kind (measurement, cleaning, activation), the full
+# condition, the location of the curve in the chunks and further attributes (e.g. data file and features).
+# Queries filter the index and return the curves as views on the chunks, without loading them into memory
+class MeasurementStore:
+    def __init__(self, path, chunk_points=1 << 18):
+        self.path = path
+        self.chunk_points = chunk_points  # rows per chunk file, a longer curve gets a chunk of its own
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.index_path = os.path.join(path, 'index.jsonl')
+        self.records = CampaignJournal.read(self.index_path)
+        self.keys = {}  # (run ID, kind, condition tuple) -> records
+        for record in self.records:
+            self.keys.setdefault(self.key(record), []).append(record)
+        self.chunks = {}  # chunk number -> memmap
+        self.chunk = max([record['chunk'] for record in self.records], default=-1)
+        self.chunk_used = sum(record['length'] for record in self.records if record['chunk'] == self.chunk)
+        self.index_file = open(self.index_path, 'a')
+
+    @staticmethod
+    def key(record):
+        return (record['run_id'], record['kind'], tuple(record['condition'].values()))
+
+    def chunk_path(self, chunk):
+        return os.path.join(self.path, 'chunk_{:05d}.f8'.format(chunk))
+
+    def chunk_array(self, chunk):
+        if chunk not in self.chunks:
+            n_rows = os.path.getsize(self.chunk_path(chunk)) // 16
+            self.chunks[chunk] = np.memmap(self.chunk_path(chunk), dtype=np.float64, mode='r+', shape=(n_rows, 2))
+        return self.chunks[chunk]
+
+    def append(self, run_id, kind, condition, potentials, currents, attributes=None):
+        # condition: dict of the condition fields, e.g. CampaignPoint._asdict()
+        length = len(potentials)
+        with self.lock:
+            if self.chunk < 0 or self.chunk_used + length > len(self.chunk_array(self.chunk)):
+                self.chunk += 1
+                self.chunk_used = 0
+                self.chunks[self.chunk] = np.memmap(self.chunk_path(self.chunk), dtype=np.float64, mode='w+',
+                                                    shape=(max(self.chunk_points, length), 2))
+            array = self.chunk_array(self.chunk)
+            array[self.chunk_used:self.chunk_used + length, 0] = potentials
+            array[self.chunk_used:self.chunk_used + length, 1] = currents
+            array.flush()  # the curve is on disk before the index points to it
+            record = {'run_id': run_id, 'kind': kind, 'condition': dict(condition), 'chunk': self.chunk,
+                      'offset': self.chunk_used, 'length': length, 'time': clock.time(), 'attributes': attributes or {}}
+            self.chunk_used += length
+            self.index_file.write(json.dumps(record) + '\n')
+            self.index_file.flush()
+            os.fsync(self.index_file.fileno())
+            self.records.append(record)
+            self.keys.setdefault(self.key(record), []).append(record)
+        return record
+
+    def get(self, run_id, kind, condition):
+        # records of one condition tuple and run ID
+        return list(self.keys.get((run_id, kind, tuple(dict(condition).values())), []))
+
+    def query(self, kind=None, run_id=None, **condition):
+        # records matching the kind, run ID and condition fields, e.g. query('measurement', valve_position=3, temp=30)
+        with self.lock:
+            records = list(self.records)
+        return [record for record in records if (kind is None or record['kind'] == kind) and
+                (run_id is None or record['run_id'] == run_id) and
+                all(record['condition'].get(name) == value for name, value in condition.items())]
+
+    def curve(self, record):
+        # potentials and currents of a record, as views on the memory-mapped chunk
+        with self.lock:
+            array = self.chunk_array(record['chunk'])
+        rows = array[record['offset']:record['offset'] + record['length']]
+        return rows[:, 0], rows[:, 1]
+
+    def close(self):
+        with self.lock:
+            for array in self.chunks.values():
+                array.flush()
+            self.chunks = {}
+            self.index_file.close()
+
+
+# flow rate control functions
+class FlowError(Exception):
+    pass
+
+
+# Fluigent SDK of the rig: the steps, the flow controller and the flow monitor call it from several threads, so its
+# functions are serialised by one lock, unless `concurrent` is set once checked on the rig that the SDK accepts calls
+# from several threads. The valve positions set are kept for the telemetry, which does not call the SDK
+class FluigentSDK:
+    def __init__(self, fluigent, concurrent):
+        self.fluigent = fluigent
+        self.lock = None if concurrent else threading.RLock()
+        self.valve_positions = {}  # valve -> last position set
+
+    def function(self, name):
+        function = getattr(self.fluigent, name)
+        if self.lock is None:
+            return function
+        def call(*args):
+            with self.lock:
+                return function(*args)
+        return call
+
+    def set_valve_position(self, valve, position):
+        self.function('fgt_set_valvePosition')(valve, position)
+        self.valve_positions[valve] = position
+
+
+# flow controller: sets and reads the pump/sensor channels (A1, A2, B1, B2) together. The calls to the channels are
+# issued concurrently when `concurrent` is set, and the regulation response time of a channel is only sent when it changes.
+class FlowController:
+    def __init__(self, set_regulation, set_response, read_sensor, channel_names, response_time, concurrent):
+        self.set_regulation = set_regulation  # e.g. fgt_set_sensorRegulation
+        self.set_response = set_response  # e.g. fgt_set_sensorRegulationResponse
+        self.read_sensor = read_sensor  # e.g. fgt_get_sensorValue
+        self.channel_names = channel_names  # e.g. ('A1', 'A2', 'B1', 'B2')
+        self.response_time = response_time  # s
+        self.channels = range(len(channel_names))
+        self.responses = [None for _ in channel_names]  # last response time sent to every channel
+        self.setpoints = [None for _ in channel_names]  # last flow rate (uL/min) set on every channel
+        self.reading = None  # last snapshot read, published for the telemetry
+        self.pool = ThreadPoolExecutor(max_workers=len(channel_names)) if concurrent else None
+
+    def _map(self, function, *args):
+        if self.pool is None:
+            return list(map(function, *args))
+        return list(self.pool.map(function, *args))
+
+    def _set_channel(self, channel, flow_rate):
+        self.set_regulation(channel, channel, flow_rate)
+        if self.responses[channel] != self.response_time:
+            self.set_response(channel, self.response_time)
+            self.responses[channel] = self.response_time
+
+    def set_flow_rates(self, flow_rates):
+        # flow_rates: flow rate (uL/min) of every channel
+        self._map(self._set_channel, self.channels, flow_rates)
+        self.setpoints = list(flow_rates)
+
+    def set_all(self, flow_rate):
+        self.set_flow_rates([flow_rate for _ in self.channels])
+
+    def set_dilution(self, total_A, ratio_A, total_B, ratio_B):
+        # total flow rates (uL/min) of A1 + A2 and B1 + B2, and the fractions of the concentrated electrolytes A1 and B1
+        self.set_flow_rates([total_A * ratio_A, total_A * (1 - ratio_A), total_B * ratio_B, total_B * (1 - ratio_B)])
+
+    def read(self):
+        # snapshot of all channels: (clock.monotonic() in s, flow rates in uL/min)
+        now = clock.monotonic()
+        self.reading = now, self._map(self.read_sensor, self.channels)
+        return self.reading
+
+    def invalidate(self):
+        # forget the cached settings, e.g. after the regulation was stopped
+        self.responses = [None for _ in self.channel_names]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+# flow monitor: reads the flow sensors every `sample_interval` seconds into rolling buffers. A channel is stable
+# once its readings of the last `window` seconds are all within the tolerance of the setpoint and their standard
+# deviation is below `max_std`
+class FlowMonitor:
+    def __init__(self, read_flow_rates, channel_names, sample_interval, window, tolerance, abs_tolerance, max_std):
+        self.read_flow_rates = read_flow_rates  # returns (time in s, flow rates), e.g. FlowController.read
+        self.channel_names = channel_names  # name of every sensor channel, e.g. ('A1', 'A2', 'B1', 'B2')
+        self.sample_interval = sample_interval  # s
+        self.window = window  # s
+        self.tolerance = tolerance  # relative to the setpoint
+        self.abs_tolerance = abs_tolerance  # uL/min, smallest tolerance, used for low setpoints
+        self.max_std = max_std  # uL/min
+        self.buffers = [deque(maxlen=int(window / sample_interval) + 2) for _ in channel_names]
+
+    def sample(self):
+        now, flow_rates = self.read_flow_rates()
+        for buffer, flow_rate in zip(self.buffers, flow_rates):
+            buffer.append((now, flow_rate))
+
+    def is_stable(self, channel, setpoint):
+        buffer = self.buffers[channel]
+        if not buffer or buffer[0][0] > buffer[-1][0] - self.window:
+            return False  # the window is not filled yet
+        values = [value for t, value in buffer if t >= buffer[-1][0] - self.window]
+        band = max(self.tolerance * abs(setpoint), self.abs_tolerance)
+        if any(abs(value - setpoint) > band for value in values):
+            return False
+        mean = sum(values) / len(values)
+        std = math.sqrt(sum((value - mean) ** 2 for value in values) / len(values))
+        return std <= self.max_std
+
+    def wait_until_stable(self, setpoints, timeout, required=None):
+        # setpoints: flow rate (uL/min) of every channel; required: channels that have to be stable (default all)
+        # returns the time (s) until all required channels are stable
+        if required is None:
+            required = range(len(setpoints))
+        for buffer in self.buffers:
+            buffer.clear()
+        start_time = next_sample = clock.monotonic()
         while True:
-            elapsed_time = time.time() - start_time  # Calculate elapsed time
-            if elapsed_time > self.max_recording_time:  # Stop if max recording time is exceeded
-                print(f"Max recording time of {self.max_recording_time} seconds reached.")
+            self.sample()
+            unstable = [channel for channel in required if not self.is_stable(channel, setpoints[channel])]
+            elapsed_time = clock.monotonic() - start_time
+            if not unstable:
+                return elapsed_time
+            if elapsed_time > timeout:
+                raise FlowError("Flow rate did not converge within {:.0f} s: ".format(timeout) + ", ".join(
+                    "{} {:.0f} uL/min (set {:.0f} uL/min)".format(self.channel_names[channel], self.buffers[channel][-1][1], setpoints[channel])
+                    for channel in unstable))
+            next_sample += self.sample_interval
+            clock.sleep(max(0, next_sample - clock.monotonic()))
+
+    def wait_for_volume(self, volumes, timeout):
+        # integrate the flow rates until every channel delivered its volume (uL)
+        # returns the time (s) and the delivered volumes (uL)
+        delivered = [0.0 for _ in volumes]
+        previous_time, previous_flow_rates = self.read_flow_rates()
+        start_time = next_sample = previous_time
+        while True:
+            next_sample += self.sample_interval
+            clock.sleep(max(0, next_sample - clock.monotonic()))
+            now, flow_rates = self.read_flow_rates()
+            for channel in range(len(volumes)):
+                # trapezoidal rule, flow rates in uL/min; negative readings (sensor noise, backflow) do not count
+                delivered[channel] += max(0, (previous_flow_rates[channel] + flow_rates[channel]) / 2) * (now - previous_time) / 60
+            previous_time, previous_flow_rates = now, flow_rates
+            if all(delivered[channel] >= volumes[channel] for channel in range(len(volumes))):
+                return now - start_time, delivered
+            if now - start_time > timeout:
+                raise FlowError("Volume not delivered within {:.0f} s: ".format(timeout) + ", ".join(
+                    "{} {:.0f} of {:.0f} uL".format(self.channel_names[channel], delivered[channel], volumes[channel])
+                    for channel in range(len(volumes)) if delivered[channel] < volumes[channel]))
+
+
+# wait for the flow rates of A1, A2, B1 and B2 to be stable at their setpoints
+def wait_for_stable_flow(setpoints):
+    elapsed_time = flow_monitor.wait_until_stable(setpoints, flow_stable_timeout)
+    print("Flow rates stable after {:.1f} seconds".format(elapsed_time))
+
+
+# wash the lines with `n_dead_volumes` dead volumes of every line, measured by integrating the flow rates,
+# or for `wash_time` seconds in the fixed time wash mode. Lines set to no flow (e.g. the diluent at a dilution of 1)
+# deliver nothing and are not waited for
+def wash(n_dead_volumes, wash_time):
+    if wash_mode == 'time':
+        print('Waiting {:.0f} seconds...'.format(wash_time))
+        clock.sleep(wash_time)
+        return
+    volumes = [0 if setpoint == 0 else n_dead_volumes * dead_volumes[name]
+               for name, setpoint in zip(flow_controller.channel_names, flow_controller.setpoints)]
+    print('Washing with {:.1f} dead volumes...'.format(n_dead_volumes))
+    elapsed_time, delivered = flow_monitor.wait_for_volume(volumes, wash_timeout)
+    print('Delivered {} uL in {:.0f} seconds'.format(', '.join('{:.0f}'.format(volume) for volume in delivered), elapsed_time))
+
+
+# water bath control functions
+class BathError(Exception):
+    pass
+
+
+# driver of the SC150 controller of the water bath. All commands go through one lock, so the background
+# reader and the experiment steps can share the serial port. The setpoint and run status are cached and
+# only sent when they change. The reader publishes timestamped temperatures every `poll_interval` seconds.
+class SC150Bath:
+    def __init__(self, port, poll_interval=1, retries=3):
+        self.port = port  # serial.Serial or SC150Emulator
+        self.poll_interval = poll_interval
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.setpoint = None
+        self.running = None
+        self.samples = deque(maxlen=3600)  # (clock.monotonic() in s, temperature in C)
+        self.new_sample = threading.Condition()
+        self.reader = None
+        self.stop_event = threading.Event()
+
+    def command(self, command, parse=None):
+        # send a command and read its reply line, retrying after timeouts and malformed replies
+        reply = None
+        with self.lock:
+            for attempt in range(self.retries):
+                if attempt > 0 and hasattr(self.port, 'reset_input_buffer'):
+                    self.port.reset_input_buffer()  # drop a late reply of the previous attempt
+                self.port.write((command + "\r").encode('utf-8'))
+                reply = self.port.readline().decode('utf-8', errors='replace').strip()
+                if not reply:
+                    continue  # timeout
+                if parse is None:
+                    return reply
+                try:
+                    return parse(reply)
+                except ValueError:
+                    continue
+        raise BathError("No valid reply to '{}' after {} attempts, last reply {!r}".format(command, self.retries, reply))
+
+    @staticmethod
+    def parse_temperature(reply):
+        return float(reply.replace('C', ''))
+
+    @staticmethod
+    def parse_acknowledgement(reply):
+        # the set commands are acknowledged with '!', errors are replied with a code, e.g. 'F001' for a bad command
+        if reply != '!':
+            raise ValueError("Not acknowledged: {}".format(reply))
+        return True
+
+    def read_temperature(self):
+        return self.command("RT", self.parse_temperature)
+
+    def read_setpoint(self):
+        self.setpoint = self.command("RS", self.parse_temperature)
+        return self.setpoint
+
+    def set_setpoint(self, temp):
+        if self.setpoint is not None and round(self.setpoint, 2) == round(temp, 2):
+            return
+        self.command("SS %2.2f" % float(temp), self.parse_acknowledgement)
+        self.setpoint = round(float(temp), 2)
+
+    def turn_on(self):
+        if not self.running:
+            self.command("SO 1", self.parse_acknowledgement)  # set status of bath to on/run
+            self.running = True
+
+    def start_reader(self):
+        self.stop_event.clear()
+        self.reader = threading.Thread(target=self._read_loop, name='bath reader', daemon=True)
+        self.reader.start()
+
+    def stop_reader(self):
+        self.stop_event.set()
+        if self.reader is not None:
+            self.reader.join()
+            self.reader = None
+
+    def _read_loop(self):
+        next_poll = clock.monotonic()
+        while not self.stop_event.is_set():
+            try:
+                temp = self.read_temperature()
+            except BathError as e:
+                print("Bath reading failed: {}".format(e))
+            else:
+                with self.new_sample:
+                    self.samples.append((clock.monotonic(), temp))
+                    self.new_sample.notify_all()
+            next_poll += self.poll_interval
+            clock.wait(self.stop_event, max(0, next_poll - clock.monotonic()))
+
+    def latest_sample(self):
+        with self.new_sample:
+            return self.samples[-1] if self.samples else None
+
+    def wait_for_sample(self, after_time=None, timeout=None):
+        # return the first sample newer than `after_time`, or None after `timeout` seconds
+        with self.new_sample:
+            def is_new():
+                return self.samples and (after_time is None or self.samples[-1][0] > after_time)
+            if not self.new_sample.wait_for(is_new, clock.real_timeout(timeout)):
+                return None
+            return self.samples[-1]
+
+    def close(self):
+        self.stop_reader()
+        self.port.close()
+
+
+# stand-in for the serial port of the SC150 controller, answering RT, RS, SS and SO like the bath does,
+# with a first-order thermal model of the bath. Used instead of the COM port to test without the bath.
+class SC150Emulator:
+    name = 'SC150 emulator'
+
+    def __init__(self, temp=20.0, time_constant=600):
+        self.temp = temp
+        self.setpoint = temp
+        self.running = False
+        self.time_constant = time_constant  # s
+        self.last_update = clock.monotonic()
+        self.replies = deque()
+
+    def _update(self):
+        now = clock.monotonic()
+        if self.running:
+            self.temp += (self.setpoint - self.temp) * (1 - math.exp(-(now - self.last_update) / self.time_constant))
+        self.last_update = now
+
+    def write(self, data):
+        self._update()
+        for command in data.decode('utf-8').split('\r'):
+            command = command.strip()
+            if not command:
+                continue
+            if command == 'RT':
+                self.replies.append('%.2fC\r' % self.temp)
+            elif command == 'RS':
+                self.replies.append('%.2fC\r' % self.setpoint)
+            elif command.startswith('SS '):
+                self.setpoint = float(command[3:])
+                self.replies.append('!\r')
+            elif command.startswith('SO '):
+                self.running = command[3:] == '1'
+                self.replies.append('!\r')
+            else:
+                self.replies.append('F001\r')  # bad command
+        return len(data)
+
+    def readline(self):
+        return self.replies.popleft().encode('utf-8') if self.replies else b''  # b'' is a timeout
+
+    def reset_input_buffer(self):
+        self.replies.clear()
+
+    def close(self):
+        pass
+
+
+# temperature settle detector: the temperature is settled once the readings of the last `dwell_time` seconds
+# are all inside the tolerance band around the setpoint and their drift is below `max_rate`
+class TemperatureSettleDetector:
+    def __init__(self, target, tolerance, max_rate, dwell_time, rate_window=30, resolution=0.01, min_rate=0.01):
+        self.target = target
+        self.tolerance = tolerance      # C, half width of the band around the setpoint
+        self.max_rate = max_rate        # C/min, largest drift accepted as settled
+        self.dwell_time = dwell_time    # s, time the readings have to stay in the band
+        self.rate_window = rate_window  # s, time window used to predict the time to settle
+        self.resolution = resolution    # C, resolution of the readings, e.g. 0.01 C for the SC150
+        self.min_rate = min_rate        # C/min, slower approaches are not extrapolated to a time to settle
+        self.samples = deque()          # (time in s, temperature in C)
+
+    def add_sample(self, t, temp):
+        self.samples.append((t, temp))
+        # keep one sample older than the windows so that the window is known to be fully covered
+        window = max(self.dwell_time, self.rate_window)
+        while len(self.samples) > 2 and self.samples[1][0] <= t - window:
+            self.samples.popleft()
+
+    def rate(self, window):
+        # least-squares slope (C/min) of the readings of the last `window` seconds
+        now = self.samples[-1][0]
+        points = [(t, temp) for t, temp in self.samples if t >= now - window]
+        if len(points) < 2:
+            return None
+        mean_t = sum(t for t, _ in points) / len(points)
+        mean_temp = sum(temp for _, temp in points) / len(points)
+        var_t = sum((t - mean_t) ** 2 for t, _ in points)
+        if var_t == 0:
+            return None
+        return sum((t - mean_t) * (temp - mean_temp) for t, temp in points) / var_t * 60
+
+    def in_band(self, temp):
+        # the band edges are compared to half a reading step, e.g. 20.1 C is in the band of 20.0 +/- 0.1 C
+        return abs(temp - self.target) <= self.tolerance + self.resolution / 2
+
+    def time_in_band(self):
+        # time (s) the readings have continuously been inside the tolerance band
+        now = self.samples[-1][0]
+        entered = None
+        for t, temp in reversed(self.samples):
+            if not self.in_band(temp):
                 break
+            entered = t
+        return 0 if entered is None else now - entered
+
+    def is_settled(self):
+        if not self.samples or self.samples[0][0] > self.samples[-1][0] - self.dwell_time:
+            return False
+        if self.time_in_band() < self.dwell_time:
+            return False
+        rate = self.rate(self.dwell_time)
+        return rate is not None and abs(rate) <= self.max_rate
+
+    def time_to_settle(self):
+        # predicted time (s) until the temperature is settled, None if it is not approaching the setpoint
+        if not self.samples:
+            return None
+        error = self.target - self.samples[-1][1]
+        if self.in_band(self.samples[-1][1]):
+            return max(0, self.dwell_time - self.time_in_band())
+        rate = self.rate(self.rate_window)
+        if rate is None or rate * error <= 0 or abs(rate) < self.min_rate:
+            return None
+        # first-order approach: the time constant follows from the current error and rate
+        time_constant = abs(error) / abs(rate) * 60
+        return time_constant * math.log(abs(error) / self.tolerance) + self.dwell_time
+
+
+# first-order thermal model of the bath and flow cell, dT/dt = (setpoint - T) / time_constant. The time constant
+# is fitted to the temperature readings logged during each ramp and stored in a JSON file to be reused across runs.
+class BathThermalModel:
+    def __init__(self, time_constant=600, n_ramps=0):
+        self.time_constant = time_constant  # s
+        self.n_ramps = n_ramps  # number of ramps the time constant was learned from
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            params = json.load(f)
+        return cls(params['time_constant'], params['n_ramps'])
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'time_constant': self.time_constant, 'n_ramps': self.n_ramps}, f, indent=4)
+
+    def learn(self, log, min_interval=10, min_error=0.5, max_ramps=10):
+        # log: (time in s, temperature in C, setpoint in C) of one ramp
+        # least-squares fit through the origin of dT/dt against (setpoint - T) over steps of at least `min_interval` s
+        sum_xy = sum_xx = 0
+        previous = None
+        for t, temp, setpoint in log:
+            if previous is None:
+                previous = (t, temp, setpoint)
+                continue
+            if t - previous[0] < min_interval:
+                continue
+            error = previous[2] - (previous[1] + temp) / 2
+            if abs(error) >= min_error:
+                rate = (temp - previous[1]) / (t - previous[0])
+                sum_xy += error * rate
+                sum_xx += error * error
+            previous = (t, temp, setpoint)
+        if sum_xx == 0 or sum_xy <= 0:
+            return None
+        estimate = sum_xx / sum_xy
+        # running average over the last `max_ramps` ramps, so the model follows changes of the rig
+        n = min(self.n_ramps, max_ramps - 1)
+        self.time_constant = (self.time_constant * n + estimate) / (n + 1)
+        self.n_ramps += 1
+        return estimate
+
+    def time_to_reach(self, start_temp, setpoint, temp):
+        # time (s) for the temperature to go from `start_temp` to `temp` with the bath at `setpoint`
+        if (setpoint - start_temp) * (setpoint - temp) <= 0 or abs(setpoint - temp) > abs(setpoint - start_temp):
+            return None
+        return self.time_constant * math.log((setpoint - start_temp) / (setpoint - temp))
+
+
+# ramp controller: overdrives the setpoint beyond the target, and sets it back to the target
+# `lead_time` seconds before the model predicts the temperature to reach the target
+class BathRampController:
+    def __init__(self, model, max_boost, min_setpoint, max_setpoint, lead_time):
+        self.model = model
+        self.max_boost = max_boost  # C, largest overdrive of the setpoint beyond the target
+        self.min_setpoint = min_setpoint  # C
+        self.max_setpoint = max_setpoint  # C
+        self.lead_time = lead_time  # s, covers the lags of the bath that the first-order model misses
+
+    def boost_setpoint(self, current_temp, target, tolerance):
+        step = target - current_temp
+        if abs(step) <= tolerance:
+            return target
+        boost = target + math.copysign(min(self.max_boost, abs(step)), step)
+        return min(max(boost, self.min_setpoint), self.max_setpoint)
+
+    def should_release(self, current_temp, boost, target):
+        time_to_target = self.model.time_to_reach(current_temp, boost, target)
+        return time_to_target is None or time_to_target <= self.lead_time
+
+    def predicted_saving(self, start_temp, target, tolerance, boost):
+        # time saved (s) until the temperature enters the tolerance band
+        band_edge = target - math.copysign(tolerance, target - start_temp)
+        unboosted = self.model.time_to_reach(start_temp, target, band_edge)
+        boosted = self.model.time_to_reach(start_temp, boost, band_edge)
+        if unboosted is None or boosted is None:
+            return 0
+        return unboosted - boosted
+
+
+# wait for the bath to settle at `temp`, using the temperature samples published by the bath reader.
+# The ramp is shortened by overdriving the setpoint, and the thermal model is updated after each ramp.
+def wait_for_bath_temperature(temp):
+    bath.turn_on()
+    
+    start_sample = bath.wait_for_sample(None, bath_sample_timeout)
+    if start_sample is None:
+        raise BathError("No temperature reading from the bath for {:.0f} seconds".format(bath_sample_timeout))
+    start_time, start_temp = start_sample
+    
+    setpoint = bath_ramp_controller.boost_setpoint(start_temp, temp, bath_temp_tolerance)
+    predicted_saving = bath_ramp_controller.predicted_saving(start_temp, temp, bath_temp_tolerance, setpoint)
+    predicted_unboosted = bath_thermal_model.time_to_reach(start_temp, temp, temp - math.copysign(bath_temp_tolerance, temp - start_temp))
+    bath.set_setpoint(setpoint)
+    if setpoint != temp:
+        print("Boost the setpoint to %2.2f C, predicted saving: %.0f s" % (setpoint, predicted_saving))
+    
+    detector = TemperatureSettleDetector(temp, bath_temp_tolerance, bath_max_temp_rate, bath_dwell_time)
+    ramp_log = []
+    sample_time = None
+    
+    while True:
+        sample = bath.wait_for_sample(sample_time, bath_sample_timeout)
+        if sample is None:
+            raise BathError("No temperature reading from the bath for {:.0f} seconds".format(bath_sample_timeout))
+        sample_time, current_temp = sample
+        detector.add_sample(sample_time, current_temp)
+        ramp_log.append((sample_time, current_temp, setpoint))
+        
+        if setpoint != temp and bath_ramp_controller.should_release(current_temp, setpoint, temp):
+            setpoint = temp
+            bath.set_setpoint(setpoint)
+            print("Set the setpoint back to %2.2f C" % setpoint)
+        
+        # The flow rates are not read here: this step only holds the bath, and the fluidics steps run meanwhile
+        time_to_settle = detector.time_to_settle()
+        print("S_T: %2.2f C     C_T: %s C     ETA: %s" % (setpoint, current_temp, '--' if time_to_settle is None else '%.0f s' % time_to_settle))
 
-            try:
-                mvsdk.CameraSoftTrigger(self.hCamera)
-                pRawData, FrameHead = mvsdk.CameraGetImageBuffer(self.hCamera, 2000)
-                mvsdk.CameraImageProcess(self.hCamera, pRawData, self.pFrameBuffer, FrameHead)
-                mvsdk.CameraReleaseImageBuffer(self.hCamera, pRawData)
+        if setpoint == temp and detector.is_settled():
+            print("Reach the setpoint: %s C" % current_temp)
+            break
+    
+    # report the time saved against the model prediction without boosting, then learn from this ramp
+    settle_time = sample_time - start_time
+    if predicted_unboosted is not None and ramp_log[0][2] != temp:
+        print("Settled in %.0f s, predicted without boosting: %.0f s (predicted saving: %.0f s, actual saving: %.0f s)"
+              % (settle_time, predicted_unboosted + bath_dwell_time, predicted_saving, predicted_unboosted + bath_dwell_time - settle_time))
+    if bath_thermal_model.learn(ramp_log) is not None:
+        bath_thermal_model.save(bath_model_path)
+        print("Bath time constant: %.0f s (learned from %d ramps)" % (bath_thermal_model.time_constant, bath_thermal_model.n_ramps))
+
+
+# experiment step functions of one campaign point, run by the step executor
+def wash_system_for_point(point):
+    print()
+    print('---- Alchol {:.0f} at {:.2f} C ----'.format(point.valve_position, point.temp))
+    print('0. Put valve position to 0 and set flow rates to wash the system')
+    fgt_set_valvePosition(valve1_index, 0) # position 0 is the washing solvent
+    fgt_set_valvePosition(valve2_index, 0) # position 0 is the catholyte, also the washing solvent
+    flow_controller.set_all(flow_rate_for_washing_system) # set flow rates of A1, A2, B1 and B2
+    wash(washing_dead_volumes, time_for_washing)
+    
+    print('1. Put valve position to {:.0f} and set flow rates to remove the washing solvent'.format(point.valve_position))
+    fgt_set_valvePosition(valve1_index, point.valve_position) # position valve_position is the alchol i
+    fgt_set_valvePosition(valve2_index, 0) # position 0 is the catholyte
+    flow_controller.set_all(flow_rate_for_washing_system) # set flow rates of A1, A2, B1 and B2
+    wash(washing_dead_volumes, time_for_washing)
+    
+    print('2. Set flow rates for waiting tempareture to reach the set value')
+    flow_controller.set_all(flow_rate_for_waiting_temp) # set flow rates of A1, A2, B1 and B2
+    if bubble_detector is not None:
+        bubble_detector.reset_background() # the washed cell is the background of the recordings of this point
 
-                mvsdk.CameraPushFrame(self.hCamera, self.pFrameBuffer, FrameHead)
 
-            except mvsdk.CameraException as e:
-                print("CameraGetImageBuffer failed({}): {}".format(e.error_code, e.message))
-                break
+def equilibrate_temperature(temp):
+    print('3. Set the tempareture to {:.2f}, and wait'.format(temp))   
+    wait_for_bath_temperature(temp)
 
-        # Cleanup after recording
-        self.cleanup()
 
-    def cleanup(self):
-        print("Cleaning up camera resources...")
-        mvsdk.CameraStopRecord(self.hCamera)
-        mvsdk.CameraUnInit(self.hCamera)
-        mvsdk.CameraAlignFree(self.pFrameBuffer)
+def set_working_flow_rates(point):
+    print("4. Change to working flow rates")
+    flow_controller.set_flow_rates([point.flow_rate_A1, point.flow_rate_A2, point.flow_rate_B1, point.flow_rate_B2])
+    
+    wait_for_stable_flow([point.flow_rate_A1, point.flow_rate_A2, point.flow_rate_B1, point.flow_rate_B2])
+
+
+# one potentiostat method of the measurement batch: technique 'CV', or 'LSV' from Eini to Efin (Ev1, Ev2 and nSweeps unused)
+MeasurementMethod = namedtuple('MeasurementMethod', ['technique', 'Eini', 'Ev1', 'Ev2', 'Efin', 'sr', 'dE', 'nSweeps', 'sens'])
+
+def method_time(method):
+    # scan time of a method (s)
+    if method.technique == 'LSV':
+        return abs(method.Efin - method.Eini) / method.sr
+    return abs(method.Ev1 - method.Eini) / method.sr * method.nSweeps
+
+
+def measurement_condition(point, method, dilution):
+    # condition of a sub-measurement of the batch: the point with the concentration and flow rates of the dilution
+    # (fraction of the concentrated anolyte A1 in A1 + A2, None for the flow rates of the point) and the method
+    condition = point._asdict()
+    if dilution is not None:
+        total_A = point.flow_rate_A1 + point.flow_rate_A2
+        condition.update(concentration_anolyte=concentrated_anolytes * dilution, flow_rate_A1=total_A * dilution, flow_rate_A2=total_A * (1 - dilution))
+    condition.update(method._asdict(), dilution=dilution)
+    return condition
+
+
+def measurement_file_name(condition):
+    # base file name of a sub-measurement: '{valve}_{Eini}mV_{Ev1}mV_{sr}mVs_{T}oC' for a CV, with the LSV window
+    # for an LSV and the anolyte concentration for a dilution
+    if condition['technique'] == 'LSV':
+        fileName = '{:.0f}_LSV_{:.0f}mV_{:.0f}mV'.format(condition['valve_position'], condition['Eini'] * 1000, condition['Efin'] * 1000)
+    else:
+        fileName = '{:.0f}_{:.0f}mV_{:.0f}mV'.format(condition['valve_position'], condition['Eini'] * 1000, condition['Ev1'] * 1000)
+    fileName += '_{:.0f}mVs_{:.0f}oC'.format(condition['sr'] * 1000, condition['temp'])
+    if condition['dilution'] is not None:
+        fileName += '_{:g}mM'.format(condition['concentration_anolyte'])
+    return fileName
+
+
+def reference_condition(point):
+    # the first method at the first dilution of the batch stands for the point, e.g. in the adaptive sampling
+    return measurement_condition(point, measurement_methods[0], measurement_dilutions[0])
+
+
+def catholyte_fraction(point):
+    # fraction of the concentrated catholyte B1 in B1 + B2, kept while the anolyte is diluted; 0 without catholyte flow
+    total_B = point.flow_rate_B1 + point.flow_rate_B2
+    return point.flow_rate_B1 / total_B if total_B > 0 else 0
+
+
+def set_measurement_dilution(point, dilution):
+    print("Change to {} of the concentrated anolyte".format('the working fraction' if dilution is None else '{:.2f}'.format(dilution)))
+    if dilution is None:
+        flow_rates = [point.flow_rate_A1, point.flow_rate_A2, point.flow_rate_B1, point.flow_rate_B2]
+        flow_controller.set_flow_rates(flow_rates)
+    else:
+        total_A = point.flow_rate_A1 + point.flow_rate_A2
+        total_B = point.flow_rate_B1 + point.flow_rate_B2
+        flow_controller.set_dilution(total_A, dilution, total_B, catholyte_fraction(point))
+        flow_rates = [total_A * dilution, total_A * (1 - dilution), point.flow_rate_B1, point.flow_rate_B2]
+    wait_for_stable_flow(flow_rates)
+    
+    # replace the solution in the flow cell
+    wash(dilution_dead_volumes, time_for_dilution_change)
+
+
+def run_measurement(point):
+    # the measurement batch of a point: every method at every dilution, back to back while the cell is held at temperature
+    print("5. Run the measurement batch: {} methods at {} dilutions".format(len(measurement_methods), len(measurement_dilutions)))
+    file_paths = []
+    scores = []
+    for i, dilution in enumerate(measurement_dilutions):
+        if i > 0 or dilution is not None:
+            set_measurement_dilution(point, dilution)
+        for method in measurement_methods:
+            condition = measurement_condition(point, method, dilution)
+            method_file_paths, score = run_method(condition)
+            file_paths += method_file_paths
+            if score is not None:
+                scores.append(score)
+    
+    if scores:
+        bubble_scores[point] = max(scores)  # the bubbles trapped during the whole batch
+    campaign_journal.record('point', point, file_paths)
+
+    print("6. Measurement batch and video recordings finished") 
+
+
+def run_method(condition):
+    # one sub-measurement of the batch, with its own data file, video and frame index; returns their paths and the bubble score
+    fileName = measurement_file_name(condition) # base file name for data file
+    header = condition['technique']   # header for data filef"file_{x}.txt"
+    print("{} at {:.0f} mV/s: {}".format(condition['technique'], condition['sr'] * 1000, fileName))
+
+    # Initialize experiment:
+    if condition['technique'] == 'LSV':
+        cv = hp.potentiostat.LSV(condition['Eini'], condition['Efin'], condition['sr'], condition['dE'], condition['sens'], fileName, header)
+    else:
+        cv = hp.potentiostat.CV(condition['Eini'], condition['Ev1'], condition['Ev2'], condition['Efin'], condition['sr'],
+                                condition['dE'], condition['nSweeps'], condition['sens'], fileName, header)
+    scan_time = method_time(MeasurementMethod(**{field: condition[field] for field in MeasurementMethod._fields}))
+
+    data_file_path = os.path.join(folder_path, fileName + '.txt')
+    video_save_path = os.path.join(folder_path, fileName + ".mp4")
+    frame_index_path = os.path.join(folder_path, fileName + '_frames.csv')
+
+    # Watch the data file during the scan
+    cv_watcher = CVDataWatcher(data_file_path, dict(condition, measurement=fileName), condition['sr'], publish_cv_features, cv_onset_current, cv_watch_interval)
+    cv_watcher.start()
+    cv_errors = []
+    try:
+        # Start recording with the open camera session, until the CV is finished
+        cv_finished = threading.Event()
+        recordings = []
+        def record_video():
+            recordings.append(camera.record(video_save_path, scan_time + video_max_overrun, cv_finished))
+        camera_thread = threading.Thread(target=record_video)
+        camera_thread.start()
+
+        # Start CV thread; the potentiostat returns when the scan is finished
+        cv_end_times = []
+        def run_cv():
+            try:
+                cv.run()
+                cv_end_times.append(clock.monotonic())
+            except Exception as e:
+                cv_errors.append(e)
+            finally:
+                cv_finished.set()
+        cv_thread = threading.Thread(target=run_cv)
+        cv_thread.start()
+
+        cv_thread.join()  # the data file is complete before it is journaled
+        camera_thread.join()  # the bubble score needs the whole video
+        if cv_errors:
+            raise cv_errors[0]
+    finally:
+        # the watcher thread does not outlive the measurement, also when it failed
+        features = cv_watcher.stop(final=not cv_errors)
+    potentials, currents = cv_watcher.tail.potentials, cv_watcher.tail.currents
+    start_time, return_delay = anchor_scan(potentials, condition['sr'], cv_watcher.observations, cv_end_times[0])
+    file_paths = [data_file_path, video_save_path]
+    if return_delay is not None and recordings and recordings[0] is not None and \
+            save_frame_index(frame_index_path, recordings[0]['frame_times'], [(scan_point_times(potentials, condition['sr'], start_time), potentials, currents)]):
+        file_paths.append(frame_index_path)
+
+    # without a recording the detector still holds the frames of the previous video, so there is no score
+    score = None
+    if bubble_detector is not None and recordings and recordings[0] is not None:
+        score = bubble_detector.score()
+        print("Bubble score: {:.4f}".format(score))
+
+    measurement_store.append(campaign_run_id, 'measurement', condition, potentials, currents,
+                             {'data_file': fileName + '.txt', 'features': features, 'bubble_score': score, 'video_file': fileName + '.mp4',
+                              'frame_index': os.path.basename(frame_index_path) if frame_index_path in file_paths else None, 'return_delay': return_delay})
+    return file_paths, score
+
+
+def anchor_scan(potentials, sr, observations, end_time):
+    # start time of a scan from the data seen by its watcher and the return of the potentiostat at `end_time`, and the
+    # delay (s) of the return after the end of the scan, i.e. the overhead of the CHI software the watcher measured.
+    # A data file that is empty or could not be parsed has nothing to anchor on: (end_time, None)
+    if not len(potentials):
+        print("No CV data read, the video frames are not indexed")
+        return end_time, None
+    start_time = scan_start_time(potentials, sr, observations + [(end_time, len(potentials))])
+    return_delay = end_time - scan_point_times(potentials, sr, start_time)[-1]
+    if return_delay > 0:
+        print("CV data seen {:.1f} s before the potentiostat returned, video frames anchored on the data".format(return_delay))
+    return start_time, return_delay
+
+
+# concentration gradient functions
+# estimate of the anolyte concentration at the electrode from the measured flow rates of A1 and A2: the mixture reaches
+# the electrode after the plug flow through `delay_volume`, and is mixed in the inlet and the cell like in a stirred tank
+# of `mixing_volume`. The model runs on the delivered volume, so it holds while the flow rates change
+class TransportDelayModel:
+    def __init__(self, concentration, delay_volume, mixing_volume):
+        self.concentration = concentration  # mmol/L, concentration of the concentrated anolyte A1
+        self.delay_volume = delay_volume  # uL
+        self.mixing_volume = mixing_volume  # uL
+        self.times = []  # s, clock.monotonic() of the flow readings
+        self.volumes = []  # uL, volume of A1 + A2 delivered since the first reading
+        self.inlet_concentrations = []  # mmol/L, concentration of the mixture from each reading to the next
+        self.total_flow_rate = 0.0  # uL/min, of the last reading
+        self.lock = threading.Lock()
+
+    def add(self, t, flow_rate_A1, flow_rate_A2):
+        flow_rates = [max(0, flow_rate_A1), max(0, flow_rate_A2)]  # negative readings (sensor noise, backflow) do not count
+        with self.lock:
+            volume = 0.0
+            if self.times:
+                # trapezoidal rule, flow rates in uL/min
+                volume = self.volumes[-1] + (self.total_flow_rate + sum(flow_rates)) / 2 * (t - self.times[-1]) / 60
+            self.times.append(t)
+            self.volumes.append(volume)
+            self.inlet_concentrations.append(self.concentration * flow_rates[0] / max(sum(flow_rates), 1e-9))
+            self.total_flow_rate = sum(flow_rates)
+
+    def estimate(self, t):
+        # concentration (mmol/L) at the electrode at time t; before the first reading the inlet is taken as constant
+        with self.lock:
+            volumes = np.array(self.volumes)
+            inlet_concentrations = np.array(self.inlet_concentrations)
+            volume = np.interp(t, self.times, volumes) - self.delay_volume
+        n = max(1, np.searchsorted(volumes, volume, side='right'))  # readings delivered to the electrode
+        if self.mixing_volume <= 0:
+            return float(inlet_concentrations[n - 1])
+        # the stirred tank holds the inlet of every volume interval, weighted by the fraction of it still in the tank
+        edges = np.exp(-np.maximum(volume - np.append(volumes[:n], volume), 0) / self.mixing_volume)
+        return float(inlet_concentrations[0] * edges[0] + np.sum(inlet_concentrations[:n] * np.diff(edges)))
+
+
+# ramp of the fraction of the concentrated anolyte A1 in A1 + A2 at constant total flow rates, in steps of `step_interval`
+# seconds. The flow rates are read every `sample_interval` seconds into the transport delay model
+class GradientRamp:
+    def __init__(self, model, total_A, total_B, fraction_B, start_fraction, end_fraction, ramp_time, step_interval, sample_interval):
+        self.model = model
+        self.total_A, self.total_B = total_A, total_B  # uL/min, flow rates of A1 + A2 and B1 + B2
+        self.fraction_B = fraction_B  # fraction of the concentrated catholyte B1 in B1 + B2
+        self.start_fraction, self.end_fraction = start_fraction, end_fraction
+        self.ramp_time = ramp_time  # s
+        self.step_interval = step_interval  # s
+        self.sample_interval = sample_interval  # s
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.start_time = None
+
+    def fraction(self, elapsed_time):
+        progress = min(max(elapsed_time / self.ramp_time, 0), 1) if self.ramp_time > 0 else 1
+        return self.start_fraction + (self.end_fraction - self.start_fraction) * progress
+
+    def start(self):
+        self.start_time = clock.monotonic()
+        self.model.add(*self.read_flow_rates())
+        self.thread = threading.Thread(target=self.ramp_loop, daemon=True)
+        self.thread.start()
+
+    def read_flow_rates(self):
+        now, flow_rates = flow_controller.read()
+        return now, flow_rates[0], flow_rates[1]
+
+    def ramp_loop(self):
+        next_step = self.start_time
+        while not clock.wait(self.stop_event, self.sample_interval):
+            try:
+                self.model.add(*self.read_flow_rates())
+                if clock.monotonic() >= next_step:
+                    flow_controller.set_dilution(self.total_A, self.fraction(clock.monotonic() - self.start_time), self.total_B, self.fraction_B)
+                    next_step += self.step_interval
+            except Exception as e:
+                print("Gradient step failed:", e)  # the next step sets the ramp again
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def run_gradient(point):
+    # fast CVs every `gradient_cv_interval` seconds while the concentration of the anolyte ramps, each tagged with the
+    # concentration at the electrode estimated from the measured flow rates; one video records the whole pass
+    total_A = point.flow_rate_A1 + point.flow_rate_A2
+    total_B = point.flow_rate_B1 + point.flow_rate_B2
+    # the ramp is followed until its end concentration reached the electrode
+    pass_time = gradient_ramp_time + (gradient_delay_volume + 3 * gradient_mixing_volume) / total_A * 60
+    cv_times = [k * gradient_cv_interval for k in range(int(pass_time // gradient_cv_interval) + 1)]
+    print("5. Run the concentration gradient: {} fast CVs from {:.2f} to {:.2f} of the concentrated anolyte in {:.0f} seconds".format(
+        len(cv_times), gradient_fractions[0], gradient_fractions[1], gradient_ramp_time))
+    set_measurement_dilution(point, gradient_fractions[0])
+
+    model = TransportDelayModel(concentrated_anolytes, gradient_delay_volume, gradient_mixing_volume)
+    ramp = GradientRamp(model, total_A, total_B, catholyte_fraction(point), gradient_fractions[0], gradient_fractions[1],
+                        gradient_ramp_time, gradient_step_interval, flow_sample_interval)
+    base_name = measurement_file_name(measurement_condition(point, gradient_method, None)) + '_gradient'
+    video_save_path = os.path.join(folder_path, base_name + ".mp4")
+    frame_index_path = os.path.join(folder_path, base_name + '_frames.csv')
+    file_paths = [video_save_path]
+    scans = []  # (point times, potentials, currents) of the CVs, for the frame index
+
+    ramp.start()
+    # Record the pass until the last CV is finished
+    pass_finished = threading.Event()
+    recordings = []
+    def record_video():
+        recordings.append(camera.record(video_save_path, cv_times[-1] + method_time(gradient_method) + video_max_overrun, pass_finished))
+    camera_thread = threading.Thread(target=record_video)
+    camera_thread.start()
+    try:
+        for k, cv_time in enumerate(cv_times):
+            clock.sleep(max(0, ramp.start_time + cv_time - clock.monotonic()))
+            fileName = base_name + '_{:02d}'.format(k) # base file name for data file
+            cv = hp.potentiostat.CV(gradient_method.Eini, gradient_method.Ev1, gradient_method.Ev2, gradient_method.Efin, gradient_method.sr,
+                                    gradient_method.dE, gradient_method.nSweeps, gradient_method.sens, fileName, 'CV')
+            data_file_path = os.path.join(folder_path, fileName + '.txt')
+            # the features are published once the concentration during the CV is known
+            cv_watcher = CVDataWatcher(data_file_path, {}, gradient_method.sr, lambda metadata, features, final: None, cv_onset_current, cv_watch_interval)
+            cv_watcher.start()
+            cv_completed = False
+            try:
+                cv.run()
+                cv_end_time = clock.monotonic()
+                cv_completed = True
+            finally:
+                features = cv_watcher.stop(final=cv_completed)
+
+            potentials, currents = cv_watcher.tail.potentials, cv_watcher.tail.currents
+            start_time, return_delay = anchor_scan(potentials, gradient_method.sr, cv_watcher.observations, cv_end_time)
+            if return_delay is None:
+                point_times = [cv_end_time]  # no data: the concentration at the return of the potentiostat
+            else:
+                point_times = scan_point_times(potentials, gradient_method.sr, start_time)
+                scans.append((point_times, potentials, currents))
+            concentrations = [model.estimate(t) for t in (point_times[0], (point_times[0] + point_times[-1]) / 2, point_times[-1])]
+            condition = measurement_condition(point, gradient_method, concentrations[1] / concentrated_anolytes)
+            publish_cv_features(dict(condition, measurement=fileName), features, True)
+            print("Estimated anolyte concentration {:.1f} mmol/L ({:.1f} to {:.1f} mmol/L during the CV)".format(
+                concentrations[1], concentrations[0], concentrations[2]))
+            measurement_store.append(campaign_run_id, 'measurement', condition, potentials, currents,
+                                     {'data_file': fileName + '.txt', 'features': features, 'video_file': base_name + '.mp4',
+                                      'frame_index': base_name + '_frames.csv', 'concentration_range': [concentrations[0], concentrations[2]],
+                                      'return_delay': return_delay})
+            file_paths.append(data_file_path)
+    finally:
+        pass_finished.set()
+        ramp.stop()
+        camera_thread.join()
+    if recordings and recordings[0] is not None and save_frame_index(frame_index_path, recordings[0]['frame_times'], scans):
+        file_paths.append(frame_index_path)
+
+    if bubble_detector is not None and recordings and recordings[0] is not None:
+        bubble_scores[point] = bubble_detector.score()
+        print("Bubble score: {:.4f}".format(bubble_scores[point]))
+    campaign_journal.record('point', point, file_paths)
+
+    print("6. Concentration gradient and video recording finished") 
+
+
+def publish_cv_features(metadata, features, final):
+    # features of the running CV, published by its watcher, to spot bad points during the campaign
+    cv_features[metadata['measurement']] = features
+    if not final:
+        return
+    onset = 'none' if features['onset_potential'] is None else '{:.3f} V'.format(features['onset_potential'])
+    print("CV features: peak {:.3e} A at {:.3f} V, onset {}, charge {:.3e} C".format(
+        features['peak_current'] or 0, features['peak_potential'] or 0, onset, features['charge']))
+    if features['peak_current'] is None or features['peak_current'] < cv_min_peak_current:
+        print("++++++++++++++++++++++++++")
+        print("Check alchol {:.0f} at {:.2f} C: peak current below {:.1e} A".format(metadata['valve_position'], metadata['temp'], cv_min_peak_current))
+        print("++++++++++++++++++++++++++")
+
+
+def remove_bubbles(point):
+    # Remove trapped bubbles, with as many air columns as the bubble score of the measurement calls for
+    n_air_columns = bubble_purge_air_columns(bubble_scores.get(point))
+    if n_air_columns == 0:
+        print("7. No bubbles detected (score {:.4f}), skip the bubble removal".format(bubble_scores[point]))
+        return
+    print ("7. Introduce {} air columns to remove the trapped bubbles".format(n_air_columns))
+    flow_controller.set_all(flow_rate_for_bubble_removal) # set flow rates of A1, A2, B1 and B2
+    wait_for_stable_flow([flow_rate_for_bubble_removal] * 4)
+    
+    for i in range(n_air_columns):
+        # introduce air bubbles
+        fgt_set_valvePosition(valve1_index, 7) # position 7 is the air
+        fgt_set_valvePosition(valve2_index, 1) # position 1 is the air
+        clock.sleep(2)
+        
+        fgt_set_valvePosition(valve1_index, 0) # position 0 is the washing solvent
+        fgt_set_valvePosition(valve2_index, 0) # position 0 is the catholyte, also the washing solvent
+
+        # Wait  
+        wash(bubble_removal_dead_volumes, time_for_bubble_removal)
+    if bubble_detector is not None:
+        bubble_detector.reset_background() # the purged cell is the new background
+
+
+def submit_point(executor, point):
+    # submit the steps of a campaign point, returns the measurement step
+    point_name = '{:.0f}_{:.0f}oC'.format(point.valve_position, point.temp)
+    executor.submit('wash ' + point_name, FLUIDICS, wash_system_for_point, (point,),
+                    span=('wash', point.valve_position, point.temp))
+    equilibrate = executor.submit('equilibrate ' + point_name, ('bath',), equilibrate_temperature, (point.temp,),
+                                  span=('equilibrate', point.valve_position, point.temp))
+    executor.submit('stabilize ' + point_name, FLUIDICS, set_working_flow_rates, (point,), after=(equilibrate,),
+                    span=('stabilize', point.valve_position, point.temp))
+    measure = executor.submit('measure ' + point_name, FLUIDICS + ('bath', 'potentiostat', 'camera'),
+                              run_gradient if measurement_mode == 'gradient' else run_measurement, (point,),
+                              span=('measure', point.valve_position, point.temp))
+    executor.submit('bubble removal ' + point_name, FLUIDICS, remove_bubbles, (point,),
+                    span=('bubble removal', point.valve_position, point.temp))
+    return measure
+
+
+def submit_cleaning(executor, point):
+    # submit the cleaning of the electrode after the alcohol of `point`
+    executor.submit('clean electrode {:.0f}'.format(point.valve_position), FLUIDICS + ('potentiostat',),
+                    clean_electrode, (point.valve_position, point.temp), span=('cleaning', point.valve_position, point.temp))
+
+
+# step executor: every step declares the devices (resources) it holds. A step starts once the
+# earlier submitted steps holding any of its resources, and the steps listed in `after`, are finished,
+# so steps holding different resources (e.g. washing and the bath ramp) run at the same time
+FLUIDICS = ('valve1', 'valve2', 'pump0', 'pump1', 'pump2', 'pump3')
+
+class Step:
+    def __init__(self, name, resources, action, args, waits_for, span):
+        self.name = name
+        self.resources = tuple(resources)
+        self.action = action
+        self.args = args
+        self.waits_for = waits_for
+        self.span = span  # (phase, valve position, temperature) of the timing span, or None
+        self.done = threading.Event()
+        self.failed = False
+        self.duration = 0
+
+
+class StepExecutor:
+    def __init__(self, profiler=None):
+        self.steps = []
+        self.last_holders = {}  # resource -> last submitted step holding it
+        self.error = None
+        self.profiler = profiler
+
+    def submit(self, name, resources, action, args=(), after=(), span=None):
+        waits_for = [self.last_holders[r] for r in resources if r in self.last_holders] + list(after)
+        step = Step(name, resources, action, args, waits_for, span)
+        for r in resources:
+            self.last_holders[r] = step
+        self.steps.append(step)
+        step.thread = threading.Thread(target=self._run_step, args=(step,), name=name, daemon=True)
+        step.thread.start()
+        return step
+
+    def _run_step(self, step):
+        for other in step.waits_for:
+            other.done.wait()
+            if other.failed:
+                # skip the steps depending on a failed step
+                step.failed = True
+                step.done.set()
+                return
+        start_time = clock.time()
+        try:
+            if self.profiler is not None and step.span is not None:
+                with self.profiler.span(*step.span):
+                    step.action(*step.args)
+            else:
+                step.action(*step.args)
+        except Exception as e:
+            print("Step '{}' failed: {}".format(step.name, e))
+            step.failed = True
+            if self.error is None:
+                self.error = (step.name, e)
+        step.duration = clock.time() - start_time
+        step.done.set()
+
+    def wait(self):
+        for step in self.steps:
+            step.thread.join()
+        if self.error is not None:
+            raise RuntimeError("Step '{}' failed".format(self.error[0])) from self.error[1]
+
+
+# runs one step of closing the session: a failed step is reported and the next steps still run, so that the rig
+# is returned to a safe state also after a failure
+def close_safely(name, close, *args):
+    try:
+        close(*args)
+    except Exception as e:
+        print("Closing {} failed: {}".format(name, e))
+
+
+# telemetry functions
+# one telemetry sample: bath temperature and setpoint, flow rates of A1, A2, B1 and B2, valve positions, and whether
+# the potentiostat is running and the camera recording (1) or not (0). Missing readings are NaN
+TELEMETRY_DTYPE = np.dtype([('time', '<f8'), ('bath_temp', '<f4'), ('bath_setpoint', '<f4'), ('flow_rates', '<f4', (4,)),
+                            ('valve_positions', 'i1', (2,)), ('potentiostat', 'u1'), ('camera', 'u1')])
+
+# compact binary telemetry log: a memory-mapped ring buffer of `capacity` samples after a header of two uint64,
+# the capacity and the number of samples written. Once full, the oldest samples are overwritten
+class TelemetryLog:
+    header_size = 16
+
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        with open(path, 'wb') as f:
+            f.truncate(self.header_size + capacity * TELEMETRY_DTYPE.itemsize)
+        self.header = np.memmap(path, dtype='<u8', mode='r+', shape=(2,))
+        self.header[:] = (capacity, 0)
+        self.samples = np.memmap(path, dtype=TELEMETRY_DTYPE, mode='r+', offset=self.header_size, shape=(capacity,))
+
+    def append(self, sample):
+        with self.lock:
+            count = int(self.header[1])
+            self.samples[count % self.capacity] = sample
+            self.header[1] = count + 1
+
+    def flush(self):
+        with self.lock:
+            self.samples.flush()
+            self.header.flush()
+
+    @classmethod
+    def read(cls, path):
+        # samples of a telemetry log file in time order
+        capacity, count = (int(n) for n in np.fromfile(path, dtype='<u8', count=2))
+        samples = np.memmap(path, dtype=TELEMETRY_DTYPE, mode='r', offset=cls.header_size, shape=(capacity,))
+        if count <= capacity:
+            return np.array(samples[:count])
+        return np.concatenate([samples[count % capacity:], samples[:count % capacity]])
+
+
+# records a telemetry sample from `read_sample` every `interval` seconds in a thread
+class TelemetryRecorder:
+    def __init__(self, log, read_sample, interval, flush_interval=60):
+        self.log = log
+        self.read_sample = read_sample
+        self.interval = interval  # s
+        self.flush_interval = flush_interval  # s
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.record_loop, daemon=True)
+        self.thread.start()
+
+    def record_loop(self):
+        last_flush = clock.monotonic()
+        while not clock.wait(self.stop_event, self.interval):
+            try:
+                self.log.append(self.read_sample())
+            except Exception as e:
+                print("Telemetry sample failed:", e)  # the campaign goes on without this sample
+            if clock.monotonic() - last_flush >= self.flush_interval:
+                self.log.flush()
+                last_flush = clock.monotonic()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.log.flush()
+
+
+# timing profiler: every phase of the campaign runs in a span, recorded with the alcohol (valve position) and
+# temperature of its point and appended to a json lines file. The report breaks the wall-clock time down by
+# phase, alcohol and temperature; phases that run at the same time (e.g. wash and equilibrate) overlap
+class PhaseProfiler:
+    def __init__(self, path):
+        self.spans = []  # (phase, valve position, temperature, start time, end time)
+        self.active = {}  # phase -> number of running spans
+        self.lock = threading.Lock()
+        self.file = open(path, 'a')
+
+    @contextlib.contextmanager
+    def span(self, phase, valve_position=None, temp=None):
+        start_time = clock.time()
+        with self.lock:
+            self.active[phase] = self.active.get(phase, 0) + 1
+        try:
+            yield
+        finally:
+            end_time = clock.time()
+            with self.lock:
+                self.active[phase] -= 1
+                self.spans.append((phase, valve_position, temp, start_time, end_time))
+                self.file.write(json.dumps({'phase': phase, 'valve_position': valve_position, 'temp': temp,
+                                            'start': start_time, 'end': end_time}) + '\n')
+                self.file.flush()
+
+    def is_active(self, phases):
+        with self.lock:
+            return any(self.active.get(phase, 0) > 0 for phase in phases)
+
+    @staticmethod
+    def table(spans, title, key_index, phases):
+        # hours of every phase (columns) for every alcohol or temperature (rows)
+        rows = sorted(set(span[key_index] for span in spans if span[key_index] is not None))
+        phases = [phase for phase in phases if any(span[0] == phase and span[key_index] is not None for span in spans)]
+        hours = {}
+        for span in spans:
+            key = (span[key_index], span[0])
+            hours[key] = hours.get(key, 0) + (span[4] - span[3]) / 3600
+        lines = ['{:<12s}'.format(title) + ''.join('{:>19s}'.format(phase) for phase in phases) + '{:>10s}'.format('total h')]
+        for row in rows:
+            values = [hours.get((row, phase), 0) for phase in phases]
+            lines.append('{:<12}'.format(row) + ''.join('{:>19.2f}'.format(value) for value in values) + '{:>10.2f}'.format(sum(values)))
+        return lines
+
+    def report(self, wall_time):
+        with self.lock:
+            spans = list(self.spans)
+        phases = []
+        for span in spans:
+            if span[0] not in phases:
+                phases.append(span[0])
+        lines = ['---- Timing report: wall-clock {:.2f} h (phases overlap, so the shares can add up to more than 100%) ----'.format(wall_time / 3600),
+                 '{:<18s}{:>6s}{:>10s}{:>12s}{:>8s}'.format('phase', 'n', 'total h', 'mean min', 'share')]
+        for phase in phases:
+            durations = [span[4] - span[3] for span in spans if span[0] == phase]
+            lines.append('{:<18s}{:>6d}{:>10.2f}{:>12.1f}{:>7.0f}%'.format(phase, len(durations), sum(durations) / 3600,
+                                                                         sum(durations) / len(durations) / 60, 100 * sum(durations) / wall_time))
+        lines.append('')
+        lines.extend(self.table(spans, 'alchol', 1, phases))
+        lines.append('')
+        lines.extend(self.table(spans, 'temp (C)', 2, phases))
+        return '\n'.join(lines)
+
+    def close(self):
+        self.file.close()
+
+
+# the sampler does not call the Fluigent SDK: the flow rates are the last ones read by a step within the telemetry
+# interval, NaN while no step reads them (e.g. during the bath wait), and the valve positions the last ones set (-1 before)
+def read_telemetry_sample():
+    bath_sample = bath.latest_sample()
+    flow_reading = flow_controller.reading
+    if flow_reading is None or flow_reading[0] < clock.monotonic() - telemetry_interval:
+        flow_reading = None, [float('nan') for _ in flow_controller.channels]
+    return (clock.time(), float('nan') if bath_sample is None else bath_sample[1],
+            float('nan') if bath.setpoint is None else bath.setpoint, flow_reading[1],
+            (fluigent.valve_positions.get(valve1_index, -1), fluigent.valve_positions.get(valve2_index, -1)),
+            profiler.is_active(('measure', 'cleaning', 'activation')), profiler.is_active(('measure',)))
+
+
+# campaign planning functions
+# One campaign point is one CV measurement of the alchol at valve1 position `valve_position` at temperature `temp`
+CampaignPoint = namedtuple('CampaignPoint', ['valve_position', 'temp', 'concentration_anolyte', 'concentration_catholyte',
+                                             'flow_rate_A1', 'flow_rate_A2', 'flow_rate_B1', 'flow_rate_B2'])
+
+def build_campaign_grid(valve_positions, working_temps, concentrations_anolyte, concentrations_catholyte,
+                        flow_A1, flow_A2, flow_B1, flow_B2):
+    # the j-th concentrations and flow rates are used at the j-th working temperature
+    grid = []
+    for valve_position in valve_positions:
+        for j in range(len(working_temps)):
+            grid.append(CampaignPoint(valve_position, working_temps[j], concentrations_anolyte[j], concentrations_catholyte[j],
+                                      flow_A1[j], flow_A2[j], flow_B1[j], flow_B2[j]))
+    return grid
+
+
+# cost model of the water bath: time (s) to ramp between two temperatures and settle
+class BathRampModel:
+    def __init__(self, heating_rate, cooling_rate, settle_time):
+        self.heating_rate = heating_rate  # C/min
+        self.cooling_rate = cooling_rate  # C/min
+        self.settle_time = settle_time    # s, extra time to settle once the ramp is over
+
+    def ramp_time(self, from_temp, to_temp):
+        if from_temp == to_temp:
+            return 0
+        rate = self.heating_rate if to_temp > from_temp else self.cooling_rate
+        return abs(to_temp - from_temp) / rate * 60 + self.settle_time
+
+
+# durations (s) of the steps of a point and of the electrode cleaning, for the planning: the defaults from the
+# parameters until the steps were timed in a campaign, then the mean durations timed by the profiler, averaged over
+# the last campaigns and stored in a JSON file to be reused across runs. A learned duration is dropped once the default
+# of its phase changed, e.g. with other measurement methods
+class StepDurationModel:
+    def __init__(self, defaults, durations=None, n_runs=0):
+        self.defaults = defaults  # phase -> s, e.g. {'wash': 120, 'measure': 175, ...}
+        self.durations = dict(durations or {})  # phase -> s, learned
+        self.n_runs = n_runs  # number of campaigns the durations were learned from
+
+    @classmethod
+    def load(cls, path, defaults):
+        if not os.path.exists(path):
+            return cls(defaults)
+        with open(path) as f:
+            params = json.load(f)
+        durations = {phase: duration for phase, duration in params['durations'].items()
+                     if phase in defaults and params['defaults'].get(phase) == defaults[phase]}
+        return cls(defaults, durations, params['n_runs'])
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'durations': self.durations, 'defaults': self.defaults, 'n_runs': self.n_runs}, f, indent=4)
+
+    def duration(self, phase):
+        return self.durations.get(phase, self.defaults[phase])
+
+    def learn(self, spans, max_runs=10):
+        # spans: (phase, valve position, temperature, start time, end time) of the profiler
+        # returns the mean duration of every phase timed in this campaign
+        means = {}
+        for phase in self.defaults:
+            durations = [span[4] - span[3] for span in spans if span[0] == phase]
+            if durations:
+                means[phase] = sum(durations) / len(durations)
+        if not means:
+            return means
+        # running average over the last `max_runs` campaigns, so the durations follow changes of the rig
+        n = min(self.n_runs, max_runs - 1)
+        for phase, mean in means.items():
+            self.durations[phase] = (self.durations[phase] * n + mean) / (n + 1) if phase in self.durations else mean
+        self.n_runs += 1
+        return means
+
+
+def order_campaign(grid, strategy, start_temp):
+    valve_order = []
+    temps = []
+    points = {}
+    for point in grid:
+        if point.valve_position not in valve_order:
+            valve_order.append(point.valve_position)
+        if point.temp not in temps:
+            temps.append(point.temp)
+        points.setdefault((point.valve_position, point.temp), []).append(point)
+    temps.sort()
+
+    # start the temperature walk from the end closest to the current bath temperature
+    if abs(temps[-1] - start_temp) < abs(temps[0] - start_temp):
+        temps.reverse()
+
+    plan = []
+    if strategy == 'alcohol_ascending':
+        # the original order: every alchol walks the temperatures from low to high
+        for valve_position in valve_order:
+            for temp in sorted(temps):
+                plan.extend(points.get((valve_position, temp), []))
+    elif strategy == 'alcohol_serpentine':
+        # every alchol walks the temperatures, reversing direction for the next alchol
+        for i, valve_position in enumerate(valve_order):
+            for temp in (temps if i % 2 == 0 else temps[::-1]):
+                plan.extend(points.get((valve_position, temp), []))
+    elif strategy == 'temperature_grouped':
+        # measure all alchols at one equilibrated temperature, reversing the alchol order
+        # at the next temperature so that the last alchol is measured again first
+        for i, temp in enumerate(temps):
+            for valve_position in (valve_order if i % 2 == 0 else valve_order[::-1]):
+                plan.extend(points.get((valve_position, temp), []))
+    else:
+        raise ValueError("Unknown campaign ordering strategy: {}".format(strategy))
+    return plan
+
+
+def estimate_campaign_time(plan, ramp_model, start_temp, end_temp, point_time, cleaning_time, overlap_time=0):
+    # point_time: time (s) of washing, flow stabilization, measurement and bubble removal of one point
+    # cleaning_time: time (s) of flushing and cleaning the electrode after each alchol
+    # overlap_time: part of point_time (s) that runs while the bath ramps, the cleaning also overlaps with the ramp
+    total_time = 0
+    current_temp = start_temp
+    previous_valve_position = None
+    for point in plan:
+        fluidics_time = overlap_time
+        if previous_valve_position is not None and point.valve_position != previous_valve_position:
+            fluidics_time += cleaning_time
+        if overlap_time > 0:
+            total_time += max(ramp_model.ramp_time(current_temp, point.temp), fluidics_time) + point_time - overlap_time
+        else:
+            total_time += ramp_model.ramp_time(current_temp, point.temp) + fluidics_time + point_time
+        current_temp = point.temp
+        previous_valve_position = point.valve_position
+    if plan:
+        total_time += cleaning_time
+    total_time += ramp_model.ramp_time(current_temp, end_temp)
+    return total_time
+
+
+def campaign_costs(plan, ramp_model, start_temp, end_temp):
+    # time (s) of the bath ramps and number of electrode cleanings of a plan, the two costs traded off by the orders
+    temps = [start_temp] + [point.temp for point in plan] + [end_temp]
+    ramp_time = sum(ramp_model.ramp_time(from_temp, to_temp) for from_temp, to_temp in zip(temps[:-1], temps[1:]))
+    n_cleanings = sum(1 for previous, point in zip(plan[:-1], plan[1:]) if point.valve_position != previous.valve_position) + (1 if plan else 0)
+    return ramp_time, n_cleanings
+
+
+def plan_campaign(grid, ramp_model, start_temp, end_temp, point_time, cleaning_time, overlap_time=0,
+                  strategies=('alcohol_ascending', 'alcohol_serpentine', 'temperature_grouped')):
+    # order the campaign points with every strategy and keep the fastest one. The estimate counts both the bath ramps
+    # and the cleaning after every change of alchol: grouping by alchol cleans least, but ramps the bath over the whole
+    # temperature range for every alchol, while grouping by temperature cleans at every point but ramps only once
+    print('---- Campaign planning: {} points ----'.format(len(grid)))
+    best_plan, best_time, best_strategy = None, None, None
+    for strategy in strategies:
+        plan = order_campaign(grid, strategy, start_temp)
+        estimated_time = estimate_campaign_time(plan, ramp_model, start_temp, end_temp, point_time, cleaning_time, overlap_time)
+        ramp_time, n_cleanings = campaign_costs(plan, ramp_model, start_temp, end_temp)
+        print('{:<22s} estimated campaign time: {:6.2f} h (bath ramps {:.2f} h, {} cleanings of {:.1f} min)'.format(
+            strategy, estimated_time / 3600, ramp_time / 3600, n_cleanings, cleaning_time / 60))
+        if best_time is None or estimated_time < best_time:
+            best_plan, best_time, best_strategy = plan, estimated_time, strategy
+    print('Selected order: {} ({:.2f} h)'.format(best_strategy, best_time / 3600))
+    return best_plan, best_time
+
+
+def build_candidate_grid(grid):
+    # every alcohol at every temperature with every composition (concentrations and flow rates) of the grid
+    temps = sorted(set(point.temp for point in grid))
+    compositions = sorted(set(point[2:] for point in grid))
+    valve_positions = sorted(set(point.valve_position for point in grid))
+    return [CampaignPoint(valve_position, temp, *composition) for valve_position in valve_positions for temp in temps for composition in compositions]
+
+
+# adaptive sampler: a Bayesian linear surrogate of ln(peak current) for every alcohol, on the standardized inverse
+# temperature, logarithms of the concentrations and the total anolyte flow rate (the features that vary in the
+# candidates). The next point is the one with the largest information gain per time, including the bath ramp
+# and the electrode cleaning when the alcohol changes. The sampling stops when the standard deviation of the
+# activation energy of every alcohol is below `target_ea_std`, or after `max_points` points
+class AdaptiveSampler:
+    def __init__(self, candidates, ramp_model, point_time, cleaning_time, noise=0.05, prior_std=3, target_ea_std=2, max_points=None):
+        self.candidates = list(candidates)
+        self.ramp_model = ramp_model
+        self.point_time = point_time  # s
+        self.cleaning_time = cleaning_time  # s
+        self.noise = noise  # standard deviation of ln(peak current)
+        self.prior_std = prior_std  # prior standard deviation of the coefficients
+        self.target_ea_std = target_ea_std  # kJ/mol
+        self.max_points = max_points if max_points is not None else len(self.candidates)
+        raw = np.array([self.raw_features(point) for point in self.candidates])
+        self.mean = raw.mean(axis=0)
+        self.scale = raw.std(axis=0)
+        self.columns = np.nonzero(self.scale > 0)[0]  # features that vary
+        self.observations = {}  # valve position -> (features, ln(peak current))
+        self.measured = set()
+
+    @staticmethod
+    def raw_features(point):
+        return [1000 / (point.temp + 273.15), math.log(point.concentration_anolyte), math.log(point.concentration_catholyte),
+                point.flow_rate_A1 + point.flow_rate_A2]
+
+    def features(self, point):
+        z = (np.array(self.raw_features(point)) - self.mean)[self.columns] / self.scale[self.columns]
+        return np.concatenate([[1.0], z])
+
+    def add(self, point, peak_current):
+        self.measured.add(point)
+        if peak_current is None or peak_current <= 0:
+            return  # no logarithm
+        phis, ys = self.observations.setdefault(point.valve_position, ([], []))
+        phis.append(self.features(point))
+        ys.append(math.log(peak_current))
+
+    def posterior(self, valve_position):
+        # mean and covariance of the coefficients, and the noise variance, estimated from the residuals once there
+        # are more points than coefficients
+        n_coefficients = len(self.columns) + 1
+        phis, ys = self.observations.get(valve_position, ([], []))
+        phi = np.array(phis).reshape(-1, n_coefficients)
+        y = np.array(ys)
+        noise_var = self.noise ** 2
+        for i in range(2):
+            covariance = np.linalg.inv(phi.T @ phi / noise_var + np.eye(n_coefficients) / self.prior_std ** 2)
+            mean = covariance @ phi.T @ y / noise_var
+            if len(y) <= n_coefficients:
+                break
+            noise_var = max(self.noise ** 2, np.sum((y - phi @ mean) ** 2) / (len(y) - n_coefficients))
+        return mean, covariance, noise_var
+
+    def activation_energy(self, valve_position):
+        # activation energy and its standard deviation in kJ/mol, None without varying temperatures
+        if 0 not in self.columns:
+            return None, None
+        mean, covariance, noise_var = self.posterior(valve_position)
+        # d ln(i) / d(1/T) = coefficient * 1000 / scale, Ea = -R * d ln(i) / d(1/T)
+        factor = 8.314 * 1000 / self.scale[0] / 1000
+        return -mean[1] * factor, math.sqrt(covariance[1, 1]) * factor
+
+    def is_converged(self, valve_position):
+        ea, ea_std = self.activation_energy(valve_position)
+        return ea_std is not None and ea_std <= self.target_ea_std
+
+    def information_gain(self, point):
+        # expected reduction of the entropy of the coefficients by measuring the point, in nats
+        mean, covariance, noise_var = self.posterior(point.valve_position)
+        phi = self.features(point)
+        return 0.5 * math.log(1 + phi @ covariance @ phi / noise_var)
+
+    def next_point(self, previous_point, current_temp):
+        if len(self.measured) >= self.max_points:
+            return None
+        best_point, best_score = None, 0
+        for point in self.candidates:
+            if point in self.measured or self.is_converged(point.valve_position):
+                continue
+            cost = self.point_time + self.ramp_model.ramp_time(current_temp, point.temp)
+            if previous_point is not None and point.valve_position != previous_point.valve_position:
+                cost += self.cleaning_time
+            score = self.information_gain(point) / cost
+            if score > best_score:
+                best_point, best_score = point, score
+        return best_point
+
+    def summary(self):
+        lines = []
+        for valve_position in sorted(set(point.valve_position for point in self.candidates)):
+            n_measured = len([point for point in self.measured if point.valve_position == valve_position])
+            ea, ea_std = self.activation_energy(valve_position)
+            lines.append('Alchol {:.0f}: {} points, Ea = {}'.format(valve_position, n_measured,
+                         '--' if ea is None else '{:.1f} +/- {:.1f} kJ/mol'.format(ea, ea_std)))
+        return lines
+
+
+# checkpoint functions
+def file_checksum(file_path, block_size=1 << 20):
+    # sha256 of a data or video file, None if the file does not exist
+    if not os.path.exists(file_path):
+        return None
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# append-only journal with one json line per completed step: the step, its key (e.g. the campaign point), the time
+# and the checksums of the files it wrote. Every record is flushed and fsync'd, so that a crash loses at most the
+# step that was running
+class CampaignJournal:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.records = self.read(path)
+        self.file = open(path, 'a')
+
+    @staticmethod
+    def read(path):
+        records = []
+        if not os.path.exists(path):
+            return records
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    print('Journal {}: skip incomplete record {!r}'.format(path, line.strip()))  # torn write of a crash
+        return records
+
+    @staticmethod
+    def archive(path):
+        # move a finished journal aside, so that a new campaign starts with an empty one
+        if os.path.exists(path):
+            root, ext = os.path.splitext(path)
+            archive_path = root + time.strftime('_%Y%m%d_%H%M%S', time.localtime(os.path.getmtime(path))) + ext
+            os.rename(path, archive_path)
+            print('Previous journal archived to {}'.format(archive_path))
+
+    def record(self, step, key, files=()):
+        directory = os.path.dirname(self.path)
+        record = {'step': step, 'key': list(key), 'time': clock.time(),
+                  'files': {os.path.relpath(file_path, directory): file_checksum(file_path) for file_path in files}}
+        for file_name, checksum in record['files'].items():
+            if checksum is None:
+                print('Journal: {} {} did not write {}'.format(step, record['key'], file_name))
+        with self.lock:
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.records.append(record)
+
+    def is_complete(self, step, key):
+        # True if the step was journaled and all the files it wrote are still there, unchanged
+        key = list(key)
+        directory = os.path.dirname(self.path)
+        with self.lock:
+            records = [record for record in self.records if record['step'] == step and record['key'] == key]
+        if not records:
+            return False
+        for file_name, checksum in records[-1]['files'].items():
+            if checksum is None:
+                print('Journal: {} {} is repeated, {} was not written'.format(step, key, file_name))
+                return False
+            if file_checksum(os.path.join(directory, file_name)) != checksum:
+                print('Journal: {} {} is repeated, {} is missing or changed'.format(step, key, file_name))
+                return False
+        return True
+
+    def close(self):
+        self.file.close()
+
+
+# multi-rig functions, used by the coordinator script through the 'plan' and 'merge' modes
+def save_campaign_definition(path, grid, ramp_model, start_temp, point_time, cleaning_time, overlap_time):
+    # the campaign points, grouped by alcohol with the estimated time of every group, to shard them across the rigs
+    groups = []
+    for valve_position in sorted(set(point.valve_position for point in grid)):
+        group = [point for point in grid if point.valve_position == valve_position]
+        plan = order_campaign(group, 'alcohol_ascending', start_temp)
+        groups.append({'valve_position': valve_position, 'points': [list(point) for point in plan],
+                       'estimated_time': estimate_campaign_time(plan, ramp_model, start_temp, start_temp, point_time, cleaning_time, overlap_time)})
+    with open(path, 'w') as f:
+        json.dump({'points': [list(point) for point in grid], 'groups': groups}, f, indent=4)
+    print('Campaign definition saved to {}: {} points, {} alcohols'.format(path, len(grid), len(groups)))
+
+
+def merge_measurement_stores(stores, output_folder):
+    # copy the curves of the rig stores, stores: (rig name, rig data folder), into the store of `output_folder`.
+    # The data files are referred to relative to `output_folder`, and curves merged before are skipped
+    merged = MeasurementStore(os.path.join(output_folder, 'measurement_store'))
+    merged_keys = set((record['run_id'], record['kind'], record['attributes'].get('time')) for record in merged.query())
+    for rig_name, rig_folder in stores:
+        store_path = os.path.join(rig_folder, 'measurement_store')
+        if not os.path.exists(store_path):
+            print('{}: no measurement store'.format(rig_name))
+            continue
+        store = MeasurementStore(store_path)
+        n_merged = 0
+        for record in store.query():
+            if (record['run_id'], record['kind'], record['time']) in merged_keys:
+                continue
+            attributes = dict(record['attributes'], rig=rig_name, time=record['time'])
+            for key in ('data_file', 'video_file', 'frame_index'):
+                if attributes.get(key) is not None:
+                    attributes[key] = os.path.relpath(os.path.join(rig_folder, attributes[key]), output_folder)
+            if 'data_files' in attributes:
+                attributes['data_files'] = [os.path.relpath(os.path.join(rig_folder, name), output_folder) for name in attributes['data_files']]
+            potentials, currents = store.curve(record)
+            merged.append(record['run_id'], record['kind'], record['condition'], potentials, currents, attributes)
+            n_merged += 1
+        store.close()
+        print('{}: {} curves merged'.format(rig_name, n_merged))
+    merged.close()
+
+
+
+# device bring-up functions
+class DeviceError(Exception):
+    pass
+
+
+# bring-up of the devices: every device is connected and probed in its own thread, so that the slow steps (loading
+# the SDKs, the reset of the serial port, the camera enumeration) overlap. The campaign starts only once all devices
+# answered their probe, before any reagent is used
+class DeviceBringUp:
+    def __init__(self, timeout):
+        self.timeout = timeout  # s, for every device to connect and answer its probe
+        self.devices = []  # (name, connect, probe, close)
+        self.results = {}  # name -> (device, probe reply, error, time in s)
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+    def add(self, name, connect, probe, close):
+        # connect() returns the device, probe(device) a short description of its state, close(device) releases it
+        self.devices.append((name, connect, probe, close))
+
+    def bring_up(self, name, connect, probe):
+        start_time = clock.monotonic()
+        device = reply = error = None
+        try:
+            device = connect()
+            reply = probe(device)
+        except Exception as e:
+            error = e
+        with self.lock:
+            self.results[name] = (device, reply, error, clock.monotonic() - start_time)
+            if len(self.results) == len(self.devices):
+                self.finished.set()
+
+    def run(self):
+        # returns the devices by name. If a device is not ready, the devices that are get closed and DeviceError is raised
+        start_time = clock.monotonic()
+        for name, connect, probe, close in self.devices:
+            # daemon threads, so that a device that hangs does not keep the script alive
+            threading.Thread(target=self.bring_up, args=(name, connect, probe), name='bring-up ' + name, daemon=True).start()
+        self.finished.wait(clock.real_timeout(self.timeout))
+        with self.lock:
+            results = dict(self.results)
+        self.report(results, clock.monotonic() - start_time)
+
+        failed = [name for name, connect, probe, close in self.devices if name not in results or results[name][2] is not None]
+        if failed:
+            for name, connect, probe, close in self.devices:
+                if name in results and results[name][0] is not None:
+                    try:
+                        close(results[name][0])
+                    except Exception as e:
+                        print("Closing {} failed:".format(name), e)
+            raise DeviceError("Devices not ready: " + ', '.join(failed))
+        return {name: results[name][0] for name in results}
+
+    def report(self, results, total_time):
+        print('***********************************')
+        print('{:<14s}{:>10s}   {}'.format('Device', 'Time (s)', 'Status'))
+        for name, connect, probe, close in self.devices:
+            if name not in results:
+                print('{:<14s}{:>10s}   NO ANSWER within {:.0f} s'.format(name, '-', self.timeout))
+                continue
+            device, reply, error, elapsed_time = results[name]
+            status = 'ready, ' + reply if error is None else 'FAILED: {}: {}'.format(type(error).__name__, error)
+            print('{:<14s}{:>10.2f}   {}'.format(name, elapsed_time, status))
+        print('Device bring-up finished in {:.2f} s'.format(total_time))
+        print('***********************************')
+
+
+def connect_fluigent():
+    # the Fluigent SDK (or the simulated instruments), with the instruments of this rig initialized
+    fluigent = simulated_fluigent if simulate else importlib.import_module('Fluigent.SDK')
+    if fluigent_instruments is None:
+        fluigent.fgt_init()
+    else:
+        fluigent.fgt_init(fluigent_instruments) # only the instruments of this rig
+    return fluigent
+
+
+def probe_fluigent(fluigent):
+    # read every flow sensor, and switch both valves to the position they are at
+    flow_rates = [fluigent.fgt_get_sensorValue(channel) for channel in range(4)]
+    n_valves = fluigent.fgt_get_valveChannelCount()
+    if n_valves < 2:
+        raise DeviceError("{} valve channels found, 2 needed".format(n_valves))
+    positions = []
+    for valve_index in (valve1_index, valve2_index):
+        position = fluigent.fgt_get_valvePosition(valve_index)
+        fluigent.fgt_set_valvePosition(valve_index, position)
+        if fluigent.fgt_get_valvePosition(valve_index) != position:
+            raise DeviceError("Valve {} did not return to position {}".format(valve_index, position))
+        positions.append(position)
+    return 'flow rates {} uL/min, valves at positions {}'.format(', '.join('{:.0f}'.format(flow_rate) for flow_rate in flow_rates),
+                                                              ', '.join(str(position) for position in positions))
+
+
+def connect_bath():
+    # the SC150 bath on its serial port, or the emulator
+    if simulate:
+        port = simulated_bath
+    elif bath_port == 'emulator':
+        port = SC150Emulator()
+    else:
+        serial = importlib.import_module('serial')
+        port = serial.Serial(bath_port, baudrate=19200, bytesize=8, timeout=1)
+        clock.sleep(2) # the controller resets when the port opens
+    print('Serial connection established on {}'.format(port.name))
+    return SC150Bath(port, bath_poll_interval)
+
+
+def probe_bath(bath):
+    return '{:.2f} C, setpoint {:.2f} C'.format(bath.read_temperature(), bath.read_setpoint())
+
+
+def connect_potentiostat():
+    # hardpotato (or the simulated potentiostat), set up for the data folder
+    global hp
+    if simulate:
+        hp = types.SimpleNamespace(potentiostat=SimulatedPotentiostat(simulated_fluigent, simulated_bath, folder_path, concentrated_anolytes,
+                                                                      simulated_potentiostat_failure, simulation_seed, simulated_return_delay))
+    else:
+        if not os.path.exists(path):
+            raise DeviceError("CHI software not found at {}".format(path))
+        hp = importlib.import_module('hardpotato')
+    hp.potentiostat.Setup(model=model, path=path, folder=folder_path)
+    return hp.potentiostat
+
+
+def probe_potentiostat(potentiostat):
+    # the potentiostat software writes the data files into the data folder
+    if not os.access(folder_path, os.W_OK):
+        raise DeviceError("Data folder {} is not writable".format(folder_path))
+    return '{}, data saved to {}'.format(model, folder_path)
+
+
+def connect_camera():
+    global mvsdk
+    if simulate:
+        return FakeCamera(simulated_frame_size[0], simulated_frame_size[1], bubble_rate=simulated_bubble_rate, seed=simulation_seed)
+    if camera_backend == 'fake':
+        return FakeCamera()
+    mvsdk = importlib.import_module('mvsdk')
+    return MvsdkCamera(camera_index)
+
+
+def probe_camera(camera_device):
+    # acquire one frame
+    raw_buffer = camera_device.alloc(camera_device.frame_buffer_size)
+    try:
+        camera_device.acquire(raw_buffer)
+    finally:
+        camera_device.free(raw_buffer)
+    return 'frame acquired'
 
 
 
 ### Experimental parameter settings ###--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
+## Set rig ##
+# On several rigs, the script is started by the multi-rig coordinator with a rig configuration file:
+# python "Python script for automated CV tests at various Temperatures.py" rig_config.json
+# The configuration selects the mode and the devices of the rig, and overrides the rig settings marked below
+rig_config = {}
+if len(sys.argv) > 1:
+    with open(sys.argv[1]) as f:
+        rig_config = json.load(f)
+rig_mode = rig_config.get('mode', 'run') # 'run' the campaign, save its 'plan', or 'merge' the measurement stores of the rigs
+rig_name = rig_config.get('name', 'rig_1')
+
+## Set simulation ##
+simulate = rig_config.get('simulate', False) # True: dry-run the campaign on simulated devices, without the device packages
+simulation_speed = 2000 # the virtual clock of the simulation runs at most this many times faster than real time
+simulation_seed = rig_config.get('simulation_seed', 0) # seed of the noise of the simulated devices, None for new noise in every run
+simulated_bath_time_constant = 600 #unit: seconds, thermal time constant of the simulated bath
+simulated_flow_time_constant = 3 #unit: seconds, time constant of the simulated flow rate regulation
+simulated_frame_size = (320, 240) # width and height of the simulated camera frames
+simulated_frame_rate = 2 #unit: frames/s, the simulated frames are drawn and analysed in real CPU time, so they are fewer than the camera's
+simulated_bubble_rate = 0.5 # mean number of bubbles per simulated recording
+simulated_return_delay = 3 #unit: seconds, time the simulated CHI software takes to return after the scan
+simulated_potentiostat_failure = rig_config.get('simulated_potentiostat_failure') # number of CVs after which the simulated potentiostat crashes, None to never crash
+
+clock = VirtualClock(simulation_speed) if simulate else Clock()
+
 ## Set Temparatures ##
 set_working_temps = [10, 20, 30, 40, 50] 
 set_initial_temp = 20 
@@ -129,8 +2784,8 @@ for i in range(len(concentration_catholytes)):
     dilution_factor_catholytes.append(concentration_catholytes[i]/concentrated_catholytes)
 
 ## Set working flow rates of two elecrolytes ##
-flow_rate_anolytes = [300, 300, 300, 300]   # =  A1 + A2, Working electrode
-flow_rate_catholytes = [300, 300, 300, 300]     # =  B1 + B2, Counter electrode
+flow_rate_anolytes = [300, 300, 300, 300, 300]   # =  A1 + A2, Working electrode
+flow_rate_catholytes = [300, 300, 300, 300, 300]     # =  B1 + B2, Counter electrode
 flow_rate_A1 = []  #concentrated_anolyte
 flow_rate_A2 = []  #diluton_anolyte
 flow_rate_B1 = []  #concentrated_anolyte
@@ -146,26 +2801,92 @@ for i in range(len(dilution_factor_anolytes)):
 time_for_bubble_removal = 60 #unit: seconds
 time_for_washing = 60 #unit: seconds
 time_for_flushing_electrode = 30 #unit: seconds
-time_for_flow_rate_stable = 30 #unit: seconds
+time_for_flow_rate_stable = 30 #unit: seconds, expected time for the flow rates to stabilize, used for planning
+
+## Set rig configuration ##
+fluigent_instruments = rig_config.get('fluigent_instruments') # serial numbers of the Fluigent instruments of this rig, None for all connected
+dead_volumes = {'A1': 65, 'A2': 65, 'B1': 65, 'B2': 65} #unit: uL, volume of each line from the valves to the outlet of the flow cell
+device_bring_up_timeout = 120 #unit: seconds, for every device to connect and answer its health probe
+
+## Set washing ##
+wash_mode = 'volume' # 'volume': wash until the lines delivered the dead volumes below, 'time': wash for the fixed times above
+washing_dead_volumes = 3 # dead volumes per line for washing the system
+flushing_dead_volumes = 3 # dead volumes per line for flushing the electrode
+bubble_removal_dead_volumes = 6 # dead volumes per line for pushing the air columns out
+wash_timeout = 600 #unit: seconds, give up if the volume is not delivered by then (clog, empty reservoir)
+
+## Set flow controller ##
+flow_regulation_response_time = 60 #unit: seconds, response time of the flow rate regulation
+flow_concurrent_calls = rig_config.get('flow_concurrent_calls', False) # True: issue the calls to the four channels concurrently, only once checked on the rig that the Fluigent SDK accepts calls from several threads
+
+## Set flow stabilization detection ##
+flow_sample_interval = 0.5 #unit: seconds, time between two readings of the flow sensors
+flow_stable_window = 5 #unit: seconds, time the readings have to stay within the tolerance
+flow_tolerance = 0.05 # relative to the setpoint
+flow_abs_tolerance = 5 #unit: uL/min, smallest tolerance, used for low setpoints
+flow_max_std = 3 #unit: uL/min, largest standard deviation of the readings accepted as stable
+flow_stable_timeout = 120 #unit: seconds, give up if the flow rates are not stable by then (clog, empty reservoir)
 
 flow_rate_for_waiting_temp = 50 #unit: uL/min
 flow_rate_for_flushing_electrode = 600 #unit: uL/min
 flow_rate_for_cleaning_electrode_with_CVs = 150 #unit: uL/min
 flow_rate_for_bubble_removal = 400 #unit: uL/min
 flow_rate_for_washing_system = 200 #unit: uL/min    
+
+## Set water bath connection and temperature settle detection ##
+bath_port = rig_config.get('bath_port', 'COM5') # serial port of the SC150 controller, 'emulator' for the SC150Emulator stand-in
+bath_poll_interval = 1 #unit: seconds, time between two temperature readings
+bath_sample_timeout = 30 #unit: seconds, longest time without a temperature reading before giving up
+bath_temp_tolerance = 0.1 #unit: C, readings within the setpoint +/- tolerance are in the band
+bath_max_temp_rate = 0.05 #unit: C/min, largest temperature drift accepted as settled
+bath_dwell_time = 10 #unit: seconds, time the readings have to stay in the band
+
+## Set water bath setpoint boosting ##
+bath_max_boost = 5 #unit: C, largest overdrive of the setpoint beyond the target temperature, 0 to disable boosting
+bath_setpoint_limits = (5, 80) #unit: C, lowest and highest setpoint sent to the bath
+bath_boost_lead_time = 30 #unit: seconds, set the setpoint back to the target this long before the target is reached
     
 ## Set electrochemical workstation parameters ##
 # Select the potentiostat model to use:
 model = 'chi760e'
 # Pauth to the chi software, including extension .exe
-path = 'C:\Software\Workstation\chi660e\chi660e.exe'
+path = rig_config.get('chi_path', 'C:\Software\Workstation\chi660e\chi660e.exe')
 
 # Folder where to save the data
 dir_path = os.path.dirname(os.path.abspath(__file__))
 folder='test'
+if simulate:
+    folder = folder + '_simulation' # keep the synthetic data apart from the measurements
+folder = rig_config.get('folder', folder)
 folder_path = os.path.join(dir_path, folder)
 os.makedirs(folder_path, exist_ok=True)
 
+# Thermal model of the bath, learned during the ramps and reused across runs
+bath_model_path = os.path.join(dir_path, 'bath_thermal_model_simulation.json' if simulate else 'bath_thermal_model.json')
+bath_model_path = rig_config.get('bath_model_path', bath_model_path) # every rig has its own bath
+bath_thermal_model = BathThermalModel.load(bath_model_path)
+bath_ramp_controller = BathRampController(bath_thermal_model, bath_max_boost, bath_setpoint_limits[0], bath_setpoint_limits[1], bath_boost_lead_time)
+
+# Checkpoint journal of the campaign, to resume after a crash without repeating the completed points
+resume_campaign = rig_config.get('resume', False) # True: continue the campaign of the journal; False: archive the journal and start a new campaign
+campaign_journal_path = os.path.join(folder_path, 'campaign_journal.jsonl')
+# Log of the electrode activations, kept across campaigns
+electrode_id = rig_config.get('electrode_id', 'electrode_1') # change for a new electrode, which is then activated
+skip_logged_activation = True # True: skip the activation if the electrode log shows it already happened
+electrode_log_path = os.path.join(folder_path, 'electrode_log.jsonl')
+
+# Store of all curves with their conditions, for the analysis across campaigns
+measurement_store_path = os.path.join(folder_path, 'measurement_store')
+store_chunk_points = 1 << 18 # data points per chunk file of the store
+campaign_run_id = rig_config.get('run_id', time.strftime('%Y%m%d_%H%M%S', time.localtime(clock.time()))) # ID of this run in the store
+
+# Telemetry of the devices and timing of the campaign phases
+telemetry_interval = 5 #unit: seconds, interval of the telemetry samples
+telemetry_capacity = 1 << 18 # samples kept in the ring buffer of the telemetry log (15 days at 5 s)
+telemetry_path = os.path.join(folder_path, 'telemetry_{}.bin'.format(campaign_run_id))
+timing_spans_path = os.path.join(folder_path, 'timing_spans_{}.jsonl'.format(campaign_run_id))
+timing_report_path = os.path.join(folder_path, 'timing_report_{}.txt'.format(campaign_run_id))
+
 # CV measurements
 Eini = 0.2     # V, initial potential
 Ev1 = 0.55       # V, first vertex potential
@@ -178,7 +2899,38 @@ sens = 1e-4     # A/V, current sensitivity
 E2 = 0.5        # V, potential of the second working electrode
 sens2 = 1e-4    # A/V, current sensitivity of the second working electrode 
 
-measurement_time =  (Ev1 - Eini) / sr * nSweeps # Measurement time for each CV or LSV test (s)
+
+# Measurement batch of every point: the methods run back to back at every dilution, while the cell is held at temperature.
+# Every method at every dilution gets its own data file and video; the first method at the first dilution stands for the point
+measurement_methods = [MeasurementMethod('CV', Eini, Ev1, Ev2, Efin, sr, dE, nSweeps, sens)]
+# e.g. a scan rate series and an LSV:
+# measurement_methods = [MeasurementMethod('CV', Eini, Ev1, Ev2, Efin, rate, dE, nSweeps, sens) for rate in (0.002, 0.005, 0.01)] + \
+#                       [MeasurementMethod('LSV', Eini, None, None, 0.7, sr, dE, None, sens)]
+measurement_dilutions = [None] # fractions of the concentrated anolyte A1 in A1 + A2, None for the flow rates of the point, e.g. [None, 0.25, 0.75]
+dilution_dead_volumes = 3 # dead volumes per line for replacing the solution in the flow cell after a dilution change
+time_for_dilution_change = 60 #unit: seconds, replacing the solution in the fixed time wash mode
+
+# Concentration gradient: instead of the batch, fast CVs run during a ramp of the fraction of the concentrated anolyte
+# at the total flow rate of the point, each tagged with the concentration at the electrode estimated from the measured flow rates
+measurement_mode = 'batch' # 'batch': the measurement batch at every point; 'gradient': the concentration gradient at every point
+gradient_fractions = (0.1, 1.0) # fractions of the concentrated anolyte A1 in A1 + A2 at the start and the end of the ramp, from 0 (diluent only) to 1 (no diluent)
+gradient_ramp_time = 1200 #unit: seconds, time of the ramp
+gradient_step_interval = 5 #unit: seconds, time between two flow rate steps of the ramp
+gradient_cv_interval = 60 #unit: seconds, time between the starts of two fast CVs
+gradient_method = MeasurementMethod('CV', Eini, Ev1, Ev2, Efin, 0.05, dE, 1, sens) # fast CV of the gradient
+gradient_delay_volume = 40 #unit: uL, volume from the junction of A1 and A2 to the electrode
+gradient_mixing_volume = 10 #unit: uL, volume over which the anolyte mixes in the inlet and the cell
+
+if not all(0 <= fraction <= 1 for fraction in gradient_fractions + tuple(dilution for dilution in measurement_dilutions if dilution is not None)):
+    raise Exception("The gradient fractions and measurement dilutions are fractions of A1 in A1 + A2, between 0 and 1")
+
+if measurement_mode == 'gradient':
+    measurement_time = time_for_flow_rate_stable + time_for_dilution_change + gradient_ramp_time + \
+                       (gradient_delay_volume + 3 * gradient_mixing_volume) / min(flow_rate_anolytes) * 60 + method_time(gradient_method) # Measurement time of the gradient (s)
+else:
+    n_dilution_changes = len(measurement_dilutions) - (measurement_dilutions[0] is None)
+    measurement_time = sum(method_time(method) for method in measurement_methods) * len(measurement_dilutions) + \
+                       n_dilution_changes * (time_for_flow_rate_stable + time_for_dilution_change) # Measurement time of the batch (s)
       
 # CVs for electrode cleaning
 Eini_cleaning = 0.2     # V, initial potential
@@ -187,11 +2939,17 @@ Ev2_cleaning = 0.2      # V, second vertex potential
 Efin_cleaning = 0.2     # V, final potential
 sr_cleaning = 0.1         # V/s, scan rate
 dE_cleaning = 0.001      # V, potential increment
-nSweeps_cleaning = 100     # number of sweeps 
+nSweeps_cleaning = 100     # number of sweeps, at most: the cleaning stops earlier once the cycles converge
 sens_cleaning = 1e-3     # A/V, current sensitivity
 E2_cleaning = 0.5        # V, potential of the second working electrode
 sens2_cleaning = 1e-4    # A/V, current sensitivity of the second working electrode
 
+# Convergence check of the cleaning and activation CVs
+cleaning_chunk_sweeps = 10 # sweeps per chunk, even for full cycles
+cleaning_min_sweeps = 20 # sweeps before the convergence is checked
+cleaning_max_drift = 0.01 # largest relative change of the peak current between the last two cycles
+cleaning_min_correlation = 0.999 # smallest correlation between the currents of the last two cycles
+
 # CVs for electrode activation 
 Eini_activation  = 0.4     # V, initial potential
 Ev1_activation  = 0.7       # V, first vertex potential
@@ -199,399 +2957,299 @@ Ev2_activation  = 0.4      # V, second vertex potential
 Efin_activation  = 0.4     # V, final potential
 sr_activation  = 0.1         # V/s, scan rate
 dE_activation  = 0.001      # V, potential increment
-nSweeps_activation  = 200     # number of sweeps 
+nSweeps_activation  = 200     # number of sweeps, at most: the activation stops earlier once the cycles converge
 sens_activation = 1e-2     # A/V, current sensitivity
 E2_activation = 0.5        # V, potential of the second working electrode
 sens2_activation = 1e-4    # A/V, current sensitivity of the second working electrode
 
 
+## Set camera ##
+camera_backend = 'mvsdk' # 'mvsdk' for the MindVision camera, 'fake' for the FakeCamera benchmark backend
+camera_index = rig_config.get('camera_index', 0) # index of the camera of this rig among the connected cameras
+camera_frame_rate = 25 #unit: frames/s, acquisition rate and frame rate of the video
+camera_buffer_pool_size = 8 # number of preallocated frame buffers of the capture pipeline
+video_max_overrun = 60 #unit: seconds, a recording stops with its CV, or at the latest this long after the expected end of the scan
+
+## Set bubble detection ##
+bubble_detection = True # decide the bubble removal from the video, False to always remove bubbles
+bubble_roi = None # (top, bottom, left, right) in pixels of the electrode region, None for the whole frame
+bubble_threshold = 25 # grey levels, smallest difference to the background counted as bubble
+bubble_background_frames = 10 # number of frames at the start of the first recording after a wash or purge used as background
+bubble_score_frames = 10 # number of last analysed frames averaged to the bubble score
+bubble_analysis_stride = 5 # analyse every n-th frame
+bubble_score_threshold = 0.002 # fraction of the electrode region covered by bubbles, below: no bubble removal
+bubble_score_heavy = 0.02 # above: two air columns
+
+## Set live CV analysis ##
+cv_watch_interval = 5 #unit: seconds, interval of reading the growing data file during a CV
+cv_onset_current = 1e-6 #unit: A, rise of the current above the start of the scan that marks the onset
+cv_min_peak_current = 5e-7 #unit: A, a measurement with a lower peak current is reported for checking
+
+
 ## Set Vavle positions ##
+valve1_index = 0 # valve channel of the anolytes
+valve2_index = 1 # valve channel of the catholyte
 valve1_positions = [0,1,2,3,4,5,6,7] # position 0 is for the washing solvent (0.5M NaOH); positions 1,2,3,4,5,6 are for electrolytes with contianing different alchols; position 7 is for air
 valve2_positions = [0,1]  # position 0 is for the catholyte (0.5M NaOH); position 1 is for air
 
+## Set campaign planning parameters ##
+campaign_mode = 'grid' # 'grid': measure all points of the grid; 'adaptive': choose the points with the adaptive sampler (batch measurements only)
+adaptive_noise = 0.05 # standard deviation of ln(peak current) of repeated measurements
+adaptive_prior_std = 3 # prior standard deviation of the coefficients of the surrogate of ln(peak current)
+adaptive_target_ea_std = 2 #unit: kJ/mol, stop sampling an alcohol once its activation energy is known to this standard deviation
+adaptive_max_points = None # largest number of points of the adaptive campaign, None for no limit
+if campaign_mode == 'adaptive' and measurement_mode == 'gradient':
+    raise Exception("The adaptive sampling chooses points from batch measurements, set measurement_mode = 'batch'")
+bath_heating_rate = 1.0 # unit: C/min, ramp rate of the water bath when heating
+bath_cooling_rate = 0.5 # unit: C/min, ramp rate of the water bath when cooling
+bath_settle_time = 60   # unit: seconds, time for the flow cell to settle after the bath ramp
+campaign_strategies = ('alcohol_ascending', 'alcohol_serpentine', 'temperature_grouped') # ordering strategies to compare
+
+# Durations of the steps, timed in the earlier campaigns of the rig. Until then: the two washes, the flow stabilization,
+# the measurement, the bubble removal, and the cleaning of the electrode after each alchol (flushing, flow stabilization
+# and the cleaning CVs, expected to converge at the first check after `cleaning_min_sweeps` sweeps)
+step_durations_path = os.path.join(dir_path, 'step_durations_simulation.json' if simulate else 'step_durations.json')
+step_durations_path = rig_config.get('step_durations_path', step_durations_path) # every rig has its own flow system
+step_duration_model = StepDurationModel.load(step_durations_path, {
+    'wash': 2 * time_for_washing, 'stabilize': time_for_flow_rate_stable, 'measure': measurement_time,
+    'bubble removal': time_for_flow_rate_stable + 2 + time_for_bubble_removal,
+    'cleaning': time_for_flow_rate_stable + time_for_flushing_electrode + time_for_flow_rate_stable + (Ev1_cleaning - Eini_cleaning) / sr_cleaning * cleaning_min_sweeps})
+if step_duration_model.n_runs > 0:
+    print('Step durations for the planning learned from {} campaigns'.format(step_duration_model.n_runs))
+# Time of one measurement point: two washes, flow stabilization, measurement and bubble removal
+time_per_point = sum(step_duration_model.duration(phase) for phase in ('wash', 'stabilize', 'measure', 'bubble removal'))
+# Time of cleaning the electrode after each alchol
+time_per_cleaning = step_duration_model.duration('cleaning')
+# Time of one point that runs while the bath ramps: the two washes
+time_overlapped_per_point = step_duration_model.duration('wash')
+
+campaign_grid = build_campaign_grid(valve1_positions, set_working_temps, concenration_anolytes, concentration_catholytes,
+                                    flow_rate_A1, flow_rate_A2, flow_rate_B1, flow_rate_B2)
+if 'points' in rig_config:
+    campaign_grid = [CampaignPoint(*point) for point in rig_config['points']] # the points assigned to this rig
+bath_ramp_model = BathRampModel(bath_heating_rate, bath_cooling_rate, bath_settle_time)
+campaign_plan, estimated_campaign_time = plan_campaign(campaign_grid, bath_ramp_model, set_initial_temp, set_initial_temp,
+                                                       time_per_point, time_per_cleaning, time_overlapped_per_point, campaign_strategies)
+
+## Multi-rig modes without devices ##
+if rig_mode == 'plan':
+    save_campaign_definition(rig_config['plan_path'], campaign_grid, bath_ramp_model, set_initial_temp, time_per_point,
+                             time_per_cleaning, time_overlapped_per_point)
+    sys.exit(0)
+if rig_mode == 'merge':
+    merge_measurement_stores(rig_config['stores'], folder_path)
+    sys.exit(0)
 
 
-### Connect to devices and dispaly current settings ###-------------------------------------------------------------------------------------------------------------------
 
-## Connect to water bath ##
-try: 
-    bath = serial.Serial(
-        'COM5',
-        baudrate=19200,
-        bytesize=8,
-        timeout=1
-    )
+### Connect to devices and dispaly current settings ###-------------------------------------------------------------------------------------------------------------------
 
+## Bring up the devices ##
+if simulate:
     print('***********************************')
-    print('Serial connection established on')
-    print(bath.name)  # print port info
+    print('Simulation: virtual clock {:.0f} times faster than real time'.format(simulation_speed))
     print('***********************************')
-    time.sleep(2)
+    simulated_fluigent = SimulatedFluigent(time_constant=simulated_flow_time_constant, seed=simulation_seed)
+    simulated_bath = SC150Emulator(set_initial_temp, simulated_bath_time_constant)
 
-    bath.write("RT\r".encode('utf-8'))
-    response = bath.readline()
-    print("Current bath temperature: %s" % response.decode('utf-8'))
+device_bring_up = DeviceBringUp(device_bring_up_timeout)
+device_bring_up.add('Fluigent', connect_fluigent, probe_fluigent, lambda fluigent: fluigent.fgt_close())
+device_bring_up.add('Water bath', connect_bath, probe_bath, lambda bath: bath.close())
+device_bring_up.add('Potentiostat', connect_potentiostat, probe_potentiostat, lambda potentiostat: None)
+device_bring_up.add('Camera', connect_camera, probe_camera, lambda camera_device: camera_device.close())
+devices = device_bring_up.run()
 
-    bath.write("RS\r".encode('utf-8'))
-    response = bath.readline()
-    print("Current bath setpoint: %s" % response.decode('utf-8'))
-    
-except serial.SerialException as e:
-    print("++++++++++++++++++++++++++")
-    print("Serial connection failed", e)
-    print("++++++++++++++++++++++++++")
+## Connect to water bath ##
+bath = devices['Water bath']
+bath.start_reader()
 
 ## Connect to flow sensors and pumps ##
-print('Current flow rate A1: {}'.format(fgt_get_sensorValue(0)))
-print('Current flow rate A2: {}'.format(fgt_get_sensorValue(1)))
-print('Current flow rate B1: {}'.format(fgt_get_sensorValue(2)))
-print('Current flow rate B2: {}'.format(fgt_get_sensorValue(3)))
-
-## Connect to Valve ##
-# Get valve indices
-valve_indices = range(fgt_get_valveChannelCount())
-# Two valve used 
-valve1_index = 0
-valve2_index = 1
-print("Current valve 1 position {}".format(fgt_get_valvePosition(valve1_index)))
-print("Current valve 2 position {}".format(fgt_get_valvePosition(valve2_index)))
-
-if not valve_indices:
-    raise Exception("No valve channels found")
-
-## Connect to Electrochemical workstation ##
-# Initialization:
-hp.potentiostat.Setup(model=model, path=path, folder=folder)
+fluigent = FluigentSDK(devices['Fluigent'], flow_concurrent_calls)
+fgt_close = fluigent.function('fgt_close')
+fgt_set_pressure = fluigent.function('fgt_set_pressure')
+fgt_set_sensorRegulation = fluigent.function('fgt_set_sensorRegulation')
+fgt_set_sensorRegulationResponse = fluigent.function('fgt_set_sensorRegulationResponse')
+fgt_get_sensorValue = fluigent.function('fgt_get_sensorValue')
+fgt_get_valvePosition = fluigent.function('fgt_get_valvePosition')
+fgt_set_valvePosition = fluigent.set_valve_position
+flow_controller = FlowController(fgt_set_sensorRegulation, fgt_set_sensorRegulationResponse, fgt_get_sensorValue,
+                                 ('A1', 'A2', 'B1', 'B2'), flow_regulation_response_time, flow_concurrent_calls)
+flow_monitor = FlowMonitor(flow_controller.read, flow_controller.channel_names, flow_sample_interval, flow_stable_window,
+                           flow_tolerance, flow_abs_tolerance, flow_max_std)
+
+## Connect to camera ##
+bubble_detector = BubbleDetector(bubble_roi, bubble_threshold, bubble_background_frames, bubble_score_frames) if bubble_detection else None
+bubble_scores = {} # campaign point -> bubble score of its measurement
+cv_features = {} # base file name of a sub-measurement -> features of its CV, updated during the scan
+camera = CameraSession(devices['Camera'], simulated_frame_rate if simulate else camera_frame_rate, camera_buffer_pool_size, bubble_detector, bubble_analysis_stride)
 
 
 
 ### Run experiments ###--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
-## Electrode activation (applied only for new electrodes)
-print('---- Electrode activation ----')
-fgt_set_valvePosition(valve1_index, 0) # position 0 is the washing solvent
-fgt_set_valvePosition(valve2_index, 0) # position 0 is the washing solvent
-fgt_set_sensorRegulation(0, 0, flow_rate_for_flushing_electrode) # set flow rate of A1
-fgt_set_sensorRegulationResponse (0, 60)
-fgt_set_sensorRegulation(1, 1, flow_rate_for_flushing_electrode) # set flow rate of A2
-fgt_set_sensorRegulationResponse (1, 60)
-fgt_set_sensorRegulation(2, 2, flow_rate_for_flushing_electrode) # set flow rate of B1
-fgt_set_sensorRegulationResponse (2, 60)
-fgt_set_sensorRegulation(3, 3, flow_rate_for_flushing_electrode) # set flow rate of B2
-fgt_set_sensorRegulationResponse (3, 60)
-                
-fileName_activation = 'Electrode_activation' # file name 
-header_activation = 'CV_activation'   # header for data filef"file_{x}.txt"
-
-cv = hp.potentiostat.CV(Eini_activation, Ev1_activation, Ev2_activation, Efin_activation, sr_activation, dE_activation, nSweeps_activation, sens_activation, fileName_activation, header_activation)
-
-cv.run()
-
-
-## Run measurements for alchols i at different temparetures
-for valve_position in valve1_positions:
-    
-    # Wash the system after finishing each alchol test
-    print()
-    print('---- Put valve1 position to 0 to wash the system ----')
-    
-    fgt_set_valvePosition(valve1_index, 0) # position 0 is the washing solvent
-    fgt_set_valvePosition(valve2_index, 0) # position 0 is the catholyte, also the washing solvent
-    fgt_set_sensorRegulation(0, 0, flow_rate_for_washing_system) # set flow rate of A1
-    fgt_set_sensorRegulationResponse (0, 60)
-    fgt_set_sensorRegulation(1, 1, flow_rate_for_washing_system) # set flow rate of A2
-    fgt_set_sensorRegulationResponse (1, 60)
-    fgt_set_sensorRegulation(2, 2, flow_rate_for_washing_system) # set flow rate of B1
-    fgt_set_sensorRegulationResponse (2, 60)
-    fgt_set_sensorRegulation(3, 3, flow_rate_for_washing_system) # set flow rate of B2
-    fgt_set_sensorRegulationResponse (3, 60)
-
-    print('Waiting {:.0f} seconds...'.format(time_for_washing))
-    time.sleep(time_for_washing)
-    
-    # Wait the temp to reach the initial value 
-    print()
-    print('---- Set the tempareture to intinial value {:0.2f} C ----'.format(set_initial_temp))
-    
-    fgt_set_sensorRegulation(0, 0, flow_rate_for_waiting_temp) # set flow rate of A1
-    fgt_set_sensorRegulationResponse (0, 60)
-    fgt_set_sensorRegulation(1, 1, flow_rate_for_waiting_temp) # set flow rate of A2
-    fgt_set_sensorRegulationResponse (1, 60)
-    fgt_set_sensorRegulation(2, 2, flow_rate_for_waiting_temp) # set flow rate of B1
-    fgt_set_sensorRegulationResponse (2, 60)
-    fgt_set_sensorRegulation(3, 3, flow_rate_for_waiting_temp) # set flow rate of B2
-    fgt_set_sensorRegulationResponse (3, 60)
-    
-    bath.write("SO 1\r".encode('utf-8'))  # set status of bath to on/run
-    response = bath.readline()
-    
-    flag = False
+## Start the telemetry and the timing of the phases
+campaign_start_time = clock.time()
+profiler = PhaseProfiler(timing_spans_path)
+telemetry = TelemetryRecorder(TelemetryLog(telemetry_path, telemetry_capacity), read_telemetry_sample, telemetry_interval)
+telemetry.start()
+
+## Run the campaign, closing the session also when a step fails
+campaign_journal = electrode_log = measurement_store = None
+try:
+    ## Open the checkpoint journal
+    if resume_campaign:
+        print('---- Resume the campaign of {} ----'.format(campaign_journal_path))
+        # Restore a safe state: washing solvent in both channels, at the flow rate for waiting
+        fgt_set_valvePosition(valve1_index, 0) # position 0 is the washing solvent
+        fgt_set_valvePosition(valve2_index, 0) # position 0 is the catholyte, also the washing solvent
+        flow_controller.set_all(flow_rate_for_waiting_temp) # set flow rates of A1, A2, B1 and B2
+    else:
+        CampaignJournal.archive(campaign_journal_path)
+    campaign_journal = CampaignJournal(campaign_journal_path)
+    electrode_log = CampaignJournal(electrode_log_path)
+    measurement_store = MeasurementStore(measurement_store_path, store_chunk_points)
+
+    ## Electrode activation (applied only for new electrodes)
+    if skip_logged_activation and electrode_log.is_complete('activation', (electrode_id,)):
+        print('---- Electrode activation of {} already done, skipped ----'.format(electrode_id))
+    else:
+        print('---- Electrode activation ----')
+        fgt_set_valvePosition(valve1_index, 0) # position 0 is the washing solvent
+        fgt_set_valvePosition(valve2_index, 0) # position 0 is the washing solvent
+        flow_controller.set_all(flow_rate_for_flushing_electrode) # set flow rates of A1, A2, B1 and B2
+                    
+        fileName_activation = 'Electrode_activation' # file name 
+        header_activation = 'CV_activation'   # header for data filef"file_{x}.txt"
+
+        with profiler.span('activation'):
+            data_file_paths, potentials, currents, n_sweeps = run_converging_cvs(Eini_activation, Ev1_activation, Ev2_activation, Efin_activation, sr_activation, dE_activation,
+                                                                                 nSweeps_activation, sens_activation, fileName_activation, header_activation)
+        measurement_store.append(campaign_run_id, 'activation', {'electrode_id': electrode_id}, potentials, currents,
+                                 {'data_files': [os.path.basename(path) for path in data_file_paths], 'n_sweeps': n_sweeps})
+        electrode_log.record('activation', (electrode_id,), data_file_paths)
+
+
+    ## Run the campaign ##
+    executor = StepExecutor(profiler)
+    previous_point = None
+
+    if campaign_mode == 'adaptive':
+        ## Run measurements for the points chosen one by one by the adaptive sampler
+        # The next point is chosen from the peak currents measured so far, once the measurement of a point is finished;
+        # its washing and bath ramp overlap the bubble removal of the previous point
+        sampler = AdaptiveSampler(build_candidate_grid(campaign_grid), bath_ramp_model, time_per_point, time_per_cleaning,
+                                  adaptive_noise, adaptive_prior_std, adaptive_target_ea_std, adaptive_max_points)
+        print()
+        print('---- Start the adaptive campaign: {} candidate points ----'.format(len(sampler.candidates)))
+        for point in sampler.candidates:
+            # the points measured before the resume
+            if campaign_journal.is_complete('point', point):
+                records = measurement_store.query('measurement', **reference_condition(point))
+                sampler.add(point, records[-1]['attributes']['features']['peak_current'] if records else None)
     
-    while flag != True:
-        command = "SS %2.2f\r" % float(set_initial_temp)
-        bath.write(command.encode('utf-8'))
-        response = bath.readline()
-
-        bath.write("RS\r".encode('utf-8'))
-        response = bath.readline()
-
-        bath.write("RT\r".encode('utf-8'))
-        response = bath.readline()
-        current_temp = float(response.decode('utf-8').strip().replace('C', ''))
+        while True:
+            point = sampler.next_point(previous_point, set_initial_temp if previous_point is None else previous_point.temp)
+            if point is None:
+                break
         
-        # Get flow rate value
-        measured_flow_rate_anolyte = fgt_get_sensorValue(0)+fgt_get_sensorValue(1)
-        measured_flow_rate_catholyte = fgt_get_sensorValue(2)+fgt_get_sensorValue(3)
+            # Clean the electrode before testing the next alcohol, unless it was cleaned there before the resume
+            if previous_point is not None and point.valve_position != previous_point.valve_position and \
+                    not campaign_journal.is_complete('cleaning', (previous_point.valve_position, previous_point.temp)):
+                submit_cleaning(executor, previous_point)
+            previous_point = point
         
-        print("S_T: %2.2f C     C_T: %s C    S_QA : %2.0f uL/min   S_QB : %2.0f uL/min    C_QA : %2.0f uL/min    C_QB : %2.0f uL/min" % (set_initial_temp, current_temp, flow_rate_for_waiting_temp*2, flow_rate_for_waiting_temp*2, measured_flow_rate_anolyte, measured_flow_rate_catholyte))
-
-        if format(current_temp, '.1f') == format(set_initial_temp, '.1f'):
-            print("Reach the initial setpoint: %s C" % current_temp)
-            
-            n = 10 
-            while n > 0:
-                time.sleep(1)
-                n -= 1
-                
-            flag = True    
+            measure = submit_point(executor, point)
+            measure.done.wait()
+            if measure.failed:
+                break
+            sampler.add(point, cv_features.get(measurement_file_name(reference_condition(point)), {}).get('peak_current'))
+            print('Adaptive sampling: {} of {} candidate points measured'.format(len(sampler.measured), len(sampler.candidates)))
     
-    # Run temprature ramping for alchol i and conduct EC tests
-    print()
-    print('---- Start testing alchol {:.0f} ----'.format(valve_position))
+        # Clean the electrode after the last alcohol
+        if previous_point is not None and not campaign_journal.is_complete('cleaning', (previous_point.valve_position, previous_point.temp)):
+            submit_cleaning(executor, previous_point)
     
-    for j in range(len(set_working_temps)):
+        executor.wait()
         print()
-        print('0. Put valve position to 0 and set flow rates to wash the system')
-        print('Waiting {:.0f} seconds...'.format(time_for_washing))
-        fgt_set_valvePosition(valve1_index, 0) # position 0 is the washing solvent
-        fgt_set_valvePosition(valve2_index, 0) # position 0 is the catholyte, also the washing solvent
-        fgt_set_sensorRegulation(0, 0, flow_rate_for_washing_system) # set flow rate of A1
-        fgt_set_sensorRegulationResponse (0, 60)
-        fgt_set_sensorRegulation(1, 1, flow_rate_for_washing_system) # set flow rate of A2
-        fgt_set_sensorRegulationResponse (1, 60)
-        fgt_set_sensorRegulation(2, 2, flow_rate_for_washing_system) # set flow rate of B1
-        fgt_set_sensorRegulationResponse (2, 60)
-        fgt_set_sensorRegulation(3, 3, flow_rate_for_washing_system) # set flow rate of B2
-        fgt_set_sensorRegulationResponse (3, 60)
-        time.sleep (time_for_washing)
-        
-        print('1. Put valve position to {:.0f} and set flow rates to remove the washing solvent'.format(valve_position))
-        print('Waiting {:.0f} seconds...'.format(time_for_washing))
-        fgt_set_valvePosition(valve1_index, valve_position) # position valve_position is the alchol i
-        fgt_set_valvePosition(valve2_index, 0) # position 0 is the catholyte
-        fgt_set_sensorRegulation(0, 0, flow_rate_for_washing_system) # set flow rate of A1
-        fgt_set_sensorRegulationResponse (0, 60)
-        fgt_set_sensorRegulation(1, 1, flow_rate_for_washing_system) # set flow rate of A2
-        fgt_set_sensorRegulationResponse (1, 60)
-        fgt_set_sensorRegulation(2, 2, flow_rate_for_washing_system) # set flow rate of B1
-        fgt_set_sensorRegulationResponse (2, 60)
-        fgt_set_sensorRegulation(3, 3, flow_rate_for_washing_system) # set flow rate of B2
-        fgt_set_sensorRegulationResponse (3, 60)
-        time.sleep (time_for_washing)
-        
-        print('2. Set flow rates for waiting tempareture to reach the set value')
-        fgt_set_sensorRegulation(0, 0, flow_rate_for_waiting_temp) # set flow rate of A1
-        fgt_set_sensorRegulationResponse (0, 60)
-        fgt_set_sensorRegulation(1, 1, flow_rate_for_waiting_temp) # set flow rate of A2
-        fgt_set_sensorRegulationResponse (1, 60)
-        fgt_set_sensorRegulation(2, 2, flow_rate_for_waiting_temp) # set flow rate of B1
-        fgt_set_sensorRegulationResponse (2, 60)
-        fgt_set_sensorRegulation(3, 3, flow_rate_for_waiting_temp) # set flow rate of B2
-        fgt_set_sensorRegulationResponse (3, 60)
+        print('---- Adaptive sampling finished: {} of {} candidate points ----'.format(len(sampler.measured), len(sampler.candidates)))
+        for line in sampler.summary():
+            print(line)
+
+    else:
+        ## Run measurements for the campaign points in the planned order
+        # The steps of all points are submitted to the executor, which overlaps steps that hold different resources,
+        # e.g. the washing of the next point and the bath ramp to its temperature run during the bubble removal
+        print()
+        print('---- Start the campaign: {} points, estimated time {:.2f} h ----'.format(len(campaign_plan), estimated_campaign_time / 3600))
+    
+        for point in campaign_plan:
         
-        print('3. Set the tempareture to {:.2f}, and wait'.format(set_working_temps[j]))   
-        bath.write("SO 1\r".encode('utf-8'))  # set status of bath to on/run
-        response = bath.readline()
+            # Clean the electrode before testing the next alcohol
+            if previous_point is not None and point.valve_position != previous_point.valve_position and \
+                    not campaign_journal.is_complete('cleaning', (previous_point.valve_position, previous_point.temp)):
+                submit_cleaning(executor, previous_point)
+            previous_point = point
         
-        flag = False
+            # Skip the points measured before the resume
+            if campaign_journal.is_complete('point', point):
+                print('Alchol {:.0f} at {:.2f} C already measured, skipped'.format(point.valve_position, point.temp))
+                continue
         
-        while not flag:
-            command = "SS %2.2f\r" % float(set_working_temps[j])
-            bath.write(command.encode('utf-8'))
-            response = bath.readline()
-
-            bath.write("RS\r".encode('utf-8'))
-            response = bath.readline()
-
-            bath.write("RT\r".encode('utf-8'))
-            response = bath.readline()
-            current_temp = float(response.decode('utf-8').strip().replace('C', ''))
-            
-            # Get flow rate value
-            measured_flow_rate_anolyte = fgt_get_sensorValue(0)+fgt_get_sensorValue(1)
-            measured_flow_rate_catholyte = fgt_get_sensorValue(2)+fgt_get_sensorValue(3)
-            
-            print("S_T: %2.2f C     C_T: %s C     S_QA : %2.0f uL/min   S_QB : %2.0f uL/min    C_QA : %2.0f uL/min    C_QB : %2.0f uL/min" % (set_working_temps[j], current_temp, flow_rate_for_waiting_temp*2, flow_rate_for_waiting_temp*2, measured_flow_rate_anolyte, measured_flow_rate_catholyte))
-
-            if format(current_temp, '.1f') == format(set_working_temps[j], '.1f'):
-                
-                print("4. Reach the setpoint: %s C, change to working flow rates" % current_temp)
-                
-                fgt_set_sensorRegulation(0, 0, flow_rate_A1[j]) # set flow rate of A1
-                fgt_set_sensorRegulationResponse (0, 60)
-                fgt_set_sensorRegulation(1, 1, flow_rate_A2[j]) # set flow rate of A2
-                fgt_set_sensorRegulationResponse (1, 60)
-                fgt_set_sensorRegulation(2, 2, flow_rate_B1[j]) # set flow rate of B1
-                fgt_set_sensorRegulationResponse (2, 60)
-                fgt_set_sensorRegulation(3, 3, flow_rate_B2[j]) # set flow rate of B2
-                fgt_set_sensorRegulationResponse (3, 60)
-                
-                time.sleep(time_for_flow_rate_stable)
-                
-                print("5. Run CV or LSV measurments")
-                # set CV method
-                msr = sr*1000
-                mEini = Eini*1000
-                mEv1 = Ev1*1000
-                fileName = '{:.0f}_'.format(valve_position)+'{:.0f}mV'.format(mEini)+'_{:.0f}mV'.format(mEv1)+'_{:.0f}mVs'.format(msr)+'_{:.0f}oC'.format(set_working_temps[j]) # base file name for data file
-                header = 'CV'   # header for data filef"file_{x}.txt"
-
-                # Initialize experiment:
-                cv = hp.potentiostat.CV(Eini, Ev1, Ev2, Efin, sr, dE, nSweeps, sens, fileName, header)
-
-                # Create a CameraRecorder object
-                video_save_path = os.path.join(folder_path, fileName + ".mp4")
-                camera_recorder = CameraRecorder(measurement_time, video_save_path)
-
-                # Start CV thread
-                cv_thread = threading.Thread(target=cv.run)
-                cv_thread.start()
-
-                # Add a slight delay before starting the camera thread
-                time.sleep(1)  # Adjust the delay as needed
-
-                camera_thread = threading.Thread(target=camera_recorder.start_recording)
-                camera_thread.start()
-
-                # Wait after running 
-                time.sleep(measurement_time)
-
-                print("6. CV test and video recording finished") 
-
-                # Remove trapped bubbles
-                print ("7. Introduce air columns to remove the trapped bubbles")
-                fgt_set_sensorRegulation(0, 0, flow_rate_for_bubble_removal) # set flow rate of A1
-                fgt_set_sensorRegulationResponse (0, 60)
-                fgt_set_sensorRegulation(1, 1, flow_rate_for_bubble_removal) # set flow rate of A2
-                fgt_set_sensorRegulationResponse (1, 60)
-                fgt_set_sensorRegulation(2, 2, flow_rate_for_bubble_removal) # set flow rate of B1
-                fgt_set_sensorRegulationResponse (2, 60)
-                fgt_set_sensorRegulation(3, 3, flow_rate_for_bubble_removal) # set flow rate of B2
-                fgt_set_sensorRegulationResponse (3, 60)
-                time.sleep(time_for_flow_rate_stable)
-                
-                # introduce air bubbles
-                fgt_set_valvePosition(valve1_index, 7) # position 7 is the air
-                fgt_set_valvePosition(valve2_index, 1) # position 1 is the air
-                time.sleep(2)
-                
-                fgt_set_valvePosition(valve1_index, 0) # position 0 is the washing solvent
-                fgt_set_valvePosition(valve2_index, 0) # position 0 is the catholyte, also the washing solvent
-
-                # Wait  
-                time.sleep(time_for_bubble_removal) 
-                
-                flag = True
-        
-    # Clean the electrode before testing next alcohol
-    fgt_set_valvePosition(valve1_index, 0) # position 0 is the washing solvent
-    fgt_set_valvePosition(valve2_index, 0) # position 0 is the catholyte, also the washing solvent
-    fgt_set_sensorRegulation(0, 0, flow_rate_for_flushing_electrode) # set flow rate of A1
-    fgt_set_sensorRegulationResponse (0, 60)
-    fgt_set_sensorRegulation(1, 1, flow_rate_for_flushing_electrode) # set flow rate of A2
-    fgt_set_sensorRegulationResponse (1, 60)
-    fgt_set_sensorRegulation(2, 2, flow_rate_for_flushing_electrode) # set flow rate of B1
-    fgt_set_sensorRegulationResponse (2, 60)
-    fgt_set_sensorRegulation(3, 3, flow_rate_for_flushing_electrode) # set flow rate of B2
-    fgt_set_sensorRegulationResponse (3, 60)
-                
-    time.sleep(time_for_flow_rate_stable + time_for_flushing_electrode)
-                
-    # Run CVs for electrode cleaning                
-    fgt_set_sensorRegulation(0, 0, flow_rate_for_cleaning_electrode_with_CVs) # set flow rate of A1
-    fgt_set_sensorRegulationResponse (0, 60)
-    fgt_set_sensorRegulation(1, 1, flow_rate_for_cleaning_electrode_with_CVs) # set flow rate of A2
-    fgt_set_sensorRegulationResponse (1, 60)
-    fgt_set_sensorRegulation(2, 2, flow_rate_for_cleaning_electrode_with_CVs) # set flow rate of B1
-    fgt_set_sensorRegulationResponse (2, 60)
-    fgt_set_sensorRegulation(3, 3, flow_rate_for_cleaning_electrode_with_CVs) # set flow rate of B2
-    fgt_set_sensorRegulationResponse (3, 60)
-                
-    time.sleep(time_for_flow_rate_stable)
-                
-    fileName_cleaning = '{:.0f}_'.format(valve_position)+'_{:.0f}oC'.format(set_working_temps[j]) # base file name for data file
-    header_cleaning = 'CV_cleaning'   # header for data filef"file_{x}.txt"
-
-    cv = hp.potentiostat.CV(Eini_cleaning, Ev1_cleaning, Ev2_cleaning, Efin_cleaning, sr_cleaning, dE_cleaning, nSweeps_cleaning, sens_cleaning, fileName_cleaning, header_cleaning)
-
-    cv.run()
-
-
-### Wash the flow system ###--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
-
-## Wash the system after finishing all tests
-print()
-print('---- All tests finished, put valve position to 0 to wash the system and cool the tempature ----')
-
-fgt_set_valvePosition(valve1_index, 0) # position 0 is the washing solvent
-fgt_set_valvePosition(valve2_index, 0) # position 0 is the catholyte, also the washing solvent
+            submit_point(executor, point)
+    
+        # Clean the electrode after the last alcohol
+        if previous_point is not None and not campaign_journal.is_complete('cleaning', (previous_point.valve_position, previous_point.temp)):
+            submit_cleaning(executor, previous_point)
+    
+        executor.wait()
 
-fgt_set_sensorRegulation(0, 0, flow_rate_for_washing_system) # set flow rate of A1
-fgt_set_sensorRegulationResponse (0, 60)
-fgt_set_sensorRegulation(1, 1, flow_rate_for_washing_system) # set flow rate of A2
-fgt_set_sensorRegulationResponse (1, 60)
-fgt_set_sensorRegulation(2, 2, flow_rate_for_washing_system) # set flow rate of B1
-fgt_set_sensorRegulationResponse (2, 60)
-fgt_set_sensorRegulation(3, 3, flow_rate_for_washing_system) # set flow rate of B2
-fgt_set_sensorRegulationResponse (3, 60)
-time.sleep (time_for_washing)
 
-fgt_set_sensorRegulation(0, 0, flow_rate_for_waiting_temp) # set flow rate of A1
-fgt_set_sensorRegulationResponse (0, 60)
-fgt_set_sensorRegulation(1, 1, flow_rate_for_waiting_temp) # set flow rate of A2
-fgt_set_sensorRegulationResponse (1, 60)
-fgt_set_sensorRegulation(2, 2, flow_rate_for_waiting_temp) # set flow rate of B1
-fgt_set_sensorRegulationResponse (2, 60)
-fgt_set_sensorRegulation(3, 3, flow_rate_for_waiting_temp) # set flow rate of B2
-fgt_set_sensorRegulationResponse (3, 60)
+    ### Wash the flow system ###--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
-bath.write("SO 1\r".encode('utf-8'))  # set status of bath to on/run
-response = bath.readline()
+    ## Wash the system after finishing all tests
+    print()
+    print('---- All tests finished, put valve position to 0 to wash the system and cool the tempature ----')
 
-flag = False
+    fgt_set_valvePosition(valve1_index, 0) # position 0 is the washing solvent
+    fgt_set_valvePosition(valve2_index, 0) # position 0 is the catholyte, also the washing solvent
 
-while flag != True:
-    command = "SS %2.2f\r" % float(set_initial_temp)
-    bath.write(command.encode('utf-8'))
-    response = bath.readline()
+    flow_controller.set_all(flow_rate_for_washing_system) # set flow rates of A1, A2, B1 and B2
+    with profiler.span('final wash'):
+        wash(washing_dead_volumes, time_for_washing)
 
-    bath.write("RS\r".encode('utf-8'))
-    response = bath.readline()
+    flow_controller.set_all(flow_rate_for_waiting_temp) # set flow rates of A1, A2, B1 and B2
 
-    bath.write("RT\r".encode('utf-8'))
-    response = bath.readline()
-    current_temp = float(response.decode('utf-8').strip().replace('C', ''))
-    
-    # Get flow rate value
-    measured_flow_rate_anolyte = fgt_get_sensorValue(0)+fgt_get_sensorValue(1)
-    measured_flow_rate_catholyte = fgt_get_sensorValue(2)+fgt_get_sensorValue(3)
-    
-    print("S_T: %2.2f C     C_T: %s C    S_QA : %2.0f uL/min   S_QB : %2.0f uL/min    C_QA : %2.0f uL/min    C_QB : %2.0f uL/min" % (set_initial_temp, current_temp, flow_rate_for_waiting_temp*2, flow_rate_for_waiting_temp*2, measured_flow_rate_anolyte, measured_flow_rate_catholyte))
+    with profiler.span('final equilibrate', temp=set_initial_temp):
+        wait_for_bath_temperature(set_initial_temp)
 
-    if format(current_temp, '.1f') == format(set_initial_temp, '.1f'):
-        print("Reach the initial setpoint: %s C" % current_temp)
-        
-        n = 10 
-        while n > 0:
-            time.sleep(1)
-            n -= 1
-            
-        flag = True    
-
-## Close the session
-# Set pressure to 0 before closing. This also stops the regulation
-fgt_set_pressure(0, 0)
-fgt_close()
+    ## Report where the campaign time went
+    timing_report = profiler.report(clock.time() - campaign_start_time)
+    print()
+    print(timing_report)
+    with open(timing_report_path, 'w') as f:
+        f.write(timing_report + '\n')
+
+    ## Learn the durations of the steps for the planning of the next campaigns
+    if step_duration_model.learn(profiler.spans):
+        step_duration_model.save(step_durations_path)
+        print("Step durations for the planning: " + ", ".join('{} {:.0f} s'.format(phase, step_duration_model.duration(phase))
+                                                             for phase in step_duration_model.defaults))
+
+finally:
+    ## Close the session and return the rig to a safe state
+    # The telemetry reads the bath and the flow controller, stop it before the devices are closed
+    close_safely('telemetry', telemetry.stop)
+    for journal in (campaign_journal, electrode_log, measurement_store):
+        if journal is not None:
+            close_safely('journal', journal.close)
+    close_safely('profiler', profiler.close)
+    # Set pressure to 0 before closing. This also stops the regulation
+    for channel in flow_controller.channels:
+        close_safely('pump {}'.format(flow_controller.channel_names[channel]), fgt_set_pressure, channel, 0)
+    close_safely('flow controller', flow_controller.close)
+    close_safely('water bath', bath.close)
+    close_safely('camera', camera.close)
+    close_safely('Fluigent', fgt_close)
 
 
 
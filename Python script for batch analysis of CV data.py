@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import re
+import json
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from collections import defaultdict
+
+
+
+### Define fuctions ###--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+GAS_CONSTANT = 8.314 # J/(mol K)
+
+# fields of the campaign conditions, as in the CampaignPoint of the measurement script
+CONDITION_FIELDS = ('valve_position', 'temp', 'concentration_anolyte', 'concentration_catholyte',
+                    'flow_rate_A1', 'flow_rate_A2', 'flow_rate_B1', 'flow_rate_B2')
+# fields of the potentiostat method of a measurement in the batch of a point, None for older campaigns
+METHOD_FIELDS = ('technique', 'Eini', 'Ev1', 'Ev2', 'Efin', 'sr', 'dE', 'nSweeps', 'sens', 'dilution')
+# the fits only combine measurements of the same method
+FIT_METHOD_FIELDS = ('technique', 'Eini', 'Ev1', 'Efin', 'sr')
+# base file name of a measurement: '{valve}_{Eini}mV_{Ev1}mV_{sr}mVs_{T}oC'
+MEASUREMENT_FILE_NAME = re.compile(r'^(\d+)_(-?\d+)mV_(-?\d+)mV_(\d+)mVs_(-?\d+)oC\.txt$')
+
+
+# file functions
+def list_measurements(campaign_folder):
+    # (data file path, condition) of the measurements of a campaign folder: from the index of its measurement store,
+    # or for older campaigns without the store, from the file names (valve position and temperature only)
+    index_path = os.path.join(campaign_folder, 'measurement_store', 'index.jsonl')
+    measurements = {}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn write of a crash
+                if record['kind'] == 'measurement':
+                    file_path = os.path.join(campaign_folder, record['attributes']['data_file'])
+                    measurements[file_path] = record['condition']  # a repeated point: the last measurement
+    for file_name in sorted(os.listdir(campaign_folder)):
+        match = MEASUREMENT_FILE_NAME.match(file_name)
+        file_path = os.path.join(campaign_folder, file_name)
+        if match and file_path not in measurements:
+            condition = dict.fromkeys(CONDITION_FIELDS)
+            condition['valve_position'] = int(match.group(1))
+            condition['temp'] = float(match.group(5))
+            measurements[file_path] = condition
+    return sorted(measurements.items())
+
+
+def read_chi_text_file(file_path):
+    # content hash, scan rate in V/s, potentials and currents of a CHI text data file
+    with open(file_path, 'rb') as f:
+        content = f.read()
+    header, _, data = content.partition(b'Potential/V, Current/A')
+    match = re.search(rb'Scan Rate \(V/s\) = ([-+.eE\d]+)', header)
+    scan_rate = float(match.group(1)) if match else float('nan')
+    values = np.array(data.replace(b',', b' ').split(), dtype=float).reshape(-1, 2)
+    return hashlib.sha256(content).hexdigest(), scan_rate, values[:, 0], values[:, 1]
+
+
+# feature functions
+def curve_features(potentials, currents, scan_rates, onset_current, baseline_points=10):
+    # features of n curves of equal length at once; potentials and currents: (n, points) arrays
+    peak_indices = np.argmax(currents, axis=1)
+    rows = np.arange(len(currents))
+    baselines = np.mean(currents[:, :baseline_points], axis=1)
+    above = currents - baselines[:, None] >= onset_current
+    onset_indices = np.argmax(above, axis=1)
+    onsets = np.where(above[rows, onset_indices], potentials[rows, onset_indices], np.nan)
+    charges = np.sum((currents[:, 1:] + currents[:, :-1]) / 2 * np.abs(np.diff(potentials, axis=1)), axis=1) / scan_rates
+    return {'peak_current': currents[rows, peak_indices], 'peak_potential': potentials[rows, peak_indices],
+            'onset_potential': onsets, 'charge': charges}
+
+
+def analyse_files(file_paths, onset_current):
+    # task of a worker process: reads the files and extracts the features of the curves grouped by length
+    results = {}
+    curves = defaultdict(list)  # number of points -> (file path, scan rate, potentials, currents)
+    for file_path in file_paths:
+        try:
+            content_hash, scan_rate, potentials, currents = read_chi_text_file(file_path)
+        except (OSError, ValueError) as e:
+            print("Skip {}: {}".format(file_path, e))
+            continue
+        results[file_path] = {'hash': content_hash}
+        if len(potentials) > 1:
+            curves[len(potentials)].append((file_path, scan_rate, potentials, currents))
+    for group in curves.values():
+        features = curve_features(np.array([curve[2] for curve in group]), np.array([curve[3] for curve in group]),
+                                  np.array([curve[1] for curve in group]), onset_current)
+        for i, curve in enumerate(group):
+            results[curve[0]].update({name: (None if np.isnan(values[i]) else float(values[i])) for name, values in features.items()})
+    return results
+
+
+# feature cache, keyed by the content hash of the files. The hash of a file is reused while its size and
+# modification time are unchanged, so that a re-analysis reads only the new and changed files
+class FeatureCache:
+    def __init__(self, path):
+        self.path = path
+        self.files = {}  # file path -> [size, mtime_ns, content hash]
+        self.features = {}  # content hash -> features
+        if os.path.exists(path):
+            with open(path) as f:
+                cache = json.load(f)
+            self.files, self.features = cache['files'], cache['features']
+
+    @staticmethod
+    def stat(file_path):
+        st = os.stat(file_path)
+        return [st.st_size, st.st_mtime_ns]
+
+    def lookup(self, file_path):
+        entry = self.files.get(file_path)
+        if entry is None or entry[:2] != self.stat(file_path):
+            return None
+        return self.features.get(entry[2])
+
+    def store(self, file_path, result):
+        features = dict(result)
+        content_hash = features.pop('hash')
+        self.files[file_path] = self.stat(file_path) + [content_hash]
+        self.features[content_hash] = features
+
+    def save(self):
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'files': self.files, 'features': self.features}, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def extract_features(measurements, cache, onset_current, n_workers, files_per_task):
+    # features of all measurements: from the cache, or extracted by the process pool
+    features = {}
+    missing = []
+    for file_path, condition in measurements:
+        cached = cache.lookup(file_path)
+        if cached is None:
+            missing.append(file_path)
+        else:
+            features[file_path] = cached
+    print('{} files, {} cached, {} to analyse'.format(len(measurements), len(features), len(missing)))
+    tasks = [missing[i:i + files_per_task] for i in range(0, len(missing), files_per_task)]
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        for results in pool.map(analyse_files, tasks, [onset_current] * len(tasks)):
+            for file_path, result in results.items():
+                cache.store(file_path, result)
+                features[file_path] = cache.features[result['hash']]
+    return features
+
+
+# fit functions
+def linear_fit(x, y):
+    # slope, intercept and R^2 of a least-squares line
+    slope, intercept = np.polyfit(x, y, 1)
+    residual = y - (slope * x + intercept)
+    total = np.sum((y - np.mean(y)) ** 2)
+    r_squared = 1 - np.sum(residual ** 2) / total if total > 0 else float('nan')
+    return slope, intercept, r_squared
+
+
+def group_points(measurements, features, feature, group_fields, x_field):
+    # (x, feature value) points of the measurements grouped by the `group_fields` of their conditions
+    groups = defaultdict(list)
+    for file_path, condition in measurements:
+        value = features.get(file_path, {}).get(feature)
+        if value is None or value <= 0 or condition.get(x_field) is None:
+            continue  # no logarithm
+        groups[tuple(condition.get(field) for field in group_fields)].append((condition[x_field], value))
+    return groups
+
+
+def fit_arrhenius(measurements, features, feature='peak_current'):
+    # apparent activation energy of each alcohol, concentration and method: ln(i) = ln(A) - Ea / (R T)
+    group_fields = ('valve_position', 'concentration_anolyte', 'concentration_catholyte') + FIT_METHOD_FIELDS
+    fits = []
+    for key, points in sorted(group_points(measurements, features, feature, group_fields, 'temp').items(), key=str):
+        temps = np.array([point[0] for point in points]) + 273.15
+        if len(set(temps)) < 2:
+            continue
+        slope, intercept, r_squared = linear_fit(1 / temps, np.log([point[1] for point in points]))
+        fits.append(dict(zip(group_fields, key), activation_energy=-slope * GAS_CONSTANT / 1000, ln_prefactor=intercept,
+                         r_squared=r_squared, n_points=len(points)))
+    return fits
+
+
+def fit_concentration_order(measurements, features, feature='peak_current'):
+    # apparent reaction order of each alcohol, temperature and method: ln(i) = n ln(c) + b
+    group_fields = ('valve_position', 'temp', 'concentration_catholyte') + FIT_METHOD_FIELDS
+    fits = []
+    for key, points in sorted(group_points(measurements, features, feature, group_fields, 'concentration_anolyte').items(), key=str):
+        concentrations = np.array([point[0] for point in points], dtype=float)
+        if len(set(concentrations)) < 2 or np.any(concentrations <= 0):
+            continue
+        slope, intercept, r_squared = linear_fit(np.log(concentrations), np.log([point[1] for point in points]))
+        fits.append(dict(zip(group_fields, key), reaction_order=slope, intercept=intercept, r_squared=r_squared, n_points=len(points)))
+    return fits
+
+
+def write_csv(file_path, rows, fields):
+    with open(file_path, 'w') as f:
+        f.write(','.join(fields) + '\n')
+        for row in rows:
+            f.write(','.join('' if row.get(field) is None else str(row.get(field)) for field in fields) + '\n')
+
+
+
+### Analysis parameter settings ###--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+dir_path = os.path.dirname(os.path.abspath(__file__))
+# Data folders of the campaigns to analyse together
+campaign_folders = [os.path.join(dir_path, 'test')]
+# Folder for the results and the feature cache
+analysis_folder = os.path.join(dir_path, 'analysis')
+
+onset_current = 1e-6 #unit: A, rise of the current above the start of the scan that marks the onset
+fit_feature = 'peak_current' # feature fitted in the Arrhenius and concentration studies
+n_workers = os.cpu_count() # number of worker processes
+files_per_task = 256 # number of files read by a worker per task
+
+
+
+### Run analysis ###--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':  # the worker processes import this script
+    start_time = time.time()
+    os.makedirs(analysis_folder, exist_ok=True)
+
+    ## Collect the measurements of all campaigns
+    measurements = []
+    for campaign_folder in campaign_folders:
+        campaign_measurements = list_measurements(campaign_folder)
+        print('{}: {} measurements'.format(campaign_folder, len(campaign_measurements)))
+        measurements.extend(campaign_measurements)
+
+    ## Extract the features
+    cache = FeatureCache(os.path.join(analysis_folder, 'feature_cache.json'))
+    features = extract_features(measurements, cache, onset_current, n_workers, files_per_task)
+    cache.save()
+
+    feature_names = ('peak_current', 'peak_potential', 'onset_potential', 'charge')
+    write_csv(os.path.join(analysis_folder, 'features.csv'),
+              [dict(condition, file=file_path, **features.get(file_path, {})) for file_path, condition in measurements],
+              ('file',) + CONDITION_FIELDS + METHOD_FIELDS + feature_names)
+
+    ## Fit the kinetics
+    arrhenius_fits = fit_arrhenius(measurements, features, fit_feature)
+    write_csv(os.path.join(analysis_folder, 'arrhenius.csv'), arrhenius_fits,
+              ('valve_position', 'concentration_anolyte', 'concentration_catholyte') + FIT_METHOD_FIELDS +
+              ('activation_energy', 'ln_prefactor', 'r_squared', 'n_points'))
+    print()
+    print('---- Arrhenius fits of the {} ----'.format(fit_feature))
+    for fit in arrhenius_fits:
+        print('Alchol {} ({} mmol/L, {} at {} V/s): Ea = {:.1f} kJ/mol, R2 = {:.3f}, {} points'.format(
+            fit['valve_position'], fit['concentration_anolyte'], fit['technique'], fit['sr'], fit['activation_energy'], fit['r_squared'], fit['n_points']))
+
+    order_fits = fit_concentration_order(measurements, features, fit_feature)
+    write_csv(os.path.join(analysis_folder, 'concentration_orders.csv'), order_fits,
+              ('valve_position', 'temp', 'concentration_catholyte') + FIT_METHOD_FIELDS + ('reaction_order', 'intercept', 'r_squared', 'n_points'))
+    print()
+    print('---- Concentration dependence of the {} ----'.format(fit_feature))
+    for fit in order_fits:
+        print('Alchol {} at {} C ({} at {} V/s): order = {:.2f}, R2 = {:.3f}, {} points'.format(
+            fit['valve_position'], fit['temp'], fit['technique'], fit['sr'], fit['reaction_order'], fit['r_squared'], fit['n_points']))
+
+    print()
+    print('Analysis of {} measurements finished in {:.1f} s, results saved to {}'.format(len(measurements), time.time() - start_time, analysis_folder))
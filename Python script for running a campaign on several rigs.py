@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import sys
+import json
+import math
+import time
+import subprocess
+
+
+
+### Define fuctions ###--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# one rig: a worker process running the measurement script with a rig configuration, on the devices of the rig
+class Rig:
+    def __init__(self, name, settings, folder_path, simulate):
+        self.name = name
+        self.settings = settings  # rig configuration entries: ports, instruments, camera index, ...
+        self.folder_path = folder_path  # data folder of the rig
+        self.simulate = simulate
+        self.process = None
+        self.log_file = None
+        self.n_runs = 0
+        self.points = []  # points assigned to the running process
+        self.failed = False
+        os.makedirs(folder_path, exist_ok=True)
+
+    def start(self, points, campaign_id):
+        # later runs of the rig resume its journal, so the activation of its electrode is not repeated
+        self.n_runs += 1
+        self.points = points
+        config = dict(self.settings, mode='run', name=self.name, simulate=self.simulate, folder=self.folder_path,
+                      bath_model_path=os.path.join(self.folder_path, 'bath_thermal_model.json'),
+                      step_durations_path=os.path.join(self.folder_path, 'step_durations.json'),
+                      run_id='{}_{}_{}'.format(campaign_id, self.name, self.n_runs), resume=self.n_runs > 1, points=points)
+        config_path = os.path.join(self.folder_path, 'rig_config_{}.json'.format(self.n_runs))
+        with open(config_path, 'w') as f:
+            json.dump(config, f, indent=4)
+        self.log_file = open(os.path.join(self.folder_path, 'rig_log_{}.txt'.format(self.n_runs)), 'w')
+        self.process = subprocess.Popen([sys.executable, measurement_script, config_path], cwd=self.folder_path,
+                                        stdout=self.log_file, stderr=subprocess.STDOUT)
+        print('{}: run {} started with {} points'.format(self.name, self.n_runs, len(points)))
+
+    def poll(self):
+        # exit code of the finished process, None while it runs
+        if self.process is None:
+            return None
+        exit_code = self.process.poll()
+        if exit_code is not None:
+            self.process = None
+            self.log_file.close()
+        return exit_code
+
+    def is_running(self):
+        return self.process is not None
+
+    def completed_points(self):
+        # the points journaled as measured by the rig
+        completed = set()
+        journal_path = os.path.join(self.folder_path, 'campaign_journal.jsonl')
+        if os.path.exists(journal_path):
+            with open(journal_path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn write of a crash
+                    if record['step'] == 'point':
+                        completed.add(tuple(record['key']))
+        return completed
+
+
+def run_measurement_script(config, config_path):
+    # run the measurement script in a mode without devices ('plan' or 'merge') and wait for it
+    with open(config_path, 'w') as f:
+        json.dump(config, f, indent=4)
+    subprocess.check_call([sys.executable, measurement_script, config_path])
+
+
+def shard_campaign(groups, n_rigs):
+    # balance the estimated time over the rigs, longest first to the least loaded rig. The groups are the alcohols,
+    # so every rig cleans its electrode once per alcohol; with fewer alcohols than rigs the points are shared instead
+    items = [(group['estimated_time'], group['points']) for group in groups]
+    if len(items) < n_rigs:
+        items = [(group['estimated_time'] / len(group['points']), [point]) for group in groups for point in group['points']]
+    shards = [[0, []] for _ in range(n_rigs)]
+    for estimated_time, points in sorted(items, key=lambda item: -item[0]):
+        shard = min(shards, key=lambda shard: shard[0])
+        shard[0] += estimated_time
+        shard[1].extend(points)
+    return shards
+
+
+def run_campaign(rigs, campaign, campaign_id, poll_interval):
+    # run the shards on the rigs. The incomplete points of a failed rig are shared among the rigs that are idle,
+    # or become idle, until all points are measured or no rig is left
+    for rig, (estimated_time, points) in zip(rigs, shard_campaign(campaign['groups'], len(rigs))):
+        print('{}: {} points, estimated time {:.2f} h'.format(rig.name, len(points), estimated_time / 3600))
+        if points:
+            rig.start(points, campaign_id)
+    pending = []
+    while True:
+        for rig in rigs:
+            exit_code = rig.poll()
+            if exit_code is None:
+                continue
+            completed = rig.completed_points()
+            incomplete = [point for point in rig.points if tuple(point) not in completed]
+            if exit_code != 0:
+                rig.failed = True
+                print('{}: failed with exit code {}, {} points to reassign'.format(rig.name, exit_code, len(incomplete)))
+            elif incomplete:
+                print('{}: finished without {} points, to reassign'.format(rig.name, len(incomplete)))
+            else:
+                print('{}: run {} finished'.format(rig.name, rig.n_runs))
+            pending.extend(incomplete)
+            rig.points = []
+        idle_rigs = [rig for rig in rigs if not rig.failed and not rig.is_running()]
+        if pending and idle_rigs:
+            n_rigs = len([rig for rig in rigs if not rig.failed])
+            share = int(math.ceil(len(pending) / float(n_rigs)))
+            for rig in idle_rigs:
+                if pending:
+                    rig.start(pending[:share], campaign_id)
+                    pending = pending[share:]
+        if not any(rig.is_running() for rig in rigs):
+            return pending
+        time.sleep(poll_interval)
+
+
+
+### Campaign settings ###--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+dir_path = os.path.dirname(os.path.abspath(__file__))
+# The campaign (temperatures, concentrations, alcohols, methods) is defined in the measurement script
+measurement_script = os.path.join(dir_path, 'Python script for automated CV tests at various Temperatures.py')
+
+# The rigs and their devices
+simulate_rigs = False # True: test the coordination locally with simulated rigs
+rigs_settings = [
+    {'name': 'rig_1', 'bath_port': 'COM5', 'fluigent_instruments': None, 'camera_index': 0, 'electrode_id': 'rig_1_electrode_1'},
+    {'name': 'rig_2', 'bath_port': 'COM6', 'fluigent_instruments': None, 'camera_index': 1, 'electrode_id': 'rig_2_electrode_1'},
+]
+
+# Folder of the merged dataset, with a data folder for every rig
+campaign_folder = 'multirig_simulation' if simulate_rigs else 'multirig'
+campaign_folder_path = os.path.join(dir_path, campaign_folder)
+campaign_id = time.strftime('%Y%m%d_%H%M%S')
+poll_interval = 1 #unit: seconds, interval of checking the rig processes
+
+
+
+### Run the campaign on the rigs ###---------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    start_time = time.time()
+    os.makedirs(campaign_folder_path, exist_ok=True)
+
+    ## Plan the campaign and shard it across the rigs
+    plan_path = os.path.join(campaign_folder_path, 'campaign_definition.json')
+    run_measurement_script({'mode': 'plan', 'plan_path': plan_path, 'simulate': simulate_rigs, 'folder': campaign_folder_path},
+                           os.path.join(campaign_folder_path, 'plan_config.json'))
+    with open(plan_path) as f:
+        campaign = json.load(f)
+
+    rigs = [Rig(settings['name'], {key: value for key, value in settings.items() if key != 'name'},
+                os.path.join(campaign_folder_path, settings['name']), simulate_rigs) for settings in rigs_settings]
+
+    ## Run the shards, with failover to the remaining rigs
+    print()
+    print('---- Campaign {}: {} points on {} rigs ----'.format(campaign_id, len(campaign['points']), len(rigs)))
+    unfinished = run_campaign(rigs, campaign, campaign_id, poll_interval)
+
+    ## Merge the measurement stores of the rigs into one dataset
+    print()
+    print('---- Merge the results ----')
+    run_measurement_script({'mode': 'merge', 'simulate': simulate_rigs, 'folder': campaign_folder_path,
+                            'stores': [[rig.name, rig.folder_path] for rig in rigs]},
+                           os.path.join(campaign_folder_path, 'merge_config.json'))
+
+    print()
+    for rig in rigs:
+        print('{}: {} points measured in {} runs{}'.format(rig.name, len(rig.completed_points()), rig.n_runs, ', failed' if rig.failed else ''))
+    if unfinished:
+        print('++++++++++++++++++++++++++')
+        print('{} points not measured, no rig left: {}'.format(len(unfinished), unfinished))
+        print('++++++++++++++++++++++++++')
+    print('Campaign finished in {:.2f} h, results merged into {}'.format((time.time() - start_time) / 3600, campaign_folder_path))
@@ -0,0 +1,57 @@
+import ast
+import importlib.util
+import os
+import types
+
+import pytest
+
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MEASUREMENT_SCRIPT = os.path.join(REPO_PATH, 'Python script for automated CV tests at various Temperatures.py')
+ANALYSIS_SCRIPT = os.path.join(REPO_PATH, 'Python script for batch analysis of CV data.py')
+COORDINATOR_SCRIPT = os.path.join(REPO_PATH, 'Python script for running a campaign on several rigs.py')
+
+
+def load_definitions(path, name):
+    # the measurement script runs the campaign when it is executed, so only its imports, functions, classes
+    # and module constants (upper case names and namedtuples) are loaded
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    body = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef)):
+            body.append(node)
+        elif isinstance(node, ast.Assign) and all(isinstance(target, ast.Name) for target in node.targets):
+            if all(target.id.isupper() for target in node.targets) or \
+                    (isinstance(node.value, ast.Call) and getattr(node.value.func, 'id', None) == 'namedtuple'):
+                body.append(node)
+    module = types.ModuleType(name)
+    module.__file__ = path
+    exec(compile(ast.Module(body=body, type_ignores=[]), path, 'exec'), module.__dict__)
+    return module
+
+
+def load_script(path, name):
+    # scripts with an `if __name__ == '__main__'` guard are imported as they are
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def script():
+    # definitions of the measurement script, on the real clock; tests set the globals the functions use
+    module = load_definitions(MEASUREMENT_SCRIPT, 'measurement_script')
+    module.clock = module.Clock()
+    return module
+
+
+@pytest.fixture(scope='session')
+def analysis():
+    return load_script(ANALYSIS_SCRIPT, 'analysis_script')
+
+
+@pytest.fixture(scope='session')
+def coordinator():
+    return load_script(COORDINATOR_SCRIPT, 'coordinator_script')
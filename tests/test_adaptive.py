@@ -0,0 +1,61 @@
+import math
+
+import pytest
+
+
+def make_sampler(script, cleaning_time, ramp_model=None, max_points=None):
+    n = 5
+    grid = script.build_campaign_grid([1, 2], [20, 30, 40, 50, 60], [1] * n, [1] * n, [100] * n, [100] * n, [100] * n, [100] * n)
+    if ramp_model is None:
+        ramp_model = script.BathRampModel(1e9, 1e9, 0)  # no ramp cost
+    return script.AdaptiveSampler(script.build_candidate_grid(grid), ramp_model, 600, cleaning_time, max_points=max_points)
+
+
+def peak_current(point):
+    # 40 kJ/mol for both alcohols
+    return point.valve_position * 1e3 * math.exp(-40e3 / (8.314 * (point.temp + 273.15)))
+
+
+def run_sampler(sampler, start_temp=20):
+    sequence = []
+    previous_point = None
+    while True:
+        point = sampler.next_point(previous_point, start_temp if previous_point is None else previous_point.temp)
+        if point is None:
+            return sequence
+        sampler.add(point, peak_current(point))
+        sequence.append((point.valve_position, point.temp))
+        previous_point = point
+
+
+def test_sampler_measures_the_temperature_extremes_until_converged(script):
+    sampler = make_sampler(script, cleaning_time=0)
+    assert run_sampler(sampler) == [(1, 20), (2, 20), (1, 60), (2, 60)]
+    for valve_position in (1, 2):
+        ea, ea_std = sampler.activation_energy(valve_position)
+        assert ea == pytest.approx(40, abs=0.01)
+        assert ea_std <= 2
+
+
+def test_cleaning_cost_keeps_the_alcohol(script):
+    sampler = make_sampler(script, cleaning_time=3600)
+    assert run_sampler(sampler) == [(1, 20), (1, 60), (2, 20), (2, 60)]
+
+
+def test_ramp_cost_starts_at_the_bath_temperature(script):
+    sampler = make_sampler(script, cleaning_time=0, ramp_model=script.BathRampModel(1.0, 0.5, 300))
+    assert sampler.next_point(None, 60) == script.CampaignPoint(1, 60, 1, 1, 100, 100, 100, 100)
+
+
+def test_sampler_stops_at_max_points(script):
+    sampler = make_sampler(script, cleaning_time=0, max_points=3)
+    assert len(run_sampler(sampler)) == 3
+
+
+def test_point_without_peak_current_is_not_fitted(script):
+    sampler = make_sampler(script, cleaning_time=0)
+    point = sampler.next_point(None, 20)
+    sampler.add(point, None)
+    assert point in sampler.measured
+    assert sampler.observations == {}
+    assert sampler.next_point(point, 20) != point
@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import pytest
+
+
+def synthetic_cv(peak_potential=0.45, peak_current=2e-5):
+    potentials = np.linspace(0.2, 0.55, 351)
+    currents = 1e-7 + peak_current * np.exp(-((potentials - peak_potential) / 0.03) ** 2)
+    return potentials, currents
+
+
+def write_chi_file(path, potentials, currents, scan_rate=0.002):
+    with open(path, 'w') as f:
+        f.write('Cyclic Voltammetry\nScan Rate (V/s) = {}\n\nPotential/V, Current/A\n\n'.format(scan_rate))
+        for potential, current in zip(potentials, currents):
+            f.write('{:.3f}, {:.4e}\n'.format(potential, current))
+
+
+def condition(valve_position, temp, concentration_anolyte):
+    return {'valve_position': valve_position, 'temp': temp, 'concentration_anolyte': concentration_anolyte,
+            'concentration_catholyte': 0.5, 'technique': 'CV', 'Eini': 0.2, 'Ev1': 0.55, 'Efin': 0.2, 'sr': 0.002}
+
+
+def test_curve_features_of_a_synthetic_cv(analysis):
+    potentials, currents = synthetic_cv()
+    features = analysis.curve_features(np.array([potentials]), np.array([currents]), np.array([0.002]), 1e-6)
+    assert features['peak_potential'][0] == pytest.approx(0.45)
+    assert features['peak_current'][0] == pytest.approx(2e-5 + 1e-7)
+    assert 0.35 < features['onset_potential'][0] < 0.45
+    # the gaussian wave holds 2e-5 A * 0.03 V * sqrt(pi), over the scan rate
+    assert features['charge'][0] == pytest.approx((2e-5 * 0.03 * np.sqrt(np.pi) + 1e-7 * 0.35) / 0.002, rel=1e-3)
+
+
+def test_curve_without_onset(analysis):
+    potentials = np.array([np.linspace(0.2, 0.55, 36)])
+    features = analysis.curve_features(potentials, np.full((1, 36), 1e-7), np.array([0.002]), 1e-6)
+    assert np.isnan(features['onset_potential'][0])
+
+
+def test_analyse_files_reads_the_chi_files(analysis, tmp_path):
+    path = str(tmp_path / '1_200mV_550mV_2mVs_30oC.txt')
+    write_chi_file(path, *synthetic_cv())
+    results = analysis.analyse_files([path, str(tmp_path / 'missing.txt')], 1e-6)
+    assert list(results) == [path]
+    assert results[path]['peak_potential'] == pytest.approx(0.45)
+    assert len(results[path]['hash']) == 64
+
+
+def test_feature_cache_follows_the_file_content(analysis, tmp_path):
+    path = str(tmp_path / 'cv.txt')
+    write_chi_file(path, *synthetic_cv())
+    cache = analysis.FeatureCache(str(tmp_path / 'cache.json'))
+    cache.store(path, analysis.analyse_files([path], 1e-6)[path])
+    cache.save()
+    cache = analysis.FeatureCache(str(tmp_path / 'cache.json'))
+    assert cache.lookup(path)['peak_potential'] == pytest.approx(0.45)
+
+    write_chi_file(path, *synthetic_cv(peak_potential=0.5))
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert cache.lookup(path) is None
+    result = analysis.analyse_files([path], 1e-6)[path]
+    cache.store(path, result)
+    assert cache.lookup(path)['peak_potential'] == pytest.approx(0.5)
+    assert len(cache.features) == 2  # both contents stay cached under their hash
+
+
+def test_fit_arrhenius_recovers_the_activation_energy(analysis):
+    measurements, features = [], {}
+    for temp in (20, 30, 40, 50):
+        file_path = 'cv_{}.txt'.format(temp)
+        measurements.append((file_path, condition(1, temp, 1.0)))
+        features[file_path] = {'peak_current': 1e3 * np.exp(-40e3 / (analysis.GAS_CONSTANT * (temp + 273.15)))}
+    fits = analysis.fit_arrhenius(measurements, features)
+    assert len(fits) == 1
+    assert fits[0]['activation_energy'] == pytest.approx(40)
+    assert fits[0]['r_squared'] == pytest.approx(1)
+    assert fits[0]['n_points'] == 4
+
+
+def test_fit_concentration_order_recovers_the_order(analysis):
+    measurements, features = [], {}
+    for concentration in (0.25, 0.5, 1.0):
+        file_path = 'cv_{}.txt'.format(concentration)
+        measurements.append((file_path, condition(2, 30, concentration)))
+        features[file_path] = {'peak_current': 1e-5 * concentration ** 0.7}
+    measurements.append(('cv_none.txt', condition(2, 30, 2.0)))  # no features: left out
+    fits = analysis.fit_concentration_order(measurements, features)
+    assert len(fits) == 1
+    assert fits[0]['reaction_order'] == pytest.approx(0.7)
+    assert fits[0]['n_points'] == 3
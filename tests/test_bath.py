@@ -0,0 +1,57 @@
+import pytest
+
+
+def make_bath(script, temp=20.0):
+    emulator = script.SC150Emulator(temp)
+    return script.SC150Bath(emulator), emulator
+
+
+def test_read_temperature_and_setpoint(script):
+    bath, emulator = make_bath(script, 23.5)
+    assert bath.read_temperature() == pytest.approx(23.5)
+    assert bath.read_setpoint() == pytest.approx(23.5)
+
+
+def test_setpoint_is_cached(script):
+    bath, emulator = make_bath(script)
+    bath.set_setpoint(30)
+    assert emulator.setpoint == 30
+    emulator.setpoint = 25  # changed behind the driver: the same setpoint is not sent again
+    bath.set_setpoint(30)
+    assert emulator.setpoint == 25
+    bath.set_setpoint(31)
+    assert emulator.setpoint == 31
+
+
+def test_command_retries_after_timeout(script):
+    bath, emulator = make_bath(script, 21.0)
+    replies = iter([b'', b'21.00C\r'])
+    emulator.readline = lambda: next(replies)
+    assert bath.read_temperature() == pytest.approx(21.0)
+
+
+def test_command_gives_up_after_retries(script):
+    bath, emulator = make_bath(script)
+    emulator.readline = lambda: b'garbage\r'
+    with pytest.raises(script.BathError):
+        bath.read_temperature()
+
+
+def test_set_commands_are_acknowledged(script):
+    bath, emulator = make_bath(script)
+    bath.set_setpoint(35)
+    bath.turn_on()
+    assert emulator.setpoint == 35
+    assert emulator.running
+    assert bath.running
+
+
+def test_rejected_setpoint_is_not_cached(script):
+    bath, emulator = make_bath(script)
+    emulator.readline = lambda: b'F001\r'
+    with pytest.raises(script.BathError, match='F001'):
+        bath.set_setpoint(35)
+    assert bath.setpoint is None
+    with pytest.raises(script.BathError):
+        bath.turn_on()
+    assert not bath.running
@@ -0,0 +1,72 @@
+import math
+
+import pytest
+
+
+def first_order_ramp(start_temp, setpoint, time_constant, duration, interval=2, release=None, target=None):
+    # (time, temperature, setpoint) readings of the bath, at the resolution of 0.01 C; the setpoint is set
+    # back to `target` at `release` seconds
+    log = []
+    temp = start_temp
+    for k in range(int(duration / interval) + 1):
+        t = k * interval
+        if release is not None and t >= release:
+            setpoint = target
+        log.append((t, round(temp, 2), setpoint))
+        temp = setpoint + (temp - setpoint) * math.exp(-interval / time_constant)
+    return log
+
+
+def test_learned_model_reproduces_the_ramp(script, tmp_path):
+    model = script.BathThermalModel()
+    log = first_order_ramp(20, 40, 300, 1200)
+    assert model.learn(log) == pytest.approx(300, rel=0.05)
+    assert model.time_constant == pytest.approx(300, rel=0.05)
+    # the learned model predicts when the logged ramp reached 39 C
+    reached = next(t for t, temp, setpoint in log if temp >= 39)
+    assert model.time_to_reach(20, 40, 39) == pytest.approx(reached, abs=10)
+
+    model.save(str(tmp_path / 'model.json'))
+    loaded = script.BathThermalModel.load(str(tmp_path / 'model.json'))
+    assert (loaded.time_constant, loaded.n_ramps) == (model.time_constant, 1)
+
+
+def test_model_learns_from_a_boosted_ramp(script):
+    model = script.BathThermalModel(time_constant=600, n_ramps=5)
+    estimate = model.learn(first_order_ramp(40, 20, 200, 900, release=300, target=25))
+    assert estimate == pytest.approx(200, rel=0.05)
+    assert model.time_constant == pytest.approx((600 * 5 + estimate) / 6)  # running average over the ramps
+
+
+def test_model_does_not_learn_without_a_ramp(script):
+    model = script.BathThermalModel()
+    assert model.learn(first_order_ramp(30, 30, 300, 600)) is None
+    assert model.n_ramps == 0
+
+
+def test_boost_respects_the_clamp(script):
+    controller = script.BathRampController(script.BathThermalModel(300), 5, 5, 45, 30)
+    assert controller.boost_setpoint(20, 30, 0.1) == 35
+    assert controller.boost_setpoint(28, 30, 0.1) == 32  # no more overdrive than the step
+    assert controller.boost_setpoint(20, 42, 0.1) == 45  # clamped to the largest setpoint
+    assert controller.boost_setpoint(30, 8, 0.1) == 5  # clamped to the smallest setpoint
+    assert controller.boost_setpoint(29.95, 30, 0.1) == 30  # within the tolerance
+
+
+def test_boost_is_released_before_the_target(script):
+    controller = script.BathRampController(script.BathThermalModel(300), 5, 5, 45, 30)
+    assert not controller.should_release(20, 35, 30)
+    # 30 s before the model reaches the target at the boosted setpoint
+    temp = 35 - 5 * math.exp(30 / 300)
+    assert controller.should_release(temp + 0.01, 35, 30)
+    assert not controller.should_release(temp - 0.1, 35, 30)
+    assert controller.should_release(31, 35, 30)  # past the target
+
+
+def test_boosted_ramp_saves_time(script):
+    model = script.BathThermalModel(300)
+    controller = script.BathRampController(model, 5, 5, 45, 30)
+    saving = controller.predicted_saving(20, 30, 0.1, 35)
+    assert saving == pytest.approx(model.time_to_reach(20, 30, 29.9) - model.time_to_reach(20, 35, 29.9))
+    assert saving > 0
+    assert controller.predicted_saving(20, 30, 0.1, 30) == 0
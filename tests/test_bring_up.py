@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+
+def make_bring_up(script, probes, timeout=1):
+    # devices named after their probes; returns the bring-up and the names of the closed devices
+    bring_up = script.DeviceBringUp(timeout)
+    closed = []
+    for name, probe in probes.items():
+        bring_up.add(name, lambda name=name: name + ' device', probe, closed.append)
+    return bring_up, closed
+
+
+def test_all_devices_ready(script, capsys):
+    bring_up, closed = make_bring_up(script, {'Bath': lambda device: '20.0 C', 'Pumps': lambda device: '0 uL/min'})
+    assert bring_up.run() == {'Bath': 'Bath device', 'Pumps': 'Pumps device'}
+    assert closed == []
+    assert 'ready, 20.0 C' in capsys.readouterr().out
+
+
+def test_failed_probe_closes_the_ready_devices(script, capsys):
+    def failing_probe(device):
+        raise IOError('no reply')
+    bring_up, closed = make_bring_up(script, {'Bath': failing_probe, 'Pumps': lambda device: '0 uL/min'})
+    with pytest.raises(script.DeviceError, match='Devices not ready: Bath'):
+        bring_up.run()
+    assert sorted(closed) == ['Bath device', 'Pumps device']  # the failed device was connected, it is closed too
+    assert 'FAILED: OSError: no reply' in capsys.readouterr().out
+
+
+def test_failed_connect_is_not_closed(script):
+    bring_up = script.DeviceBringUp(1)
+    closed = []
+    def failing_connect():
+        raise IOError('port busy')
+    bring_up.add('Bath', failing_connect, lambda device: 'ok', closed.append)
+    bring_up.add('Pumps', lambda: 'Pumps device', lambda device: 'ok', closed.append)
+    with pytest.raises(script.DeviceError, match='Devices not ready: Bath'):
+        bring_up.run()
+    assert closed == ['Pumps device']
+
+
+def test_hanging_probe_times_out(script, capsys):
+    release = threading.Event()
+    bring_up, closed = make_bring_up(script, {'Camera': lambda device: release.wait(10), 'Pumps': lambda device: '0 uL/min'}, timeout=0.2)
+    try:
+        with pytest.raises(script.DeviceError, match='Devices not ready: Camera'):
+            bring_up.run()
+    finally:
+        release.set()
+    assert closed == ['Pumps device']
+    assert 'NO ANSWER within 0 s' in capsys.readouterr().out
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+
+def frame(bubble=False):
+    image = np.full((40, 40, 3), 100, dtype=np.uint8)
+    if bubble:
+        image[10:20, 10:20] = 200  # 100 of the 1600 pixels, the opening removes the 4 corners
+    return image
+
+
+def test_clean_frames_score_zero(script):
+    detector = script.BubbleDetector(None, 30, 3, 5)
+    for _ in range(10):
+        detector(frame())
+    assert detector.score() == 0
+
+
+def test_bubble_coverage(script):
+    detector = script.BubbleDetector(None, 30, 3, 5)
+    for _ in range(3):
+        detector(frame())
+    for _ in range(5):
+        detector(frame(bubble=True))
+    assert detector.score() == pytest.approx(96 / 1600)
+
+
+def test_roi_limits_the_analysed_region(script):
+    detector = script.BubbleDetector((0, 20, 0, 20), 30, 1, 1)
+    detector(frame())
+    detector(frame(bubble=True))
+    assert detector.score() == pytest.approx(96 / 400)
+
+
+def test_background_is_kept_across_recordings(script):
+    # a bubble trapped in the first recording of a point is still scored in the next one
+    detector = script.BubbleDetector(None, 30, 3, 5)
+    for _ in range(3):
+        detector(frame())
+    detector(frame(bubble=True))
+    detector.reset()
+    for _ in range(5):
+        detector(frame(bubble=True))
+    assert detector.score() == pytest.approx(96 / 1600)
+
+
+def test_background_is_learned_again_after_a_purge(script):
+    detector = script.BubbleDetector(None, 30, 3, 5)
+    for _ in range(3):
+        detector(frame())
+    detector.reset_background()
+    detector.reset()
+    for _ in range(3):
+        detector(np.full((40, 40, 3), 150, dtype=np.uint8))  # e.g. another electrolyte
+    detector(np.full((40, 40, 3), 150, dtype=np.uint8))
+    assert detector.score() == 0
+
+
+def test_air_columns_follow_the_score(script):
+    script.bubble_score_threshold = 0.01
+    script.bubble_score_heavy = 0.05
+    assert script.bubble_purge_air_columns(None) == 1
+    assert script.bubble_purge_air_columns(0.001) == 0
+    assert script.bubble_purge_air_columns(0.02) == 1
+    assert script.bubble_purge_air_columns(0.1) == 2
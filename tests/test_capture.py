@@ -0,0 +1,59 @@
+import threading
+
+import numpy as np
+import pytest
+
+
+def make_pipeline(script, tmp_path, pool_size=4, frame_analyzer=None, analysis_stride=1, **latencies):
+    camera = script.FakeCamera(width=32, height=24, seed=0, **latencies)
+    camera.start_record(str(tmp_path / 'video.mp4'), 20)
+    return camera, script.CapturePipeline(camera, camera.frame_buffer_size, pool_size, frame_analyzer, analysis_stride)
+
+
+def test_fast_stages_keep_every_frame(script, tmp_path):
+    camera, pipeline = make_pipeline(script, tmp_path, acquire_time=0.001, process_time=0.002, encode_time=0.002)
+    stats = pipeline.run(0.5, 20)
+    camera.stop_record()
+    assert stats['frames'] == 10
+    assert stats['dropped'] == 0 and stats['errors'] == 0
+    assert np.diff(stats['frame_times']) == pytest.approx(np.full(9, 0.05), abs=0.02)
+    with open(str(tmp_path / 'video.mp4')) as f:
+        assert len(f.readlines()) == 10  # one line per encoded frame
+
+
+def test_slow_encoding_drops_frames(script, tmp_path):
+    camera, pipeline = make_pipeline(script, tmp_path, pool_size=2, acquire_time=0.001, process_time=0.001, encode_time=0.1)
+    stats = pipeline.run(1, 20)
+    camera.stop_record()
+    assert stats['dropped'] > 0
+    assert stats['frames'] + stats['dropped'] == 20  # every frame slot is either encoded or counted as dropped
+    assert stats['frames'] <= 1 / 0.1 + 2  # the encoder limits the rate, plus the frames in the pool
+    assert stats['frame_times'] == sorted(stats['frame_times'])
+
+
+def test_slow_acquisition_skips_the_missed_slots(script, tmp_path):
+    camera, pipeline = make_pipeline(script, tmp_path, acquire_time=0.12, process_time=0.001, encode_time=0.001)
+    stats = pipeline.run(1, 20)
+    camera.stop_record()
+    assert stats['frames'] + stats['dropped'] >= 20
+    assert stats['frames'] <= 9
+    assert np.all(np.diff(stats['frame_times']) >= 0.1)
+
+
+def test_stop_event_ends_the_recording(script, tmp_path):
+    camera, pipeline = make_pipeline(script, tmp_path, acquire_time=0.001, process_time=0.001, encode_time=0.001)
+    stop_event = threading.Event()
+    threading.Timer(0.2, stop_event.set).start()
+    stats = pipeline.run(10, 20, stop_event)
+    camera.stop_record()
+    assert 2 <= stats['frames'] <= 6
+
+
+def test_every_stride_frame_is_analysed(script, tmp_path):
+    analysed = []
+    camera, pipeline = make_pipeline(script, tmp_path, frame_analyzer=lambda frame: analysed.append(frame.shape), analysis_stride=3,
+                                     acquire_time=0.001, process_time=0.001, encode_time=0.001)
+    stats = pipeline.run(0.5, 20)
+    camera.stop_record()
+    assert stats['frames'] == 10
+    assert analysed == [(24, 32, 3)] * 4  # frames 0, 3, 6 and 9
@@ -0,0 +1,66 @@
+import sys
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def virtual_clock(script):
+    switch_interval = sys.getswitchinterval()
+    script.clock = script.VirtualClock(1000)
+    yield script.clock
+    sys.setswitchinterval(switch_interval)
+
+
+def test_sleep_ends_at_its_end_time(virtual_clock):
+    start = virtual_clock.monotonic()
+    virtual_clock.sleep(10)
+    assert virtual_clock.monotonic() - start >= 10
+    assert virtual_clock.monotonic() - start < 10 + 2 * virtual_clock.max_real_step * virtual_clock.speed
+
+
+def test_wait_returns_when_the_event_is_set(virtual_clock):
+    event = threading.Event()
+    threading.Timer(0.05, event.set).start()
+    assert virtual_clock.wait(event, 1e6)
+    assert virtual_clock.monotonic() < 1e6
+
+
+def test_wait_times_out(virtual_clock):
+    event = threading.Event()
+    start = virtual_clock.monotonic()
+    assert not virtual_clock.wait(event, 5)
+    assert virtual_clock.monotonic() - start >= 5
+
+
+def test_stalled_process_does_not_skip_virtual_time(virtual_clock):
+    # the ticker cannot run while the process is stalled, then steps by at most `max_real_step` of real time
+    virtual_clock.sleep(1)
+    start = virtual_clock.monotonic()
+    with virtual_clock.lock:
+        time.sleep(0.2)  # 200 s of virtual time at 1000 times real time
+    assert virtual_clock.monotonic() - start < 5
+
+
+def test_sampling_loop_keeps_its_interval_under_load(virtual_clock):
+    # a sampling thread sleeping 0.5 s sees every sample time, although a busy thread competes for the interpreter
+    stop = threading.Event()
+
+    def busy():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy, daemon=True)
+    worker.start()
+    try:
+        times = []
+        for _ in range(50):
+            virtual_clock.sleep(0.5)
+            times.append(virtual_clock.monotonic())
+    finally:
+        stop.set()
+        worker.join()
+    steps = [later - earlier for earlier, later in zip(times[:-1], times[1:])]
+    assert min(steps) >= 0.5 - 1e-9
+    assert sum(steps) / len(steps) < 2
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+
+def write_cv(script, path, potentials, currents):
+    script.write_chi_text_file(path, 'Cyclic Voltammetry', 'CV', [('Scan Rate (V/s)', 0.1)], potentials, currents)
+
+
+def test_watcher_publishes_the_final_features(script, tmp_path):
+    path = str(tmp_path / 'cv.txt')
+    potentials = np.linspace(0, 0.6, 61)
+    currents = 1e-6 * np.exp(-((potentials - 0.5) / 0.05) ** 2)
+    published = []
+    watcher = script.CVDataWatcher(path, {'measurement': 'cv'}, 0.1, lambda metadata, features, final: published.append(final), 1e-7)
+    watcher.start()
+    write_cv(script, path, potentials, currents)  # a file written before the watcher started would be ignored
+    features = watcher.stop()
+    assert features['peak_potential'] == pytest.approx(0.5)
+    assert published[-1] is True
+    assert not watcher.thread.is_alive()
+
+
+def test_watcher_of_a_failed_cv_only_stops(script, tmp_path):
+    published = []
+    watcher = script.CVDataWatcher(str(tmp_path / 'missing.txt'), {'measurement': 'cv'}, 0.1,
+                                   lambda metadata, features, final: published.append(final), 1e-7)
+    watcher.start()
+    assert watcher.stop(final=False) is None
+    assert published == []
+    assert not watcher.thread.is_alive()
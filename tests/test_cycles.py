@@ -0,0 +1,67 @@
+import types
+
+import numpy as np
+import pytest
+
+
+def cycle(amplitude, n=50):
+    # one cycle from 0.2 V to 0.6 V and back, with a peak of `amplitude` on the forward sweep
+    forward = np.linspace(0.2, 0.6, n, endpoint=False)
+    backward = np.linspace(0.6, 0.2, n, endpoint=False)
+    potentials = np.concatenate([forward, backward])
+    currents = np.concatenate([amplitude * np.exp(-((forward - 0.45) / 0.05) ** 2), -0.1 * np.ones(n)])
+    return potentials, currents
+
+
+def test_split_cycles_at_the_reversals(script):
+    cycles = [cycle(amplitude) for amplitude in (1.0, 2.0, 3.0)]
+    potentials = np.concatenate([c[0] for c in cycles] + [[0.2]])
+    currents = np.concatenate([c[1] for c in cycles] + [[-0.1]])
+    split = script.split_cycles(potentials, currents)
+    assert len(split) == 3
+    assert [np.max(c[1]) for c in split] == pytest.approx([1.0, 2.0, 3.0], rel=1e-2)
+    assert split[0][0][0] == pytest.approx(0.2)
+
+
+def test_cycle_convergence(script):
+    drift, correlation = script.cycle_convergence(cycle(1.0), cycle(1.0))
+    assert drift == 0 and correlation == pytest.approx(1)
+    drift, correlation = script.cycle_convergence(cycle(1.0), cycle(1.1))
+    assert drift == pytest.approx(0.1, rel=1e-3)
+    assert script.cycle_convergence(cycle(0.0), cycle(1.0))[0] == float('inf')
+
+
+def stub_potentiostat(script, folder, amplitude):
+    # CVs whose peak current is amplitude(cycle number), counted over all CVs run
+    cycles_run = []
+    class StubCV:
+        def __init__(self, Eini, Ev1, Ev2, Efin, sr, dE, nSweeps, sens, fileName, header):
+            self.nSweeps, self.fileName = nSweeps, fileName
+        def run(self):
+            cycles = []
+            for _ in range(self.nSweeps // 2):
+                cycles.append(cycle(amplitude(len(cycles_run))))
+                cycles_run.append(1)
+            script.write_chi_text_file(str(folder / (self.fileName + '.txt')), 'Cyclic Voltammetry', 'CV', [('Scan Rate (V/s)', 0.1)],
+                                       np.concatenate([c[0] for c in cycles] + [[0.2]]), np.concatenate([c[1] for c in cycles] + [[-0.1]]))
+    script.hp = types.SimpleNamespace(potentiostat=types.SimpleNamespace(CV=StubCV))
+    script.folder_path = str(folder)
+    script.cleaning_chunk_sweeps = 4
+    script.cleaning_min_sweeps = 8
+    script.cleaning_max_drift = 0.01
+    script.cleaning_min_correlation = 0.999
+
+
+def test_cvs_stop_once_converged(script, tmp_path):
+    stub_potentiostat(script, tmp_path, lambda n: 1 + 0.5 ** n)  # the peak drifts by less than 1% from the 6th cycle
+    data_file_paths, potentials, currents, n_sweeps = script.run_converging_cvs(0.2, 0.6, 0.2, 0.2, 0.1, 0.008, 40, 1e-4, 'clean', 'CV')
+    assert n_sweeps == 16
+    assert len(data_file_paths) == 4
+    assert len(potentials) == len(currents) == 4 * (4 * 50 + 1)
+
+
+def test_cvs_stop_at_the_largest_number_of_sweeps(script, tmp_path):
+    stub_potentiostat(script, tmp_path, lambda n: 1 + 0.05 * n)  # the peak keeps growing
+    data_file_paths, potentials, currents, n_sweeps = script.run_converging_cvs(0.2, 0.6, 0.2, 0.2, 0.1, 0.008, 10, 1e-4, 'clean', 'CV')
+    assert n_sweeps == 10
+    assert len(data_file_paths) == 3  # chunks of 4, 4 and 2 sweeps
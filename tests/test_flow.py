@@ -0,0 +1,123 @@
+import time
+
+import pytest
+
+
+def make_flow_controller(script, concurrent=False, time_constant=0.01, noise=0):
+    script.clock = script.Clock()
+    fluigent = script.SimulatedFluigent(time_constant=time_constant, noise=noise, seed=0)
+    controller = script.FlowController(fluigent.fgt_set_sensorRegulation, fluigent.fgt_set_sensorRegulationResponse,
+                                       fluigent.fgt_get_sensorValue, ('A1', 'A2', 'B1', 'B2'), 1, concurrent)
+    return controller, fluigent
+
+
+def test_set_dilution_splits_the_total_flow(script):
+    controller, fluigent = make_flow_controller(script)
+    controller.set_dilution(400, 0.25, 200, 1.0)
+    assert fluigent.setpoints == [100, 300, 200, 0]
+
+
+def test_close_shuts_down_the_pool(script):
+    controller, fluigent = make_flow_controller(script, concurrent=True)
+    controller.set_all(100)
+    controller.close()
+    with pytest.raises(RuntimeError):
+        controller.read()
+
+
+def test_close_safely_goes_on_after_a_failure(script, capsys):
+    closed = []
+
+    def fail():
+        raise OSError('port closed')
+
+    script.close_safely('bath', fail)
+    script.close_safely('camera', closed.append, 'camera')
+    assert closed == ['camera']
+    assert 'Closing bath failed: port closed' in capsys.readouterr().out
+
+
+def make_flow_monitor(script, controller):
+    return script.FlowMonitor(controller.read, controller.channel_names, 0.01, 0.1, 0.05, 5, 50)
+
+
+def test_wait_until_stable_after_the_flow_response(script):
+    controller, fluigent = make_flow_controller(script, time_constant=0.05)
+    controller.set_all(100)
+    monitor = script.FlowMonitor(controller.read, controller.channel_names, 0.01, 0.1, 0.05, 1, 1)
+    elapsed_time = monitor.wait_until_stable([100] * 4, 5)
+    # within 5 uL/min after 0.15 s, then stable over the window of 0.1 s
+    assert 0.2 <= elapsed_time < 2
+
+
+def test_noisy_flow_is_not_stable(script):
+    controller, fluigent = make_flow_controller(script, noise=20)
+    controller.set_all(100)
+    monitor = script.FlowMonitor(controller.read, controller.channel_names, 0.01, 0.1, 0.5, 1, 5)
+    with pytest.raises(script.FlowError, match='did not converge within 0 s: A1'):
+        monitor.wait_until_stable([100] * 4, 0.3)
+
+
+def test_only_the_required_channels_have_to_be_stable(script):
+    controller, fluigent = make_flow_controller(script)
+    controller.set_flow_rates([100, 100, 100, 50])
+    monitor = make_flow_monitor(script, controller)
+    with pytest.raises(script.FlowError, match='B2 50 uL/min \\(set 100 uL/min\\)'):
+        monitor.wait_until_stable([100] * 4, 0.3)
+    assert monitor.wait_until_stable([100] * 4, 0.3, required=[0, 1, 2]) < 0.3
+
+
+def test_wait_for_volume_integrates_the_flow_rates(script):
+    controller, fluigent = make_flow_controller(script)
+    controller.set_all(6000)  # 100 uL/s
+    monitor = make_flow_monitor(script, controller)
+    elapsed_time, delivered = monitor.wait_for_volume([10, 10, 20, 20], 5)
+    assert all(volume >= needed for volume, needed in zip(delivered, [10, 10, 20, 20]))
+    assert 0.15 <= elapsed_time < 1
+    assert delivered[0] == pytest.approx(elapsed_time * 100, rel=0.2)
+
+
+def test_wait_for_volume_times_out(script):
+    controller, fluigent = make_flow_controller(script)
+    controller.set_flow_rates([6000, 0, 6000, 6000])
+    monitor = make_flow_monitor(script, controller)
+    with pytest.raises(script.FlowError, match='A2'):
+        monitor.wait_for_volume([10, 10, 10, 10], 0.2)
+
+
+def test_wash_does_not_wait_for_lines_without_flow(script):
+    # a dilution of 1 sets the diluent A2 to no flow
+    controller, fluigent = make_flow_controller(script)
+    script.flow_controller = controller
+    script.flow_monitor = make_flow_monitor(script, controller)
+    script.wash_mode = 'volume'
+    script.dead_volumes = {'A1': 5, 'A2': 5, 'B1': 5, 'B2': 5}
+    script.wash_timeout = 2
+    controller.set_dilution(12000, 1.0, 12000, 0.5)
+    script.wash(2, 60)
+
+
+def test_sdk_calls_are_serialised(script):
+    active, overlaps = [], []
+    class SlowSDK:
+        def fgt_get_sensorValue(self, sensor):
+            active.append(sensor)
+            overlaps.append(len(active))
+            time.sleep(0.01)
+            active.remove(sensor)
+            return 0
+    sdk = script.FluigentSDK(SlowSDK(), concurrent=False)
+    controller = script.FlowController(None, None, sdk.function('fgt_get_sensorValue'), ('A1', 'A2', 'B1', 'B2'), 1, True)
+    controller.read()
+    controller.close()
+    assert max(overlaps) == 1
+
+
+def test_state_is_published_for_the_telemetry(script):
+    controller, fluigent = make_flow_controller(script)
+    sdk = script.FluigentSDK(fluigent, concurrent=False)
+    sdk.set_valve_position(0, 3)
+    assert sdk.valve_positions == {0: 3}
+    assert controller.reading is None
+    now, flow_rates = controller.read()
+    assert controller.reading == (now, flow_rates)
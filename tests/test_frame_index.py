@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+
+def test_scan_is_anchored_on_the_data_seen_before_the_return(script):
+    potentials = np.linspace(0.2, 0.3, 101)  # 10 s at 10 mV/s
+    observations = [(102.5, 21), (105.0, 51)]  # points 20 and 50 were taken 2 s and 5 s after the start at 100 s
+    start_time, return_delay = script.anchor_scan(potentials, 0.01, observations, 113.0)
+    assert start_time == pytest.approx(100.0)
+    assert return_delay == pytest.approx(3.0)
+
+
+def test_scan_without_observations_ends_at_the_return(script):
+    potentials = np.linspace(0.2, 0.3, 101)
+    start_time, return_delay = script.anchor_scan(potentials, 0.01, [], 113.0)
+    assert start_time == pytest.approx(103.0)
+    assert return_delay == pytest.approx(0.0)
+
+
+def test_frames_get_the_potential_of_their_time(script):
+    potentials = np.array([0.2, 0.3, 0.2])
+    point_times = script.scan_point_times(potentials, 0.01, 100.0)  # vertex at 110 s, end at 120 s
+    index = script.frame_potential_index([95.0, 105.0, 110.0, 115.0, 125.0], [(point_times, potentials, potentials * 1e-5)])
+    assert np.isnan(index[0, 2]) and np.isnan(index[4, 2])
+    assert index[1:4, 2] == pytest.approx([0.25, 0.3, 0.25])
+    assert index[:, 1] == pytest.approx([0, 10, 15, 20, 30])
+
+
+def test_scan_without_data_is_not_anchored(script):
+    start_time, return_delay = script.anchor_scan(np.array([]), 0.1, [], 10.0)
+    assert start_time == 10.0
+    assert return_delay is None
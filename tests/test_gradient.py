@@ -0,0 +1,36 @@
+import pytest
+
+
+def test_delay_model_follows_a_step_after_the_delay_volume(script):
+    model = script.TransportDelayModel(80, 40, 0)
+    for t in range(0, 60):
+        model.add(t, 0, 600)  # diluent only, 10 uL/s
+    for t in range(60, 120):
+        model.add(t, 600, 0)  # concentrated anolyte only
+    assert model.estimate(59) == 0
+    assert model.estimate(63) == 0  # still the diluent in the delay volume
+    assert model.estimate(66) == pytest.approx(80)
+
+
+def test_delay_model_mixes_in_the_stirred_tank(script):
+    model = script.TransportDelayModel(80, 0, 10)
+    for t in range(0, 30):
+        model.add(t, 0, 600)
+    for t in range(30, 60):
+        model.add(t, 600, 0)
+    assert model.estimate(31) == pytest.approx(80 * (1 - 2.718281828 ** -1), rel=0.01)
+    assert model.estimate(59) == pytest.approx(80, rel=1e-3)
+
+
+def test_delay_model_at_no_flow_keeps_the_concentration(script):
+    model = script.TransportDelayModel(80, 40, 10)
+    for t in range(0, 60):
+        model.add(t, 300, 300)
+    for t in range(60, 120):
+        model.add(t, 0, 0)
+    assert model.estimate(119) == pytest.approx(40)
+
+
+def test_catholyte_fraction(script):
+    assert script.catholyte_fraction(script.CampaignPoint(1, 30, 1, 1, 100, 100, 150, 50)) == 0.75
+    assert script.catholyte_fraction(script.CampaignPoint(1, 30, 1, 1, 100, 100, 0, 0)) == 0  # no catholyte flow
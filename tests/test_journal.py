@@ -0,0 +1,69 @@
+import json
+import os
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def test_recorded_step_is_complete(script, tmp_path):
+    data_path = str(tmp_path / 'point.txt')
+    write(data_path, 'data')
+    journal = script.CampaignJournal(str(tmp_path / 'journal.jsonl'))
+    journal.record('point', (1, 20.0), [data_path])
+    assert journal.is_complete('point', (1, 20.0))
+    assert not journal.is_complete('point', (1, 30.0))
+    assert not journal.is_complete('cleaning', (1, 20.0))
+    journal.close()
+
+
+def test_journal_is_read_back(script, tmp_path):
+    data_path = str(tmp_path / 'point.txt')
+    write(data_path, 'data')
+    journal = script.CampaignJournal(str(tmp_path / 'journal.jsonl'))
+    journal.record('point', (1, 20.0), [data_path])
+    journal.close()
+    with open(str(tmp_path / 'journal.jsonl'), 'a') as f:
+        f.write('{"step": "point", "key": [2')  # torn write of a crash
+    journal = script.CampaignJournal(str(tmp_path / 'journal.jsonl'))
+    assert journal.is_complete('point', (1, 20.0))
+    assert len(journal.records) == 1
+    journal.close()
+
+
+def test_changed_or_deleted_file_repeats_the_step(script, tmp_path):
+    data_path = str(tmp_path / 'point.txt')
+    write(data_path, 'data')
+    journal = script.CampaignJournal(str(tmp_path / 'journal.jsonl'))
+    journal.record('point', (1, 20.0), [data_path])
+    write(data_path, 'other data')
+    assert not journal.is_complete('point', (1, 20.0))
+    os.remove(data_path)
+    assert not journal.is_complete('point', (1, 20.0))
+    journal.close()
+
+
+def test_file_never_written_repeats_the_step(script, tmp_path):
+    data_path = str(tmp_path / 'point.txt')
+    write(data_path, 'data')
+    journal = script.CampaignJournal(str(tmp_path / 'journal.jsonl'))
+    journal.record('point', (1, 20.0), [data_path, str(tmp_path / 'point.mp4')])
+    assert not journal.is_complete('point', (1, 20.0))
+    journal.close()
+    with open(str(tmp_path / 'journal.jsonl')) as f:
+        record = json.loads(f.readline())
+    assert record['files'] == {'point.txt': script.file_checksum(data_path), 'point.mp4': None}
+
+
+def test_archive_starts_a_new_journal(script, tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = script.CampaignJournal(path)
+    journal.record('point', (1, 20.0))
+    journal.close()
+    script.CampaignJournal.archive(path)
+    assert not os.path.exists(path)
+    assert len(os.listdir(str(tmp_path))) == 1
+    journal = script.CampaignJournal(path)
+    assert not journal.is_complete('point', (1, 20.0))
+    journal.close()
@@ -0,0 +1,50 @@
+import pytest
+
+
+def make_grid(script, n_alcohols=8, temps=(20, 30, 40, 50, 60)):
+    n = len(temps)
+    return script.build_campaign_grid(list(range(1, n_alcohols + 1)), list(temps), [1] * n, [1] * n,
+                                      [100] * n, [100] * n, [100] * n, [100] * n)
+
+
+def test_campaign_costs_count_ramps_and_cleanings(script):
+    model = script.BathRampModel(1.0, 0.5, 0)
+    plan = script.order_campaign(make_grid(script, 2, (20, 30)), 'alcohol_serpentine', 20)
+    ramp_time, n_cleanings = script.campaign_costs(plan, model, 20, 20)
+    assert ramp_time == pytest.approx(10 * 60 + 20 * 60)
+    assert n_cleanings == 2
+
+
+def test_cleaning_cost_is_in_the_objective(script):
+    model = script.BathRampModel(1.0, 0.5, 300)
+    grid = make_grid(script)
+    plan, _ = script.plan_campaign(grid, model, 20, 20, 600, 250)
+    assert [point.temp for point in plan[:8]] == [20] * 8
+    # with a long cleaning, grouping by alchol is cheaper than cleaning at every point
+    plan, _ = script.plan_campaign(grid, model, 20, 20, 600, 4 * 3600)
+    _, n_cleanings = script.campaign_costs(plan, model, 20, 20)
+    assert n_cleanings == 8
+
+
+def test_planner_picks_the_shortest_estimate(script):
+    model = script.BathRampModel(1.0, 0.5, 300)
+    grid = make_grid(script)
+    _, best_time = script.plan_campaign(grid, model, 20, 20, 600, 250)
+    for strategy in ('alcohol_ascending', 'alcohol_serpentine', 'temperature_grouped'):
+        plan = script.order_campaign(grid, strategy, 20)
+        assert best_time <= script.estimate_campaign_time(plan, model, 20, 20, 600, 250)
+
+
+def test_step_durations_are_learned_from_the_spans(script, tmp_path):
+    model = script.StepDurationModel({'wash': 120, 'measure': 175, 'cleaning': 440})
+    spans = [('wash', 1, 20, 0, 100), ('wash', 2, 20, 200, 320), ('measure', 1, 20, 100, 280), ('equilibrate', None, 20, 0, 900)]
+    assert model.learn(spans) == {'wash': 110, 'measure': 180}
+    assert [model.duration(phase) for phase in ('wash', 'measure', 'cleaning')] == [110, 180, 440]
+    model.learn([('wash', 1, 20, 0, 130)])
+    assert model.duration('wash') == pytest.approx(120)  # running average over the campaigns
+    path = str(tmp_path / 'step_durations.json')
+    model.save(path)
+    loaded = script.StepDurationModel.load(path, {'wash': 120, 'measure': 300, 'cleaning': 440})
+    assert loaded.n_runs == 2
+    assert loaded.duration('wash') == pytest.approx(120)
+    assert loaded.duration('measure') == 300  # other methods: the learned duration is dropped
@@ -0,0 +1,46 @@
+import math
+
+import pytest
+
+
+def feed(detector, temps, interval=1.0):
+    start = detector.samples[-1][0] + interval if detector.samples else 0
+    for i, temp in enumerate(temps):
+        detector.add_sample(start + i * interval, temp)
+
+
+def test_settles_in_band(script):
+    detector = script.TemperatureSettleDetector(20.0, 0.1, 0.1, 60)
+    feed(detector, [20.02] * 30)
+    assert not detector.is_settled()
+    feed(detector, [20.02] * 70)
+    assert detector.is_settled()
+
+
+def test_reading_on_the_band_edge_settles(script):
+    # 20.1 - 20.0 is slightly larger than 0.1 in floating point
+    detector = script.TemperatureSettleDetector(20.0, 0.1, 0.1, 60)
+    feed(detector, [20.1] * 100)
+    assert detector.is_settled()
+    assert detector.time_to_settle() == 0
+
+
+def test_reading_outside_the_band_does_not_settle(script):
+    detector = script.TemperatureSettleDetector(20.0, 0.1, 0.1, 60)
+    feed(detector, [20.11] * 100)
+    assert not detector.is_settled()
+
+
+def test_time_to_settle_of_an_approach(script):
+    detector = script.TemperatureSettleDetector(20.0, 0.1, 0.1, 60)
+    feed(detector, [25.0 - 0.05 * i for i in range(31)])  # 3 C/min, 3.5 C away
+    # first order: time constant 70 s, log(3.5 / 0.1) time constants to the band, then the dwell time
+    assert detector.time_to_settle() == pytest.approx(70 * math.log(35) + 60)
+
+
+def test_no_time_to_settle_for_a_stalled_approach(script):
+    detector = script.TemperatureSettleDetector(20.0, 0.1, 0.1, 60)
+    feed(detector, [21.0 - 1e-9 * i for i in range(31)])
+    assert detector.time_to_settle() is None
+    feed(detector, [21.0 - 0.0001 * i for i in range(31)])  # 0.006 C/min, below the smallest rate extrapolated
+    assert detector.time_to_settle() is None
@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+
+def group(estimated_time, points):
+    return {'estimated_time': estimated_time, 'points': points}
+
+
+def test_groups_are_balanced_over_the_rigs(coordinator):
+    groups = [group(5, [[1, 30]]), group(4, [[2, 30]]), group(3, [[3, 30]]), group(2, [[4, 30]])]
+    shards = coordinator.shard_campaign(groups, 2)
+    assert sorted(estimated_time for estimated_time, points in shards) == [7, 7]
+    assert sorted(point for estimated_time, points in shards for point in points) == [[1, 30], [2, 30], [3, 30], [4, 30]]
+
+
+def test_groups_are_not_split_across_rigs(coordinator):
+    groups = [group(6, [[1, 30], [1, 40]]), group(2, [[2, 30], [2, 40]])]
+    shards = coordinator.shard_campaign(groups, 2)
+    assert [points for estimated_time, points in shards] == [[[1, 30], [1, 40]], [[2, 30], [2, 40]]]
+
+
+def test_points_are_shared_with_fewer_groups_than_rigs(coordinator):
+    groups = [group(9, [[1, 30], [1, 40], [1, 50]])]
+    shards = coordinator.shard_campaign(groups, 3)
+    assert [estimated_time for estimated_time, points in shards] == pytest.approx([3, 3, 3])
+    assert all(len(points) == 1 for estimated_time, points in shards)
+
+
+def test_completed_points_skip_a_torn_journal_line(coordinator, tmp_path):
+    rig = coordinator.Rig('rig1', {}, str(tmp_path), True)
+    with open(str(tmp_path / 'campaign_journal.jsonl'), 'w') as f:
+        f.write(json.dumps({'step': 'point', 'key': [1, 30]}) + '\n')
+        f.write(json.dumps({'step': 'cleaning', 'key': [1]}) + '\n')
+        f.write('{"step": "point", "ke')
+    assert rig.completed_points() == {(1, 30)}
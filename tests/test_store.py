@@ -0,0 +1,75 @@
+import json
+import os
+
+import numpy as np
+
+
+def condition(valve_position, temp):
+    return {'valve_position': valve_position, 'temp': temp, 'concentration_anolyte': 1.0}
+
+
+def curve(n, offset=0):
+    potentials = np.linspace(0.2, 0.55, n)
+    return potentials, potentials * 1e-5 + offset
+
+
+def test_appended_curves_are_read_back_after_reopening(script, tmp_path):
+    path = str(tmp_path / 'measurement_store')
+    store = script.MeasurementStore(path)
+    store.append('run1', 'measurement', condition(1, 30), *curve(100), attributes={'data_file': 'a.txt'})
+    store.append('run1', 'cleaning', condition(1, 30), *curve(50, 1e-6))
+    store.close()
+
+    with open(os.path.join(path, 'index.jsonl')) as f:
+        records = [json.loads(line) for line in f]
+    assert [(record['kind'], record['offset'], record['length']) for record in records] == [('measurement', 0, 100), ('cleaning', 100, 50)]
+    assert records[0]['condition'] == condition(1, 30)
+    assert records[0]['attributes'] == {'data_file': 'a.txt'}
+
+    store = script.MeasurementStore(path)
+    potentials, currents = store.curve(store.query('cleaning')[0])
+    assert np.array_equal(potentials, curve(50)[0])
+    assert np.array_equal(currents, curve(50, 1e-6)[1])
+    record = store.append('run2', 'measurement', condition(2, 40), *curve(10))
+    assert (record['chunk'], record['offset']) == (0, 150)  # the reopened store goes on in its last chunk
+    store.close()
+
+
+def test_chunk_rollover(script, tmp_path):
+    store = script.MeasurementStore(str(tmp_path / 'measurement_store'), chunk_points=100)
+    records = [store.append('run1', 'measurement', condition(1, temp), *curve(60, temp)) for temp in (20, 30)]
+    long_record = store.append('run1', 'measurement', condition(1, 40), *curve(250, 40))
+    assert [(record['chunk'], record['offset']) for record in records + [long_record]] == [(0, 0), (1, 0), (2, 0)]
+    for record, temp, n in zip(records + [long_record], (20, 30, 40), (60, 60, 250)):
+        assert np.array_equal(store.curve(record)[1], curve(n, temp)[1])
+    store.close()
+
+
+def test_query_by_condition(script, tmp_path):
+    store = script.MeasurementStore(str(tmp_path / 'measurement_store'))
+    for valve_position in (1, 2):
+        for temp in (30, 40):
+            store.append('run1', 'measurement', condition(valve_position, temp), *curve(5))
+    store.append('run1', 'activation', condition(0, 30), *curve(5))
+    assert [(record['condition']['valve_position'], record['condition']['temp']) for record in store.query('measurement', temp=30)] == [(1, 30), (2, 30)]
+    assert len(store.query(valve_position=2)) == 2
+    assert len(store.query(run_id='run2')) == 0
+    assert len(store.get('run1', 'measurement', condition(2, 40))) == 1
+    store.close()
+
+
+def test_merge_copies_the_rig_stores_once(script, tmp_path, capsys):
+    for rig in ('rig1', 'rig2'):
+        store = script.MeasurementStore(str(tmp_path / rig / 'measurement_store'))
+        store.append('run_' + rig, 'measurement', condition(1, 30), *curve(20), attributes={'data_file': 'a.txt'})
+        store.close()
+    stores = [(rig, str(tmp_path / rig)) for rig in ('rig1', 'rig2')]
+    script.merge_measurement_stores(stores, str(tmp_path / 'merged'))
+    script.merge_measurement_stores(stores, str(tmp_path / 'merged'))
+
+    merged = script.MeasurementStore(str(tmp_path / 'merged' / 'measurement_store'))
+    records = merged.query('measurement')
+    assert sorted(record['attributes']['rig'] for record in records) == ['rig1', 'rig2']
+    assert records[0]['attributes']['data_file'] == os.path.join('..', 'rig1', 'a.txt')
+    assert np.array_equal(merged.curve(records[1])[0], curve(20)[0])
+    merged.close()